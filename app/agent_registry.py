@@ -0,0 +1,356 @@
+from app.config import settings
+from app.wazuh_client import AGENT_FIELDS
+from typing import Dict, Any, List, Optional, Set, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_agent(agent: Dict[str, Any]) -> Dict[str, Any]:
+    """Slim view of an agent for prompt context and the lookup indexes."""
+    os_info = agent.get("os") or {}
+    return {
+        "id": agent.get("id"),
+        "name": agent.get("name"),
+        "ip": agent.get("ip"),
+        "status": agent.get("status"),
+        "os": os_info.get("name", "Unknown") if isinstance(os_info, dict) else str(os_info),
+    }
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance, giving up (returning max_distance + 1) once it can't be <= max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def _digits(text: str) -> List[str]:
+    return re.findall(r"\d+", text)
+
+
+def _token_match(value: str, name: str) -> bool:
+    """
+    Token-boundary check for fuzzy mentions: same letter/digit tokens in the same order, digits
+    identical and words within a small typo distance ("web-srever-01" ~ "web-server-01", but
+    "linux" !~ "linux-db").
+    """
+    value_tokens = re.findall(r"[a-z]+|\d+", value.lower())
+    name_tokens = re.findall(r"[a-z]+|\d+", name.lower())
+    if len(value_tokens) != len(name_tokens):
+        return False
+    for a, b in zip(value_tokens, name_tokens):
+        if a.isdigit() or b.isdigit() or len(b) <= 3:
+            if a != b:
+                return False
+        elif _edit_distance(a, b, max(1, len(b) // 3)) > max(1, len(b) // 3):
+            return False
+    return True
+
+
+# Query words that never name an agent (kept out of fuzzy matching)
+_QUERY_STOPWORDS = {
+    "alert", "alerts", "agent", "agents", "logs", "events", "show", "from", "last", "past", "hours", "days",
+    "minutes", "with", "the", "for", "and", "failed", "login", "logins", "critical", "high", "medium", "low",
+    "today", "yesterday", "week", "server", "host", "machine", "all", "any", "what", "which", "on",
+}
+
+
+class AgentRegistry:
+    """
+    In-memory Wazuh agent inventory shared by the whole server.
+
+    - Refreshed by a background task every `refresh_interval` seconds (started in startup_event)
+    - Stale-while-revalidate: readers always get the current snapshot immediately; if it is
+      older than the interval a refresh is kicked off in the background
+    - Agents are indexed by id, name, IP and OS so lookups are dict hits; names also get a
+      trigram index for fuzzy matching (typos, partial names)
+    - `version` changes whenever the agent list does (used to key the plan cache)
+    - The full AGENT_FIELDS record of each agent is kept for get_agent responses (`record()`)
+    """
+    def __init__(self, refresh_interval: float, retry_interval: float):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.wazuh_client = None
+        self.agents: List[Dict[str, Any]] = []
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self.version = ""
+        self.last_updated = 0.0
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._by_name: Dict[str, Dict[str, Any]] = {}
+        self._by_ip: Dict[str, Dict[str, Any]] = {}
+        self._by_os: Dict[str, List[Dict[str, Any]]] = {}
+        self._trigram_index: Dict[str, List[Dict[str, Any]]] = {}
+        self._trigram_counts: Dict[str, int] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._metrics = {"refreshes": 0, "failures": 0, "stale_reads": 0, "last_error": None}
+
+    # ---------- lifecycle ----------
+
+    def start(self, wazuh_client):
+        """Bind the Wazuh client and start the periodic refresh loop."""
+        self.wazuh_client = wazuh_client
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._loop_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._loop_task = None
+        self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            ok = await self.refresh()
+            await asyncio.sleep(self.refresh_interval if ok else self.retry_interval)
+
+    # ---------- refresh ----------
+
+    async def refresh(self) -> bool:
+        """
+        Refresh the inventory, joining a refresh that is already running.
+        Returns False (and keeps the previous snapshot) if the fetch fails.
+        """
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        return await asyncio.shield(self._refresh_task)
+
+    async def _fetch(self) -> bool:
+        if self.wazuh_client is None:
+            return False
+        try:
+            result = await self.wazuh_client.get_agents(select=AGENT_FIELDS)
+            raw_agents = result.get("agents", [])
+            if not raw_agents and self.agents:
+                # get_agents() swallows API errors and returns an empty list - don't wipe a good inventory
+                raise RuntimeError("Wazuh API returned no agents")
+            self._load([_normalize_agent(agent) for agent in raw_agents], records=raw_agents)
+            self._metrics["refreshes"] += 1
+            self._metrics["last_error"] = None
+            return True
+        except Exception as e:
+            self._metrics["failures"] += 1
+            self._metrics["last_error"] = str(e)
+            logger.error(f"Agent registry refresh failed: {e}")
+            return False
+
+    def _load(self, agents: List[Dict[str, Any]], records: Optional[List[Dict[str, Any]]] = None):
+        """
+        Build new indexes and swap them in together so readers never see a half-built registry.
+        `records` are the agents as fetched (nested "os", version, lastKeepAlive), kept by ID.
+        """
+        records_by_id = {str(record["id"]): record for record in records or [] if record.get("id")}
+        by_id, by_name, by_ip, by_os, trigram_index, trigram_counts = {}, {}, {}, {}, {}, {}
+        for agent in agents:
+            if agent["id"]:
+                by_id[str(agent["id"])] = agent
+            if agent["name"]:
+                by_name[agent["name"].lower()] = agent
+                grams = _trigrams(agent["name"])
+                trigram_counts[agent["name"]] = len(grams)
+                for gram in grams:
+                    trigram_index.setdefault(gram, []).append(agent)
+            if agent["ip"] and agent["ip"].lower() != "any":
+                by_ip[agent["ip"]] = agent
+            by_os.setdefault(agent["os"].lower(), []).append(agent)
+
+        version = hashlib.sha1(json.dumps(agents, sort_keys=True).encode()).hexdigest()[:12]
+        if version != self.version:
+            logger.info(f"Agent registry updated: {len(agents)} agents (version {version})")
+        self.agents = agents
+        self._records = records_by_id
+        self._by_id, self._by_name, self._by_ip, self._by_os = by_id, by_name, by_ip, by_os
+        self._trigram_index, self._trigram_counts = trigram_index, trigram_counts
+        self.version = version
+        self.last_updated = time.time()
+
+    def is_stale(self) -> bool:
+        return time.time() - self.last_updated >= self.refresh_interval
+
+    async def snapshot(self, wazuh_client=None) -> Dict[str, Any]:
+        """
+        Current inventory as {"agents", "last_updated", "version"}.
+        Only the very first load is awaited; afterwards stale data is returned while a
+        background refresh runs.
+        """
+        if self.wazuh_client is None and wazuh_client is not None:
+            self.wazuh_client = wazuh_client
+        if not self.last_updated:
+            await self.refresh()
+        elif self.is_stale():
+            self._metrics["stale_reads"] += 1
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(self._fetch())
+        return {"agents": self.agents, "last_updated": self.last_updated, "version": self.version}
+
+    # ---------- lookups ----------
+
+    def get(self, agent_id: Any) -> Optional[Dict[str, Any]]:
+        """Look up by agent ID; "1" matches "001" like the Wazuh API does."""
+        if agent_id is None:
+            return None
+        agent_id = str(agent_id).strip()
+        agent = self._by_id.get(agent_id)
+        if agent is None and agent_id.isdigit():
+            agent = self._by_id.get(agent_id.zfill(3))
+        return agent
+
+    def record(self, agent_id: Any) -> Optional[Dict[str, Any]]:
+        """Full fetched record of an agent (falls back to the slim view if none was kept)."""
+        agent = self.get(agent_id)
+        if agent is None:
+            return None
+        return self._records.get(str(agent["id"]), agent)
+
+    def by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._by_name.get(str(name).strip().lower())
+
+    def by_ip(self, ip: str) -> Optional[Dict[str, Any]]:
+        return self._by_ip.get(str(ip).strip())
+
+    def by_os(self, os_name: str) -> List[Dict[str, Any]]:
+        return self._by_os.get(str(os_name).strip().lower(), [])
+
+    def resolve(self, value: Any) -> Optional[Dict[str, Any]]:
+        """Find an agent from whatever the user gave: ID, name or IP."""
+        if value is None:
+            return None
+        return self.get(value) or self.by_name(value) or self.by_ip(value)
+
+    def fuzzy(self, value: str, limit: int = 5) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Agents whose name is similar to `value`: trigram Jaccard similarity, with names within
+        a small edit distance once separators are ignored ("webserver01", "web-srever-01" vs
+        "web-server-01") scored 0.9 minus 0.1 per edit. Names whose numbers differ from the
+        value's ("web-02" vs "web-01") are different machines and never match.
+        """
+        value = str(value).strip().lower()
+        grams = _trigrams(value)
+        shared: Dict[str, int] = {}
+        candidates: Dict[str, Dict[str, Any]] = {}
+        for gram in grams:
+            for agent in self._trigram_index.get(gram, ()):
+                shared[agent["name"]] = shared.get(agent["name"], 0) + 1
+                candidates[agent["name"]] = agent
+        compact_value = re.sub(r"[-_.\s]", "", value)
+        max_distance = max(1, len(compact_value) // 5)
+        value_digits = _digits(value)
+        scored = []
+        for name, count in shared.items():
+            if _digits(name) != value_digits:
+                continue
+            score = count / (len(grams) + self._trigram_counts[name] - count)
+            distance = _edit_distance(compact_value, re.sub(r"[-_.\s]", "", name.lower()), max_distance)
+            if distance <= max_distance:
+                score = max(score, 0.9 - 0.1 * distance)
+            scored.append((candidates[name], round(score, 3)))
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit]
+
+    def closest(self, value: Any, threshold: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Exact lookup, else the single best fuzzy name match scoring at least `threshold`
+        (default AGENT_SNAP_THRESHOLD, high enough to only bridge separator/case differences,
+        since this is used to rewrite filters). Ambiguous matches (two agents with the same
+        best score) return None.
+        """
+        agent = self.resolve(value)
+        if agent is not None or value is None:
+            return agent
+        threshold = settings.AGENT_SNAP_THRESHOLD if threshold is None else threshold
+        matches = self.fuzzy(str(value), limit=2)
+        if not matches or matches[0][1] < threshold:
+            return None
+        if len(matches) > 1 and matches[1][1] == matches[0][1]:
+            return None
+        return matches[0][0]
+
+    def _candidates(self, value: str) -> List[Dict[str, Any]]:
+        """Fuzzy matches above AGENT_FUZZY_THRESHOLD that also pass the token-boundary check."""
+        return [agent for agent, score in self.fuzzy(value)
+                if score >= settings.AGENT_FUZZY_THRESHOLD and _token_match(value, agent["name"])]
+
+    def mentioned_in(self, query: str, limit: Optional[int] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Agents a query refers to, in query order, as {"exact": [...], "candidates": [...]}.
+        "exact" are matched by IP, ID (only right after "agent"/"id", so "last 5 hours" doesn't
+        pick agent 005) or name up to case/separators; "candidates" are close fuzzy name
+        matches (typos) the planner may use but should not assume.
+        """
+        limit = limit or settings.AGENT_CONTEXT_MAX
+        raw = [w.strip(".,;:!?'\"()") for w in query.split()]
+        words, previous = [], ""
+        for word in raw:
+            if word.isdigit():
+                if previous.lower() in ("agent", "id", "agent.id"):
+                    words.append(word)
+            elif len(word) >= 2 and word.lower() not in _QUERY_STOPWORDS:
+                words.append(word)
+            previous = word
+        exact: Dict[str, Dict[str, Any]] = {}
+        candidates: Dict[str, Dict[str, Any]] = {}
+        unresolved = []
+        for word in words:
+            if len(word) < 3 and not word.isdigit():
+                unresolved.append(word)   # too short to match alone, may start a pair ("db primary")
+                continue
+            agent = self.resolve(word) if word.isdigit() else self.closest(word)
+            if agent is None:
+                unresolved.append(word)
+                if not word.isdigit():
+                    for candidate in self._candidates(word):
+                        candidates.setdefault(candidate["id"], candidate)
+            else:
+                exact.setdefault(agent["id"], agent)
+        # adjacent unmatched words catch names typed with spaces ("web 01" -> "web-01")
+        for first, second in zip(unresolved, unresolved[1:]):
+            agent = self.closest(f"{first}-{second}")
+            if agent is not None:
+                exact.setdefault(agent["id"], agent)
+            else:
+                for candidate in self._candidates(f"{first}-{second}"):
+                    candidates.setdefault(candidate["id"], candidate)
+        candidates = {agent_id: agent for agent_id, agent in candidates.items() if agent_id not in exact}
+        return {"exact": list(exact.values())[:limit], "candidates": list(candidates.values())[:limit]}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "agents": len(self.agents),
+            "version": self.version,
+            "age_seconds": round(time.time() - self.last_updated, 1) if self.last_updated else None,
+            "stale": self.is_stale(),
+            "refresh_interval": self.refresh_interval,
+            "refreshing": self._refresh_task is not None and not self._refresh_task.done(),
+            "operating_systems": {os_name: len(agents) for os_name, agents in self._by_os.items()},
+            **self._metrics,
+        }
+
+
+agent_registry = AgentRegistry(
+    refresh_interval=settings.AGENT_REGISTRY_REFRESH_INTERVAL,
+    retry_interval=settings.AGENT_REGISTRY_RETRY_INTERVAL,
+)
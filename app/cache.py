@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+import time
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "created_at", "size", "hits")
+
+    def __init__(self, value: Any, expires_at: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.created_at = time.monotonic()
+        self.size = size
+        self.hits = 0
+
+
+class TTLCache:
+    """
+    Small LRU cache with a per-entry TTL and hit/miss counters.
+    Optionally bounded by total size in bytes (callers pass each entry's size to set()).
+    Meant to be used from the event loop only (no locking).
+    """
+    def __init__(self, max_entries: int, ttl: float, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Hashable) -> Optional[_Entry]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key: Hashable):
+        entry = self._data.pop(key)
+        self.total_bytes -= entry.size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        entry.hits += 1
+        self.hits += 1
+        return entry.value
+
+    def age(self, key: Hashable) -> Optional[float]:
+        """Seconds since the entry was stored, or None if absent/expired."""
+        entry = self._lookup(key)
+        return time.monotonic() - entry.created_at if entry else None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, size: int = 0):
+        if self.max_bytes is not None and size > self.max_bytes:
+            if key in self._data:
+                self._remove(key)  # don't keep serving the previous value for this key
+            return  # would evict everything else and still not fit
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = _Entry(value, time.monotonic() + (ttl if ttl is not None else self.ttl), size)
+        self.total_bytes += size
+        while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        if key not in self._data:
+            return False
+        self._remove(key)
+        return True
+
+    def clear(self) -> int:
+        count = len(self._data)
+        self._data.clear()
+        self.total_bytes = 0
+        return count
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Per-entry details (most recently used first) for admin endpoints."""
+        now = time.monotonic()
+        return [
+            {
+                "key": key,
+                "hits": entry.hits,
+                "size_bytes": entry.size,
+                "age_seconds": round(now - entry.created_at, 1),
+                "expires_in_seconds": round(entry.expires_at - now, 1),
+            }
+            for key, entry in reversed(self._data.items())
+            if entry.expires_at > now
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        stats = {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+        if self.max_bytes is not None:
+            stats["total_bytes"] = self.total_bytes
+            stats["max_bytes"] = self.max_bytes
+        return stats
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Literal
+import os
 
 
 class Settings(BaseSettings):
@@ -44,6 +45,19 @@ class Settings(BaseSettings):
         "manager.name",
         "vulnerability.severity",
     ]
+    # _source projection for build_dsl when a plan has no "fields": FIELD_ALLOWLIST
+    # plus what the summarizer reads, minus the bulky SOURCE_EXCLUDES
+    SUMMARY_FIELDS: List[str] = [
+        "id",
+        "rule.groups",
+        "rule.firedtimes",
+        "rule.mitre.id",
+        "syscheck.path",
+        "syscheck.event",
+        "data.vulnerability.cve",
+        "data.vulnerability.severity",
+    ]
+    SOURCE_EXCLUDES: List[str] = ["full_log", "previous_output"]
     TIME_MAX_DAYS: int = 14
     MAX_LIMIT: int = 200
     DEFAULT_TZ: str = "UTC"
@@ -63,9 +77,139 @@ class Settings(BaseSettings):
     # SSL verification (self-signed cert handling)
     WAZUH_VERIFY_SSL: bool = False
 
+    # Outbound HTTP transport (app/http_transport.py). HTTP/2 needs the
+    # optional h2 package; without it clients fall back to HTTP/1.1
+    HTTP2_ENABLED: bool = True
+    WAZUH_API_POOL_MAX_CONNECTIONS: int = 20
+    WAZUH_API_POOL_MAX_KEEPALIVE: int = 10
+    WAZUH_API_KEEPALIVE_EXPIRY: float = 30.0
+
+    # GET /agents pagination - page size (the API caps limit at 100000)
+    # and how many pages are fetched concurrently
+    WAZUH_AGENTS_PAGE_SIZE: int = 500
+    WAZUH_AGENTS_PAGE_CONCURRENCY: int = 4
+
+    # Wazuh API JWT: refreshed this many seconds before its exp claim;
+    # lifetime assumed when the token carries no exp (manager default 900s)
+    WAZUH_TOKEN_REFRESH_MARGIN: float = 60.0
+    WAZUH_TOKEN_DEFAULT_LIFETIME: float = 900.0
+    WAZUH_TOKEN_RETRY_INTERVAL: float = 15.0
+
+    # Indexer client - "async" uses a pooled httpx client, "thread" runs
+    # the blocking opensearch-py client on a bounded thread pool
+    INDEXER_BACKEND: Literal["async", "thread"] = "async"
+    INDEXER_TIMEOUT: float = 30.0
+    INDEXER_CONNECT_TIMEOUT: float = 10.0
+    INDEXER_MAX_RETRIES: int = 2
+    INDEXER_POOL_MAX_CONNECTIONS: int = 50
+    INDEXER_POOL_MAX_KEEPALIVE: int = 20
+    INDEXER_KEEPALIVE_EXPIRY: float = 30.0
+    INDEXER_THREAD_WORKERS: int = 8
+
+    # Indexer result cache. "now"-relative ranges are rounded with OpenSearch
+    # date math to RESULT_CACHE_ROUNDING (s/m/h/d, empty to disable) so
+    # repeated dashboard polls share one cache key
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_TTL: float = 10.0
+    RESULT_CACHE_SIZE: int = 256
+    RESULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESULT_CACHE_ROUNDING: Literal["", "s", "m", "h", "d"] = "m"
+
+    # /query/dsl/batch - max DSL bodies per _msearch request
+    DSL_BATCH_MAX_QUERIES: int = 20
+
+    # /query/dsl/export - PIT + search_after paging
+    EXPORT_PAGE_SIZE: int = 1000
+    EXPORT_MAX_PAGE_SIZE: int = 10000
+    EXPORT_MAX_DOCS: int = 1_000_000
+    EXPORT_PIT_KEEP_ALIVE: str = "2m"
+
     # OpenAI API Key - Required from environment
     OPENAI_API_KEY: str
 
+    # LLM gateway - caps concurrent OpenAI calls; timeouts are per-call
+    # budgets in seconds covering queue wait + request
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_POOL_MAX_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY: float = 30.0
+    LLM_MAX_RETRIES: int = 2
+    LLM_DEFAULT_TIMEOUT: float = 60.0
+    LLM_ROUTER_TIMEOUT: float = 15.0
+    LLM_PLANNER_TIMEOUT: float = 30.0
+    LLM_SUMMARY_TIMEOUT: float = 45.0
+
+    # Summary sampler: deduped, projected documents sent to GPT are capped at
+    # SUMMARY_TOKEN_BUDGET tokens; longer strings (full_log) are cut
+    SUMMARY_TOKEN_BUDGET: int = 3000
+    SUMMARY_MAX_FIELD_CHARS: int = 300
+    # Count tokens with tiktoken (loaded on first use; may download its encoding file).
+    # Set to false on restricted networks to always use the ~4 chars/token estimate
+    TIKTOKEN_ENABLED: bool = True
+    # "stats": local statistics over every hit (levels, top rules/agents/IPs,
+    # histogram) plus a SUMMARY_STATS_SAMPLE_TOKENS example sample;
+    # "sample": sampled documents only
+    SUMMARY_MODE: Literal["stats", "sample"] = "stats"
+    SUMMARY_STATS_SAMPLE_TOKENS: int = 800
+    # Attach the summary aggregation bundle (top rules/agents/IPs, histogram,
+    # rule.level stats) to summarized advanced queries so the statistics cover
+    # the full match set instead of the returned hits
+    SUMMARY_AGGREGATIONS: bool = True
+
+    # Routing cache in front of route_query; the fast classifier answers
+    # unambiguous queries from keyword heuristics without calling GPT
+    ROUTING_CACHE_ENABLED: bool = True
+    ROUTING_CACHE_SIZE: int = 1024
+    ROUTING_CACHE_TTL: float = 3600.0
+    ROUTING_FAST_CLASSIFIER: bool = True
+
+    # Plan cache for parse_query_to_plan. Plans with absolute timestamps are
+    # only reused within the current PLAN_CACHE_TIME_BUCKET (seconds)
+    PLAN_CACHE_ENABLED: bool = True
+    PLAN_CACHE_SIZE: int = 512
+    PLAN_CACHE_MAX_BYTES: int = 2 * 1024 * 1024
+    PLAN_CACHE_TTL: float = 6 * 3600.0
+    PLAN_CACHE_TIME_BUCKET: float = 60.0
+
+    # Deterministic planner for templated queries (severity / time / failed logins /
+    # agent / source IP); anything it doesn't fully understand goes to GPT
+    LOCAL_PLANNER_ENABLED: bool = True
+
+    # Planner prompt retrieval: send the PLANNER_EXAMPLES_K most similar curated examples
+    # (PLANNER_EXAMPLES_PATH, BM25 over a local index built at startup) instead of fixed ones.
+    # PLANNER_SECTIONS_K > 0 also retrieves that many reference sections instead of sending
+    # all of them: fewer prompt tokens, but the static prompt prefix drops below the
+    # 1024 tokens OpenAI needs to cache it, so 0 (all sections, cached) is the default
+    PLANNER_RETRIEVAL: bool = True
+    PLANNER_EXAMPLES_PATH: str = os.path.join(os.path.dirname(__file__), "planner_examples.json")
+    PLANNER_EXAMPLES_K: int = 3
+    PLANNER_SECTIONS_K: int = 0
+
+    # /query/nl planning: "sequential" routes first and then parses the plan,
+    # "speculative" parses the advanced plan concurrently with routing and
+    # cancels it if routing picks SIMPLE_PIPELINE, "combined" asks GPT for
+    # the routing decision and the plan in a single call
+    QUERY_PLANNING_MODE: Literal["sequential", "speculative", "combined"] = "sequential"
+
+    # Agent registry: refreshed in the background every AGENT_REGISTRY_REFRESH_INTERVAL
+    # seconds; reads older than that are served stale while a refresh runs
+    AGENT_REGISTRY_REFRESH_INTERVAL: float = 300.0
+    AGENT_REGISTRY_RETRY_INTERVAL: float = 30.0
+    # Fuzzy agent matching (similarity 0-1): AGENT_FUZZY_THRESHOLD for listing candidate
+    # agents a query may mention in the planner prompt, the much stricter
+    # AGENT_SNAP_THRESHOLD for rewriting an agent filter to a real agent name (0.9 only
+    # bridges case/separator differences); at most AGENT_CONTEXT_MAX agents per prompt
+    AGENT_FUZZY_THRESHOLD: float = 0.5
+    AGENT_SNAP_THRESHOLD: float = 0.9
+    AGENT_CONTEXT_MAX: int = 20
+
+    # Field registry: field types / keyword sub-fields from the _mapping of the newest
+    # index per INDEX_ALLOWLIST pattern, cached on disk for fast restarts and refreshed
+    # in the background
+    FIELD_REGISTRY_REFRESH_INTERVAL: float = 3600.0
+    FIELD_REGISTRY_RETRY_INTERVAL: float = 60.0
+    FIELD_REGISTRY_CACHE_PATH: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache",
+                                                  "field_registry.json")
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -2,6 +2,7 @@ from typing import Dict, Any, List
 from .schemas import WazuhSearchPlan, FilterItem
 from .utils import field_to_term_field
 from .config import settings
+from .hit_stats import HISTOGRAM_MAX_BUCKETS, SUMMARY_AGG_PREFIX, TOP_N
 
 def filter_to_clause(f: FilterItem):
     # convert FilterItem to ES clause
@@ -21,7 +22,48 @@ def filter_to_clause(f: FilterItem):
         return {"bool": {"must_not": {"term": {field: val}}}}
     raise ValueError("unsupported op")
 
-def build_dsl(plan: WazuhSearchPlan) -> Dict[str, Any]:
+def default_source_fields() -> List[str]:
+    excluded = set(settings.SOURCE_EXCLUDES)
+    fields = [f for f in settings.FIELD_ALLOWLIST if f not in excluded]
+    return fields + [f for f in settings.SUMMARY_FIELDS if f not in fields and f not in excluded]
+
+def source_projection(plan: WazuhSearchPlan) -> Dict[str, Any]:
+    """
+    _source includes/excludes for a plan: its own "fields" list or the default projection.
+    Fields fetched via docvalue_fields are left out of _source. ["*"] returns whole documents.
+    """
+    fields = plan.fields or default_source_fields()
+    if "*" in fields:
+        return {"includes": ["*"]}
+    docvalues = set(plan.docvalue_fields or [])
+    return {
+        "includes": [f for f in fields if f not in docvalues],
+        "excludes": [f for f in settings.SOURCE_EXCLUDES if f not in fields],
+    }
+
+def summary_aggregations() -> Dict[str, Any]:
+    """
+    Aggregation bundle feeding the summary statistics (hit_stats.stats_from_aggregations):
+    top rules, agents and source IPs, an alert histogram and rule.level stats over every match.
+    """
+    def terms(field, **sub):
+        agg = {"terms": {"field": field_to_term_field(field), "size": TOP_N}}
+        return {**agg, "aggs": sub} if sub else agg
+
+    p = SUMMARY_AGG_PREFIX
+    return {
+        f"{p}rules": terms("rule.id", description={"top_hits": {"size": 1, "_source": ["rule.description"]}}),
+        f"{p}agents": terms("agent.name"),
+        f"{p}srcips": terms("data.srcip"),
+        f"{p}histogram": {"auto_date_histogram": {"field": "@timestamp", "buckets": HISTOGRAM_MAX_BUCKETS}},
+        f"{p}levels": {"stats": {"field": "rule.level"}},
+    }
+
+def build_dsl(plan: WazuhSearchPlan, summary_aggs: bool = False) -> Dict[str, Any]:
+    """
+    Plan -> OpenSearch query body. summary_aggs attaches the summary aggregation bundle
+    alongside any aggregation the plan asks for (used when the results get summarized).
+    """
     bool_filter = []
     must_not_clauses = []
     # time range
@@ -54,7 +96,7 @@ def build_dsl(plan: WazuhSearchPlan) -> Dict[str, Any]:
         agg = plan.aggregation
         if agg.get("type") == "terms":
             body["aggs"] = {
-                "top_terms": {"terms": {"field": agg["field"], "size": agg.get("size",10)}}
+                "top_terms": {"terms": {"field": field_to_term_field(agg["field"]), "size": agg.get("size",10)}}
             }
             body["size"] = 0
         elif agg.get("type") == "count":
@@ -62,6 +104,20 @@ def build_dsl(plan: WazuhSearchPlan) -> Dict[str, Any]:
     else:
         body["size"] = min(plan.limit or settings.MAX_LIMIT, settings.MAX_LIMIT)
 
+    if summary_aggs:
+        body.setdefault("aggs", {}).update(summary_aggregations())
+
+    # projection - aggregation-only queries return no documents at all
+    if body.get("size") == 0:
+        body["_source"] = False
+    else:
+        body["_source"] = source_projection(plan)
+        if plan.docvalue_fields:
+            body["docvalue_fields"] = [
+                {"field": f, "format": "strict_date_optional_time"} if f in ("@timestamp", "timestamp") else f
+                for f in plan.docvalue_fields
+            ]
+
     # Safety defaults
     body.update({"track_total_hits": False})
     return body
@@ -1,7 +1,21 @@
-from opensearchpy import OpenSearch, RequestsHttpConnection, helpers
+from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy.exceptions import HTTP_EXCEPTIONS, TransportError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from .cache import TTLCache
 from .config import settings
+from .http_transport import create_async_client
+from .serialization import dumps
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import httpx
 import urllib3
 
+logger = logging.getLogger(__name__)
+
 # Disable SSL warnings for self-signed certificates
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -9,28 +23,471 @@ def get_client():
     auth = None
     if settings.OPENSEARCH_USER and settings.OPENSEARCH_PASS:
         auth = (settings.OPENSEARCH_USER, settings.OPENSEARCH_PASS)
-    
+
     client = OpenSearch(
         hosts=[settings.OPENSEARCH_HOST],
         http_auth=auth,
         use_ssl=True,
         verify_certs=False,
         ssl_show_warn=False,
-        timeout=30,
-        max_retries=2,
+        timeout=settings.INDEXER_TIMEOUT,
+        max_retries=settings.INDEXER_MAX_RETRIES,
         retry_on_timeout=True
     )
     return client
 
+# Synchronous client - only used by the "thread" backend
 client = get_client()
 
-def validate_query(indices: str, body: dict):
+
+class AsyncIndexerClient:
+    """
+    Non-blocking OpenSearch client on top of a pooled httpx.AsyncClient.
+    Keeps connections alive between requests so searches don't pay a new TLS handshake each time.
+    """
+    def __init__(self, host: str, username: Optional[str], password: Optional[str]):
+        auth = (username, password) if username and password else None
+        self.client = create_async_client(
+            "indexer",
+            base_url=host.rstrip('/'),
+            auth=auth,
+            timeout=httpx.Timeout(settings.INDEXER_TIMEOUT, connect=settings.INDEXER_CONNECT_TIMEOUT),
+            max_connections=settings.INDEXER_POOL_MAX_CONNECTIONS,
+            max_keepalive=settings.INDEXER_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.INDEXER_KEEPALIVE_EXPIRY,
+        )
+
+    async def request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                      body: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None,
+                      content: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Send a request to the indexer, retrying on timeouts and connection errors like opensearch-py does."""
+        request_timeout = timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, path, params=params, json=body, content=content,
+                                                     headers=headers, timeout=request_timeout)
+                if response.status_code >= 400:
+                    raise _transport_error(response)
+                return response.json()
+            except (httpx.TimeoutException, httpx.ConnectError) as e:
+                if attempt >= settings.INDEXER_MAX_RETRIES:
+                    raise
+                attempt += 1
+                logger.warning(f"Indexer {method} {path} failed ({e!r}), retry {attempt}/{settings.INDEXER_MAX_RETRIES}")
+
+    async def search(self, index: str, body: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await self.request("POST", f"/{index}/_search", body=body, timeout=timeout)
+
+    async def msearch(self, searches: List[Tuple[str, Dict[str, Any]]], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run several (index, body) searches in one _msearch round trip."""
+        return await self.request("POST", "/_msearch", content=msearch_payload(searches), timeout=timeout,
+                                  headers={"Content-Type": "application/x-ndjson"})
+
+    async def validate(self, index: str, body: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await self.request("POST", f"/{index}/_validate/query", params={"explain": "true"}, body=body, timeout=timeout)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def _transport_error(response: httpx.Response) -> TransportError:
+    """
+    The exception opensearch-py raises for an error response (RequestError, NotFoundError, ...),
+    so both backends report e.g. RequestError(400, 'parsing_exception', <reason>).
+    """
+    error, info = response.text, None
+    try:
+        info = response.json()
+        error = info.get("error", error)
+        if isinstance(error, dict) and "type" in error:
+            error = error["type"]
+    except ValueError:
+        pass
+    return HTTP_EXCEPTIONS.get(response.status_code, TransportError)(response.status_code, error, info)
+
+
+def msearch_payload(searches: List[Tuple[str, Dict[str, Any]]]) -> bytes:
+    """NDJSON _msearch body: a header line ({"index": ...}) then the search body, per search."""
+    lines = []
+    for index, body in searches:
+        lines.append(json.dumps({"index": index}, separators=(",", ":")))
+        lines.append(json.dumps(body, separators=(",", ":"), default=str))
+    return ("\n".join(lines) + "\n").encode()
+
+
+_async_client: Optional[AsyncIndexerClient] = None
+_executor: Optional[ThreadPoolExecutor] = None
+
+def get_async_client() -> AsyncIndexerClient:
+    """Return the shared async indexer client, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncIndexerClient(settings.OPENSEARCH_HOST, settings.OPENSEARCH_USER, settings.OPENSEARCH_PASS)
+    return _async_client
+
+async def _run_in_thread(func, *args):
+    """Run a blocking opensearch-py call on the bounded indexer thread pool."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.INDEXER_THREAD_WORKERS, thread_name_prefix="indexer")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+def _validate_query_sync(indices: str, body: dict):
     # OpenSearch / Elasticsearch validate API; in OpenSearch use _validate/query with explain
-    resp = client.transport.perform_request("GET", f"/{indices}/_validate/query", params={"explain": "true"}, body=body)
-    return resp
+    return client.transport.perform_request("GET", f"/{indices}/_validate/query", params={"explain": "true"}, body=body)
 
-def execute_query(indices: str, body: dict):
+def _execute_query_sync(indices: str, body: dict):
     return client.search(index=indices, body=body)
 
+def _msearch_sync(searches: List[Tuple[str, Dict[str, Any]]]):
+    return client.msearch(body=msearch_payload(searches).decode())
+
+async def validate_query(indices: str, body: dict, timeout: Optional[float] = None):
+    if settings.INDEXER_BACKEND == "thread":
+        return await _run_in_thread(_validate_query_sync, indices, body)
+    return await get_async_client().validate(indices, body, timeout=timeout)
+
+async def _search(indices: str, body: dict, timeout: Optional[float] = None):
+    if settings.INDEXER_BACKEND == "thread":
+        return await _run_in_thread(_execute_query_sync, indices, body)
+    return await get_async_client().search(indices, body, timeout=timeout)
+
+async def _msearch(searches: List[Tuple[str, Dict[str, Any]]], timeout: Optional[float] = None):
+    if settings.INDEXER_BACKEND == "thread":
+        return await _run_in_thread(_msearch_sync, searches)
+    return await get_async_client().msearch(searches, timeout=timeout)
+
+
+async def _request(method: str, path: str, params: Optional[Dict[str, Any]] = None, body: Optional[Dict[str, Any]] = None):
+    """Raw indexer request on whichever backend is configured."""
+    if settings.INDEXER_BACKEND == "thread":
+        return await _run_in_thread(lambda: client.transport.perform_request(method, path, params=params, body=body))
+    return await get_async_client().request(method, path, params=params, body=body)
+
+
+# ==================== EXPORT (PIT + search_after) ====================
+
+# search_after needs a total order; _id breaks @timestamp ties
+DEFAULT_EXPORT_SORT = [{"@timestamp": {"order": "asc"}}, {"_id": {"order": "asc"}}]
+
+def encode_cursor(sort_values: List[Any]) -> str:
+    """Opaque resume token for the document with these sort values."""
+    return base64.urlsafe_b64encode(json.dumps(sort_values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid export cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid export cursor")
+    return values
+
+# PITs opened for exports -> index pattern they were opened on. A PIT search runs on the
+# indices baked into the PIT, so a client-supplied pit_id is only reused if we opened it
+# for the same (allowlisted) index.
+export_pits = TTLCache(max_entries=1024, ttl=3600)
+
+class ExportInterrupted(Exception):
+    """An export failed mid-stream; carries the PIT that was current at the time."""
+    def __init__(self, pit_id: str, error: Exception):
+        super().__init__(str(error))
+        self.pit_id = pit_id
+
+async def open_pit(indices: str, keep_alive: str) -> str:
+    result = await _request("POST", f"/{indices}/_search/point_in_time", params={"keep_alive": keep_alive})
+    export_pits.set(result["pit_id"], indices)
+    return result["pit_id"]
+
+def is_export_pit(pit_id: str, indices: str) -> bool:
+    """True if this server opened `pit_id` for an export of `indices`."""
+    return export_pits.get(pit_id) == indices
+
+async def close_pit(pit_id: str):
+    export_pits.invalidate(pit_id)
+    try:
+        await _request("DELETE", "/_search/point_in_time", body={"pit_id": [pit_id]})
+    except Exception as e:
+        logger.warning(f"Failed to delete PIT: {e}")
+
+def _is_missing_pit(error: Exception) -> bool:
+    return isinstance(error, TransportError) and error.status_code == 404
+
+def with_tiebreaker(sort: Optional[Any]) -> List[Any]:
+    """Export sort with "_id" appended (unless already there): search_after needs a total order."""
+    if not sort:
+        return DEFAULT_EXPORT_SORT
+    sort = list(sort) if isinstance(sort, list) else [sort]
+    if any(key == "_id" or (isinstance(key, dict) and "_id" in key) for key in sort):
+        return sort
+    return sort + [{"_id": {"order": "asc"}}]
+
+async def export_pages(indices: str, query: Optional[Dict[str, Any]], sort: Optional[List[Any]] = None,
+                       includes: Optional[List[str]] = None, page_size: Optional[int] = None,
+                       search_after: Optional[List[Any]] = None, pit_id: Optional[str] = None,
+                       max_docs: Optional[int] = None) -> AsyncIterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Walk every matching document with a point-in-time + search_after, yielding (pit_id, hits) pages.
+
+    Only the current page and the prefetched next one are held in memory. Pass `search_after`
+    (and the `pit_id` of the interrupted export, if still alive) to resume; an expired PIT is
+    replaced by a new one, so a resumed export sees the index as of the resume.
+    The PIT is deleted once the export completes; an interrupted export leaves it to expire
+    after EXPORT_PIT_KEEP_ALIVE so it can be resumed. Indexer errors are raised as
+    ExportInterrupted carrying the current PIT.
+    """
+    keep_alive = settings.EXPORT_PIT_KEEP_ALIVE
+    page_size = min(page_size or settings.EXPORT_PAGE_SIZE, settings.EXPORT_MAX_PAGE_SIZE)
+    max_docs = min(max_docs or settings.EXPORT_MAX_DOCS, settings.EXPORT_MAX_DOCS)
+    export_sort = with_tiebreaker(sort)
+    if pit_id is None:
+        pit_id = await open_pit(indices, keep_alive)
+
+    async def fetch(after: Optional[List[Any]]):
+        nonlocal pit_id
+        body = {
+            "size": page_size,
+            "query": query or {"match_all": {}},
+            "sort": export_sort,
+            "pit": {"id": pit_id, "keep_alive": keep_alive},
+            "track_total_hits": False,
+        }
+        if includes:
+            body["_source"] = {"includes": includes}
+        if after is not None:
+            body["search_after"] = after
+        try:
+            return await _request("POST", "/_search", body=body)
+        except Exception as e:
+            if not _is_missing_pit(e):
+                raise
+            logger.warning("Export PIT expired, opening a new one and continuing from the cursor")
+            pit_id = await open_pit(indices, keep_alive)
+            body["pit"]["id"] = pit_id
+            return await _request("POST", "/_search", body=body)
+
+    exported = 0
+    next_page = asyncio.create_task(fetch(search_after))
+    try:
+        while True:
+            try:
+                result = await next_page
+            except Exception as e:
+                next_page = None
+                raise ExportInterrupted(pit_id, e) from e
+            next_page = None
+            if result.get("pit_id", pit_id) != pit_id:
+                pit_id = result["pit_id"]
+                export_pits.set(pit_id, indices)
+            hits = result.get("hits", {}).get("hits", [])[:max_docs - exported]
+            exported += len(hits)
+            done = len(hits) < page_size or exported >= max_docs
+            if not done:
+                next_page = asyncio.create_task(fetch(hits[-1]["sort"]))
+            if hits:
+                yield pit_id, hits
+            if done:
+                break
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+    await close_pit(pit_id)
+
+
+# ==================== RESULT CACHE ====================
+
+# Inclusive bounds only: OpenSearch rounds gte down and lte up (widening the window), but
+# rounds gt up and lt down, which would narrow it - exclusive bounds are left as they are
+ROUNDED_BOUNDS = {"gte": None, "lte": None, "from": "include_lower", "to": "include_upper"}
+
+result_cache = TTLCache(
+    max_entries=settings.RESULT_CACHE_SIZE,
+    ttl=settings.RESULT_CACHE_TTL,
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+)
+_inflight: Dict[str, asyncio.Future] = {}
+_coalesced = {"count": 0}
+
+class LeaderCancelled(Exception):
+    """The in-flight search a caller joined was cancelled by the caller that started it."""
+
+def _inclusive_bound(bound: str, spec: Dict[str, Any]) -> bool:
+    if bound not in ROUNDED_BOUNDS:
+        return False
+    flag = ROUNDED_BOUNDS[bound]
+    return flag is None or spec.get(flag, True) is not False
+
+def round_relative_times(node: Any, unit: str) -> Any:
+    """
+    Return a copy of a DSL body with every inclusive 'now'-relative range bound rounded to `unit`
+    using OpenSearch date math ("now-24h" -> "now-24h/m"). gte rounds down and lte rounds up, so
+    the window still covers the requested range; gt/lt (and from/to with include_lower/upper
+    false) would be narrowed by rounding and are kept unrounded, as are bounds that already round.
+    """
+    if isinstance(node, list):
+        return [round_relative_times(item, unit) for item in node]
+    if not isinstance(node, dict):
+        return node
+    rounded = {}
+    for key, value in node.items():
+        if key == "range" and isinstance(value, dict):
+            rounded[key] = {
+                field: {
+                    bound: (f"{v}/{unit}" if _inclusive_bound(bound, spec) and isinstance(v, str)
+                            and v.startswith("now") and "/" not in v else v)
+                    for bound, v in spec.items()
+                } if isinstance(spec, dict) else spec
+                for field, spec in value.items()
+            }
+        else:
+            rounded[key] = round_relative_times(value, unit)
+    return rounded
+
+def cache_key(indices: str, body: dict) -> str:
+    """Stable hash of index pattern + canonical (key-sorted, compact) DSL."""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{indices}\n{canonical}".encode()).hexdigest()
+
+async def cached_search(indices: str, body: dict, timeout: Optional[float] = None,
+                        use_cache: bool = True) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Search through the result cache.
+
+    Returns (result, cache_info) where cache_info["status"] is HIT, MISS, COALESCED
+    (joined an identical in-flight search) or BYPASS, and cache_info["age"] is in seconds.
+    Cached results are shared between callers and must be treated as read-only.
+    """
+    if not (settings.RESULT_CACHE_ENABLED and use_cache):
+        return await _search(indices, body, timeout), {"status": "BYPASS", "age": 0}
+
+    if settings.RESULT_CACHE_ROUNDING:
+        body = round_relative_times(body, settings.RESULT_CACHE_ROUNDING)
+    key = cache_key(indices, body)
+
+    while True:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached, {"status": "HIT", "age": round(result_cache.age(key) or 0, 1)}
+
+        pending = _inflight.get(key)
+        if pending is None:
+            break
+        _coalesced["count"] += 1
+        try:
+            return await asyncio.shield(pending), {"status": "COALESCED", "age": 0}
+        except LeaderCancelled:
+            continue  # the search we joined was cancelled by its own caller, not us - go again
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await _search(indices, body, timeout)
+        result_cache.set(key, result, size=len(dumps(result)))
+        future.set_result(result)
+        return result, {"status": "MISS", "age": 0}
+    except asyncio.CancelledError:
+        # Only this caller was cancelled (e.g. its client disconnected); joined callers retry
+        future.set_exception(LeaderCancelled())
+        future.exception()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+async def cached_msearch(searches: List[Tuple[str, Dict[str, Any]]], timeout: Optional[float] = None,
+                         use_cache: bool = True) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Batched cached_search(): cached searches are answered locally and the rest go to the
+    indexer in a single _msearch. Returns (responses, cache_infos) in the order of `searches`;
+    a failed search's response carries an "error" key instead of hits and is not cached.
+    """
+    caching = settings.RESULT_CACHE_ENABLED and use_cache
+    responses: List[Optional[Dict[str, Any]]] = [None] * len(searches)
+    infos: List[Dict[str, Any]] = [{"status": "BYPASS", "age": 0} for _ in searches]
+    keys: List[Optional[str]] = [None] * len(searches)
+    pending = []
+
+    for i, (indices, body) in enumerate(searches):
+        if caching:
+            if settings.RESULT_CACHE_ROUNDING:
+                body = round_relative_times(body, settings.RESULT_CACHE_ROUNDING)
+            keys[i] = cache_key(indices, body)
+            cached = result_cache.get(keys[i])
+            if cached is not None:
+                responses[i] = cached
+                infos[i] = {"status": "HIT", "age": round(result_cache.age(keys[i]) or 0, 1)}
+                continue
+            infos[i] = {"status": "MISS", "age": 0}
+        pending.append((i, indices, body))
+
+    if pending:
+        result = await _msearch([(indices, body) for _, indices, body in pending], timeout)
+        received = result.get("responses") or []
+        if len(received) != len(pending):
+            logger.warning(f"_msearch returned {len(received)} responses for {len(pending)} searches")
+        for n, (i, _, _) in enumerate(pending):
+            response = received[n] if n < len(received) and isinstance(received[n], dict) else None
+            if response is None:
+                response = {"error": {"type": "missing_response",
+                                      "reason": "no response for this search in the _msearch result"}}
+            responses[i] = response
+            if caching and "error" not in response:
+                result_cache.set(keys[i], response, size=len(dumps(response)))
+    return responses, infos
+
+# Keys of a batch entry that are ours, not part of the DSL body
+BATCH_CONTROL_KEYS = ("index", "name")
+
+def split_batch_queries(queries: List[Dict[str, Any]], default_index: str = "wazuh-alerts-*"):
+    """
+    Turn /query/dsl/batch entries ({"index", "name", ...DSL}) into (name, index, body) triples.
+    Raises ValueError naming the first entry with a disallowed index or an empty body.
+    """
+    from .validators import is_index_allowed
+    if not queries:
+        raise ValueError("queries must be a non-empty list")
+    if len(queries) > settings.DSL_BATCH_MAX_QUERIES:
+        raise ValueError(f"At most {settings.DSL_BATCH_MAX_QUERIES} queries per batch")
+    triples = []
+    for i, entry in enumerate(queries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Query {i}: must be a DSL object")
+        index = entry.get("index", default_index)
+        if not is_index_allowed(index):
+            raise ValueError(f"Query {i}: index not allowed")
+        body = {k: v for k, v in entry.items() if k not in BATCH_CONTROL_KEYS}
+        if not body:
+            raise ValueError(f"Query {i}: DSL query body cannot be empty")
+        triples.append((entry.get("name") or f"query_{i + 1}", index, body))
+    return triples
+
+async def execute_query(indices: str, body: dict, timeout: Optional[float] = None, use_cache: bool = True):
+    result, _ = await cached_search(indices, body, timeout=timeout, use_cache=use_cache)
+    return result
+
+def result_cache_stats() -> Dict[str, Any]:
+    return {
+        **result_cache.stats(),
+        "rounding": settings.RESULT_CACHE_ROUNDING or None,
+        "coalesced": _coalesced["count"],
+        "in_flight": len(_inflight),
+    }
 
+def cache_headers(cache_info: Dict[str, Any]) -> Dict[str, str]:
+    """Response headers describing how a search was served."""
+    return {"X-Cache": cache_info["status"], "X-Cache-Age": str(cache_info["age"])}
 
+async def close_clients():
+    """Close pooled indexer connections and the offload thread pool (called on shutdown)."""
+    global _async_client, _executor
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
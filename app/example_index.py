@@ -0,0 +1,98 @@
+from typing import Any, Dict, List, Tuple
+import json
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "from", "to", "and", "or", "by", "with", "me", "my",
+    "show", "get", "list", "find", "give", "display", "all", "any", "are", "is", "were", "was",
+    "what", "which", "there", "please", "last", "past", "this", "that",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word/number tokens without stopwords; trailing plural "s" stripped (logins -> login)."""
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over a small set of short documents, with postings lists for fast scoring."""
+
+    def __init__(self, documents: List[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+        for doc_id, document in enumerate(documents):
+            tokens = tokenize(document)
+            self.lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                self.postings.setdefault(token, []).append((doc_id, tf))
+        n = len(documents)
+        self.avg_length = sum(self.lengths) / n if n else 0.0
+        self.idf = {token: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for token, docs in self.postings.items()}
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (doc_id, score) with a positive score, best first."""
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+
+class ExampleIndex:
+    """
+    Curated NL -> WazuhSearchPlan examples (JSON file in the repo) and planner reference
+    sections, indexed once so each query gets only its most similar examples and sections.
+    """
+
+    def __init__(self, path: str, sections: Dict[str, str]):
+        self.path = path
+        self.examples: List[Dict[str, Any]] = []
+        self.section_names = list(sections)
+        section_keywords: Dict[str, List[str]] = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.examples = data.get("examples", [])
+            section_keywords = data.get("section_keywords", {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load planner examples from {path}: {e}")
+
+        self._examples = BM25Index([" ".join([ex["query"], *ex.get("tags", [])]) for ex in self.examples])
+        self._sections = BM25Index([" ".join([name.replace("_", " "), text, *section_keywords.get(name, [])])
+                                    for name, text in sections.items()])
+        logger.info(f"Planner example index: {len(self.examples)} examples, {len(self.section_names)} sections")
+
+    def default_examples(self) -> List[Dict[str, Any]]:
+        """Examples sent when retrieval is off (marked "default" in the JSON file)."""
+        return [example for example in self.examples if example.get("default")]
+
+    def select(self, query: str, examples_k: int, sections_k: int) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Top-k most similar examples and the names of the reference sections the query touches."""
+        examples = [self.examples[doc_id] for doc_id, _ in self._examples.search(query, examples_k)]
+        sections = [self.section_names[doc_id] for doc_id, _ in self._sections.search(query, sections_k)]
+        return examples, sections
+
+    def stats(self) -> Dict[str, int]:
+        return {"examples": len(self.examples), "sections": len(self.section_names),
+                "vocabulary": len(self._examples.postings) + len(self._sections.postings)}
@@ -0,0 +1,229 @@
+from app.config import settings
+from typing import Dict, Any, List, Optional
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Wazuh alert template types, used until the first mapping is loaded (or if the indexer is unreachable)
+DEFAULT_FIELD_TYPES = {
+    # Rule fields
+    "rule.id": "keyword",
+    "rule.level": "integer",
+    "rule.description": "text",
+    "rule.mitre.technique": "keyword",
+    "rule.mitre.tactic": "keyword",
+    # Agent fields
+    "agent.name": "keyword",
+    "agent.id": "keyword",
+    "agent.ip": "ip",
+    "agent.os.platform": "keyword",
+    # Data fields
+    "data.srcip": "ip",
+    "data.dstip": "ip",
+    "data.srcuser": "keyword",
+    "data.dstuser": "keyword",
+    "data.srcport": "integer",
+    "data.dstport": "integer",
+    "data.protocol": "keyword",
+    "data.win.eventdata.targetUserName": "keyword",
+    "data.win.system.eventID": "keyword",
+    "data.win.system.channel": "keyword",
+    # Decoder fields
+    "decoder.name": "keyword",
+    "decoder.parent": "keyword",
+    # Other fields
+    "@timestamp": "date",
+    "timestamp": "date",
+    "location": "keyword",
+    "full_log": "text",
+    "manager.name": "keyword",
+    "vulnerability.severity": "keyword",
+}
+
+# Types that support range operators (gt/gte/lt/lte)
+RANGE_TYPES = {"long", "integer", "short", "byte", "double", "float", "half_float", "scaled_float",
+               "unsigned_long", "date", "date_nanos", "ip"}
+
+
+def flatten_mapping(properties: Dict[str, Any], prefix: str = "") -> Dict[str, Dict[str, Any]]:
+    """
+    Index mapping properties -> {dotted field: {"type", "keyword"}} where "keyword" is the
+    keyword sub-field to use for term queries/aggregations on text fields (None if there is none).
+    """
+    fields: Dict[str, Dict[str, Any]] = {}
+    for name, spec in properties.items():
+        path = f"{prefix}{name}"
+        if "properties" in spec:
+            fields.update(flatten_mapping(spec["properties"], f"{path}."))
+            continue
+        field_type = spec.get("type", "object")
+        keyword = None
+        if field_type == "text":
+            keyword = next((f"{path}.{sub}" for sub, sub_spec in spec.get("fields", {}).items()
+                            if sub_spec.get("type") == "keyword"), None)
+        fields[path] = {"type": field_type, "keyword": keyword}
+    return fields
+
+
+class FieldRegistry:
+    """
+    Field types of the allowed indices, loaded from the index _mapping.
+
+    - Loaded at startup from a disk cache (fast restarts), then from the indexer, and refreshed
+      in the background every `refresh_interval` seconds
+    - Lookups (type, keyword sub-field, known field) are dict hits
+    - Until a mapping is loaded the Wazuh template defaults (DEFAULT_FIELD_TYPES) are used
+    """
+    def __init__(self, refresh_interval: float, retry_interval: float, cache_path: Optional[str]):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.cache_path = cache_path
+        self.source = "defaults"
+        self.last_updated = 0.0
+        self._fields: Dict[str, Dict[str, Any]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._metrics = {"refreshes": 0, "failures": 0, "last_error": None}
+        # Without a mapping, text fields are assumed to have the usual ".keyword" sub-field
+        self._load({field: {"type": field_type, "keyword": f"{field}.keyword" if field_type == "text" else None}
+                    for field, field_type in DEFAULT_FIELD_TYPES.items()}, "defaults")
+
+    # ---------- lifecycle ----------
+
+    def start(self):
+        """Load the disk cache and start the periodic refresh loop."""
+        self.load_cache()
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._loop_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._loop_task = None
+        self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            ok = await self.refresh()
+            await asyncio.sleep(self.refresh_interval if ok else self.retry_interval)
+
+    # ---------- refresh ----------
+
+    async def refresh(self) -> bool:
+        """Reload the mapping, joining a refresh that is already running. Keeps the old fields on failure."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        return await asyncio.shield(self._refresh_task)
+
+    async def _fetch(self) -> bool:
+        from app.es_client import _request
+
+        try:
+            fields: Dict[str, Dict[str, Any]] = {}
+            for pattern in settings.INDEX_ALLOWLIST:
+                # The newest index carries the current template; fetching every daily index's mapping is wasteful
+                indices = await _request("GET", f"/_cat/indices/{pattern}",
+                                         params={"format": "json", "h": "index", "s": "index:desc"})
+                if not indices:
+                    continue
+                index = indices[0]["index"]
+                mapping = await _request("GET", f"/{index}/_mapping")
+                for field, spec in flatten_mapping(mapping[index]["mappings"].get("properties", {})).items():
+                    fields.setdefault(field, spec)
+            if not fields:
+                raise RuntimeError(f"no indices match {settings.INDEX_ALLOWLIST}")
+            self._load(fields, "indexer")
+            self.save_cache()
+            self._metrics["refreshes"] += 1
+            self._metrics["last_error"] = None
+            return True
+        except Exception as e:
+            self._metrics["failures"] += 1
+            self._metrics["last_error"] = str(e)
+            logger.error(f"Field registry refresh failed: {e}")
+            return False
+
+    def _load(self, fields: Dict[str, Dict[str, Any]], source: str):
+        if source != "defaults":
+            logger.info(f"Field registry loaded {len(fields)} fields from {source}")
+        self._fields = fields
+        self.source = source
+        self.last_updated = time.time()
+
+    def load_cache(self) -> bool:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            self._load(cached["fields"], "cache")
+            self.last_updated = cached.get("saved_at", self.last_updated)
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable field registry cache {self.cache_path}: {e}")
+            return False
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": self.last_updated, "fields": self._fields}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write field registry cache {self.cache_path}: {e}")
+
+    # ---------- lookups ----------
+
+    def type_of(self, field: str) -> Optional[str]:
+        spec = self._fields.get(field)
+        return spec["type"] if spec else None
+
+    def is_known(self, field: str) -> bool:
+        return field in self._fields
+
+    def term_field(self, field: str) -> str:
+        """Field to use for term/terms queries and aggregations: the keyword sub-field of text fields."""
+        spec = self._fields.get(field)
+        if spec and spec["type"] == "text":
+            return spec["keyword"] or field
+        return field
+
+    def supports_exact(self, field: str) -> bool:
+        """eq/in need a non-text field or a keyword sub-field."""
+        spec = self._fields.get(field)
+        return spec is not None and (spec["type"] != "text" or spec["keyword"] is not None)
+
+    def supports_range(self, field: str) -> bool:
+        return self.type_of(field) in RANGE_TYPES
+
+    def fields(self) -> List[str]:
+        return list(self._fields)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fields": len(self._fields),
+            "source": self.source,
+            "age_seconds": round(time.time() - self.last_updated, 1) if self.last_updated else None,
+            "cache_path": self.cache_path,
+            "refresh_interval": self.refresh_interval,
+            **self._metrics,
+        }
+
+
+field_registry = FieldRegistry(
+    refresh_interval=settings.FIELD_REGISTRY_REFRESH_INTERVAL,
+    retry_interval=settings.FIELD_REGISTRY_RETRY_INTERVAL,
+    cache_path=settings.FIELD_REGISTRY_CACHE_PATH,
+)
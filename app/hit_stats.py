@@ -0,0 +1,152 @@
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Histogram bucket sizes (seconds); the smallest giving <= HISTOGRAM_MAX_BUCKETS buckets is used
+HISTOGRAM_INTERVALS = (60, 300, 600, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 7 * 86400)
+HISTOGRAM_MAX_BUCKETS = 24
+TOP_N = 5
+# Name prefix of the aggregation bundle build_dsl attaches (see dsl_builder.summary_aggregations)
+SUMMARY_AGG_PREFIX = "summary_"
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _interval_label(seconds: int) -> str:
+    if seconds % 86400 == 0:
+        return f"{seconds // 86400}d"
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    return f"{seconds // 60}m"
+
+
+def _histogram(timestamps: List[datetime]) -> Dict[str, Any]:
+    if not timestamps:
+        return {"interval": None, "buckets": []}
+    start, end = min(timestamps), max(timestamps)
+    span = (end - start).total_seconds()
+    interval = next((i for i in HISTOGRAM_INTERVALS if span / i < HISTOGRAM_MAX_BUCKETS), HISTOGRAM_INTERVALS[-1])
+    counts = Counter(int(ts.timestamp()) // interval * interval for ts in timestamps)
+    return {
+        "interval": _interval_label(interval),
+        "buckets": [(datetime.fromtimestamp(bucket, timezone.utc).isoformat(timespec="minutes"), counts[bucket])
+                    for bucket in sorted(counts)],
+    }
+
+
+def _match_count(total: Any) -> Optional[int]:
+    """hits.total as an int: accepts an int or {"value": int}; None when the indexer didn't count."""
+    if isinstance(total, dict):
+        total = total.get("value")
+    return total if isinstance(total, int) and not isinstance(total, bool) else None
+
+
+def compute_hit_stats(hits: List[Dict[str, Any]], total: Any = None) -> Dict[str, Any]:
+    """
+    One pass over indexer hits: counts by rule level, top rules, agents and source IPs,
+    time range and a histogram. `total` is the full match count (int or hits.total object)
+    when larger than len(hits); None means the hits are all there is. An unusable total
+    (e.g. {} with track_total_hits disabled) leaves stats["total"] None.
+    """
+    levels, rules, agents, srcips = Counter(), Counter(), Counter(), Counter()
+    descriptions: Dict[str, str] = {}
+    timestamps = []
+    for hit in hits:
+        source = hit.get("_source", {})
+        rule = source.get("rule") or {}
+        if rule.get("level") is not None:
+            levels[rule["level"]] += 1
+        if rule.get("id") is not None:
+            rules[rule["id"]] += 1
+            descriptions.setdefault(rule["id"], rule.get("description", ""))
+        agent = (source.get("agent") or {}).get("name")
+        if agent:
+            agents[agent] += 1
+        srcip = (source.get("data") or {}).get("srcip")
+        if srcip:
+            srcips[srcip] += 1
+        ts = _parse_timestamp(source.get("@timestamp") or source.get("timestamp"))
+        if ts:
+            timestamps.append(ts)
+
+    return {
+        "total": len(hits) if total is None else _match_count(total),
+        "analysed": len(hits),
+        "levels": sorted(levels.items(), key=lambda kv: str(kv[0]).zfill(3), reverse=True),
+        "rules": [(rule_id, descriptions.get(rule_id, ""), count) for rule_id, count in rules.most_common(TOP_N)],
+        "agents": agents.most_common(TOP_N),
+        "srcips": srcips.most_common(TOP_N),
+        "time_range": ((min(timestamps).isoformat(timespec="seconds"), max(timestamps).isoformat(timespec="seconds"))
+                       if timestamps else None),
+        "histogram": _histogram(timestamps),
+    }
+
+
+def stats_from_aggregations(aggs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    compute_hit_stats()-shaped statistics from the indexer-side summary aggregation bundle,
+    covering every matching alert rather than the returned hits. None if the bundle is absent.
+    """
+    if not aggs or f"{SUMMARY_AGG_PREFIX}levels" not in aggs:
+        return None
+
+    def buckets(name):
+        return aggs.get(f"{SUMMARY_AGG_PREFIX}{name}", {}).get("buckets", [])
+
+    def description(bucket):
+        top = bucket.get("description", {}).get("hits", {}).get("hits", [])
+        return ((top[0].get("_source") or {}).get("rule") or {}).get("description", "") if top else ""
+
+    level_stats = aggs[f"{SUMMARY_AGG_PREFIX}levels"]
+    timeline = [(b.get("key_as_string") or datetime.fromtimestamp(b["key"] / 1000, timezone.utc).isoformat(timespec="minutes"),
+                 b["doc_count"]) for b in buckets("histogram") if b.get("doc_count")]
+    return {
+        "total": level_stats.get("count", 0),
+        "analysed": level_stats.get("count", 0),
+        "source": "indexer",
+        "levels": [],
+        "level_stats": {k: level_stats.get(k) for k in ("min", "max", "avg")},
+        "rules": [(b["key"], description(b), b["doc_count"]) for b in buckets("rules")],
+        "agents": [(b["key"], b["doc_count"]) for b in buckets("agents")],
+        "srcips": [(b["key"], b["doc_count"]) for b in buckets("srcips")],
+        "time_range": (timeline[0][0], timeline[-1][0]) if timeline else None,
+        "histogram": {"interval": aggs.get(f"{SUMMARY_AGG_PREFIX}histogram", {}).get("interval"),
+                      "buckets": timeline},
+    }
+
+
+def format_stats_table(stats: Dict[str, Any]) -> str:
+    """Render compute_hit_stats() output as a compact text table for the summary prompt."""
+    def row(pairs):
+        return " | ".join(f"{key}: {count}" for key, count in pairs) or "-"
+
+    if stats.get("source") == "indexer":
+        lines = [f"Alerts matching (aggregated by the indexer): {stats['total']}"]
+    else:
+        lines = [f"Hits analysed: {stats['analysed']} of {stats['total']} matching" if stats["total"] is not None
+                 else f"Hits analysed: {stats['analysed']} (total matches not counted)"]
+    if stats["time_range"]:
+        lines.append(f"Time range: {stats['time_range'][0]} to {stats['time_range'][1]}")
+    if stats.get("level_stats"):
+        level = stats["level_stats"]
+        avg = f"{level['avg']:.1f}" if level.get("avg") is not None else "-"
+        lines.append(f"Rule level: min {level.get('min')}, max {level.get('max')}, avg {avg}")
+    else:
+        lines.append(f"By rule level: {row(stats['levels'])}")
+    lines.append("Top rules: " + (" | ".join(f"{rule_id} \"{desc}\": {count}" for rule_id, desc, count in stats["rules"]) or "-"))
+    lines.append(f"Top agents: {row(stats['agents'])}")
+    lines.append(f"Top source IPs: {row(stats['srcips'])}")
+    if stats["histogram"]["buckets"]:
+        interval = stats["histogram"]["interval"] or ""
+        lines.append(f"Histogram ({interval or 'auto'} buckets): "
+                     + row((start[:10] if interval.endswith("d") else start[5:16].replace("T", " "),
+                            count) for start, count in stats["histogram"]["buckets"]))
+    return "\n".join(lines)
@@ -0,0 +1,94 @@
+from app.config import settings
+from typing import Any, Dict, Optional
+import logging
+import ssl
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401 - httpx only negotiates HTTP/2 when h2 is installed
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_ssl_contexts: Dict[bool, ssl.SSLContext] = {}
+_metrics: Dict[str, Dict[str, int]] = {}
+
+
+def get_ssl_context(verify: bool) -> ssl.SSLContext:
+    """
+    One SSLContext per verify mode, shared by every outbound pool, so certificates and
+    ciphers are loaded once and all clients negotiate TLS the same way.
+    """
+    context = _ssl_contexts.get(verify)
+    if context is None:
+        context = ssl.create_default_context()
+        if not verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        _ssl_contexts[verify] = context
+    return context
+
+
+def _metrics_hooks(name: str) -> Dict[str, Any]:
+    """
+    httpx event hooks that count requests, new TCP connections and TLS handshakes per client
+    using httpcore's trace extension. requests - new connections = requests served on a reused one.
+    """
+    counters = _metrics.setdefault(name, {"requests": 0, "connections_opened": 0, "tls_handshakes": 0,
+                                          "http2_responses": 0})
+
+    async def trace(event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            counters["connections_opened"] += 1
+        elif event_name == "connection.start_tls.complete":
+            counters["tls_handshakes"] += 1
+
+    async def on_request(request: httpx.Request):
+        counters["requests"] += 1
+        request.extensions["trace"] = trace
+
+    async def on_response(response: httpx.Response):
+        if response.http_version == "HTTP/2":
+            counters["http2_responses"] += 1
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def create_async_client(name: str, *, max_connections: int, max_keepalive: int, keepalive_expiry: float,
+                        timeout: httpx.Timeout, verify: bool = settings.WAZUH_VERIFY_SSL,
+                        http2: Optional[bool] = None, **kwargs) -> httpx.AsyncClient:
+    """
+    Pooled httpx.AsyncClient used for every outbound connection (Wazuh API, indexer, OpenAI).
+    HTTP/2 is used when HTTP2_ENABLED is set and h2 is installed; HTTP/1.1 otherwise.
+    """
+    if http2 is None:
+        http2 = settings.HTTP2_ENABLED
+    if http2 and not HTTP2_AVAILABLE:
+        logger.info(f"{name}: HTTP/2 requested but h2 is not installed, using HTTP/1.1")
+        http2 = False
+    return httpx.AsyncClient(
+        verify=get_ssl_context(verify),
+        http2=http2,
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        event_hooks=_metrics_hooks(name),
+        **kwargs,
+    )
+
+
+def transport_stats() -> Dict[str, Any]:
+    """Per-client connection reuse counters for the admin endpoint."""
+    report = {"http2_available": HTTP2_AVAILABLE, "http2_enabled": settings.HTTP2_ENABLED, "clients": {}}
+    for name, counters in _metrics.items():
+        requests = counters["requests"]
+        report["clients"][name] = {
+            **counters,
+            "reuse_ratio": round(1 - counters["connections_opened"] / requests, 4) if requests else None,
+        }
+    return report
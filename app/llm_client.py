@@ -1,60 +1,30 @@
-from openai import AsyncOpenAI
 from app.config import settings
 from app.schemas import WazuhSearchPlan
+from app.validators import is_index_allowed, validate_filters, enforce_time_window
+from app.llm_gateway import gateway
+from app.cache import TTLCache
+from app.agent_registry import agent_registry
+from app.field_registry import field_registry
+from app.serialization import dumps, prompt_json
+from app.sampler import sample_hits, sample_items
+from app.local_planner import FIELD_CORRECTIONS, plan_query_locally
+from app.example_index import ExampleIndex
+from app.hit_stats import SUMMARY_AGG_PREFIX, compute_hit_stats, format_stats_table, stats_from_aggregations
+import copy
 import json
 import logging
-from typing import Dict, Any, Optional, List
-import httpx
+import re
+import time
+from typing import Dict, Any, AsyncIterator, Optional, List
 
 logger = logging.getLogger(__name__)
 
-# Initialize async client with timeout
-client = AsyncOpenAI(
-    api_key=settings.OPENAI_API_KEY,
-    timeout=httpx.Timeout(60.0, connect=10.0)  # 60s total, 10s connect
-)
-
-# Global agent cache (refreshed periodically)
-_agent_cache = {"agents": [], "last_updated": 0}
-_agent_cache_ttl = 300  # 5 minutes
-
-
 async def get_agent_context(wazuh_client=None) -> Dict[str, Any]:
     """
-    Get current agent list from Wazuh to provide context for GPT.
+    Get current agent list from the agent registry to provide context for GPT.
     This prevents hallucinating agent names.
     """
-    import time
-    
-    # Return cached if still valid
-    if time.time() - _agent_cache["last_updated"] < _agent_cache_ttl and _agent_cache["agents"]:
-        return _agent_cache
-    
-    # Fetch fresh agent list
-    if wazuh_client:
-        try:
-            result = await wazuh_client.get_agents()
-            agents = result.get("data", {}).get("affected_items", [])
-            
-            agent_list = []
-            for agent in agents:
-                agent_list.append({
-                    "id": agent.get("id"),
-                    "name": agent.get("name"),
-                    "ip": agent.get("ip"),
-                    "status": agent.get("status"),
-                    "os": agent.get("os", {}).get("name", "Unknown")
-                })
-            
-            _agent_cache["agents"] = agent_list
-            _agent_cache["last_updated"] = time.time()
-            logger.info(f"Updated agent cache: {len(agent_list)} agents")
-            return _agent_cache
-        except Exception as e:
-            logger.error(f"Failed to fetch agent context: {e}")
-    
-    # Return cached even if expired
-    return _agent_cache
+    return await agent_registry.snapshot(wazuh_client)
 
 
 def format_agent_context(agents: List[Dict]) -> str:
@@ -72,6 +42,35 @@ def format_agent_context(agents: List[Dict]) -> str:
     return context
 
 
+# Keyword heuristics shared by analyze_query_intent and the local routing classifier
+SECURITY_KEYWORDS = ["attack", "breach", "intrusion", "malware", "exploit", "vulnerability",
+                     "brute force", "unauthorized", "suspicious", "malicious", "threat"]
+PATTERN_KEYWORDS = ["pattern", "multiple", "repeated", "summarize", "count by", "group by"]
+TIME_KEYWORDS = ["now", "recent", "latest", "last", "today", "yesterday", "real-time"]
+SECURITY_DATA_KEYWORDS = ["alert", "alerts", "log", "logs", "event", "events", "incident", "incidents",
+                          "login", "logins", "logon", "authentication", "fim", "file", "files", "rule", "rules"]
+AGENT_INVENTORY_KEYWORDS = ["agent", "agents", "endpoint", "endpoints", "inventory"]
+# Words a pure agent-listing query may contain besides AGENT_INVENTORY_KEYWORDS; anything else
+# ("active", "vulnerabilities", "open ports") makes the local classifier defer to GPT
+AGENT_LISTING_WORDS = {"show", "me", "list", "get", "display", "give", "all", "the", "my", "our", "of",
+                       "a", "every", "registered", "what", "which", "are", "is", "there", "please", "wazuh"}
+# "now" alone ("agents active now") is not a time range
+ROUTING_TIME_KEYWORDS = [kw for kw in TIME_KEYWORDS if kw != "now"]
+TIME_PATTERN = r"\b(?:minutes?|mins?|hours?|hrs?|days?|weeks?|months?|since|between|ago|past)\b"
+
+
+def _plural_pattern(keyword: str) -> str:
+    """Regex for a keyword and its plural ("attack(s)", "vulnerabilit(y|ies)")."""
+    if keyword.endswith("y") and keyword[-2:-1] not in "aeiou":
+        return re.escape(keyword[:-1]) + "(?:y|ies)"
+    return re.escape(keyword) + "(?:s|es)?"
+
+
+def _contains_word(text: str, keywords: List[str]) -> bool:
+    """Whole-word / whole-phrase keyword match, plurals included (avoids 'now' matching 'unknown')."""
+    return any(re.search(rf"\b{_plural_pattern(kw)}\b", text) for kw in keywords)
+
+
 def analyze_query_intent(user_query: str) -> Dict[str, Any]:
     """
     Analyze user query to provide hints for GPT parsing.
@@ -89,26 +88,64 @@ def analyze_query_intent(user_query: str) -> Dict[str, Any]:
     }
     
     # Security incident indicators
-    security_keywords = ["attack", "breach", "intrusion", "malware", "exploit", "vulnerability", 
-                        "brute force", "unauthorized", "suspicious", "malicious", "threat"]
-    if any(kw in query_lower for kw in security_keywords):
+    if any(kw in query_lower for kw in SECURITY_KEYWORDS):
         metadata["is_security_incident"] = True
         metadata["suggested_limit"] = 100
     
     # Pattern detection needs more data
-    pattern_keywords = ["pattern", "multiple", "repeated", "summarize", "count by", "group by"]
-    if any(kw in query_lower for kw in pattern_keywords):
+    if any(kw in query_lower for kw in PATTERN_KEYWORDS):
         metadata["needs_aggregation"] = True
         metadata["suggested_limit"] = 200
     
     # Time-sensitive queries
-    time_keywords = ["now", "recent", "latest", "last", "today", "yesterday", "real-time"]
-    if any(kw in query_lower for kw in time_keywords):
+    if any(kw in query_lower for kw in TIME_KEYWORDS):
         metadata["time_sensitive"] = True
     
     return metadata
 
 
+def normalize_query(user_query: str) -> str:
+    """Normalize a query for cache lookups: lowercase, collapse whitespace, drop trailing punctuation."""
+    return re.sub(r"\s+", " ", user_query.lower()).strip().rstrip("?!. ")
+
+
+def classify_query_locally(user_query: str) -> Optional[Dict[str, Any]]:
+    """
+    Keyword-based router for unambiguous queries so they can skip the GPT round trip.
+    Returns a routing dict for high-confidence cases, None when GPT should decide (any query
+    mentioning agents together with other content, following ROUTER_PROMPT's "if any doubt").
+    """
+    query_lower = normalize_query(user_query)
+    intent = analyze_query_intent(query_lower)
+
+    mentions_time = (_contains_word(query_lower, ROUTING_TIME_KEYWORDS)
+                     or re.search(TIME_PATTERN, query_lower) is not None)
+    mentions_security_data = (_contains_word(query_lower, SECURITY_DATA_KEYWORDS)
+                              or _contains_word(query_lower, SECURITY_KEYWORDS) or intent["needs_aggregation"])
+    mentions_agents = _contains_word(query_lower, AGENT_INVENTORY_KEYWORDS)
+
+    if mentions_agents:
+        # Only a bare "list all agents" is unambiguous; agents + anything else (status, vulnerabilities,
+        # ports, alerts, time) could be either pipeline - "if any doubt" is GPT's call
+        other_words = [word for word in re.findall(r"[\w.-]+", query_lower)
+                       if word not in AGENT_INVENTORY_KEYWORDS and word not in AGENT_LISTING_WORDS]
+        if other_words:
+            return None
+        return {
+            "pipeline": "SIMPLE_PIPELINE",
+            "reasoning": "Local classifier: pure agent inventory query with no time filter",
+            "confidence": 0.95
+        }
+    if mentions_time or mentions_security_data:
+        reason = "time reference" if mentions_time else "security data (alerts/logs/events)"
+        return {
+            "pipeline": "ADVANCED_PIPELINE",
+            "reasoning": f"Local classifier: query mentions {reason}",
+            "confidence": 0.95
+        }
+    return None
+
+
 # Router System Prompt - Decides which pipeline to use
 ROUTER_PROMPT = """You are a Wazuh SIEM query router. Your job is to determine which pipeline should handle the user's query.
 
@@ -167,17 +204,70 @@ Examples:
 """
 
 
+# Routing decisions keyed by normalized query text
+routing_cache = TTLCache(max_entries=settings.ROUTING_CACHE_SIZE, ttl=settings.ROUTING_CACHE_TTL)
+routing_stats = {"local_classifier_hits": 0, "llm_calls": 0}
+
+
 async def route_query(user_query: str) -> Dict[str, Any]:
+    """
+    Route query to appropriate pipeline.
+    Checks the routing cache first, then the local keyword classifier, and only then asks GPT-4o.
+    """
+    routing = lookup_cached_route(user_query)
+    if routing is not None:
+        return routing
+
+    routing_stats["llm_calls"] += 1
+    routing = await _route_query_llm(user_query)
+    if routing.pop("fallback", False):
+        # Don't cache error fallbacks - next request should retry GPT
+        return routing
+    routing["source"] = "llm"
+    _store_route(user_query, routing)
+    return dict(routing)
+
+
+def lookup_cached_route(user_query: str) -> Optional[Dict[str, Any]]:
+    """Routing decision from the cache or the local classifier, or None if GPT has to decide."""
+    key = normalize_query(user_query)
+    if settings.ROUTING_CACHE_ENABLED:
+        cached = routing_cache.get(key)
+        if cached is not None:
+            logger.info(f"Routing cache hit: {cached['pipeline']}")
+            return {**cached, "source": "cache"}
+
+    if settings.ROUTING_FAST_CLASSIFIER:
+        routing = classify_query_locally(user_query)
+        if routing is not None:
+            routing_stats["local_classifier_hits"] += 1
+            routing["source"] = "local"
+            logger.info(f"Query routed locally to {routing['pipeline']}")
+            _store_route(user_query, routing)
+            return dict(routing)
+    return None
+
+
+def _store_route(user_query: str, routing: Dict[str, Any]):
+    if settings.ROUTING_CACHE_ENABLED:
+        routing_cache.set(normalize_query(user_query), routing)
+
+
+def routing_cache_stats() -> Dict[str, Any]:
+    return {**routing_cache.stats(), **routing_stats}
+
+
+async def _route_query_llm(user_query: str) -> Dict[str, Any]:
     """Route query to appropriate pipeline using GPT-4o."""
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
+        response = await gateway.chat(
             messages=[
                 {"role": "system", "content": ROUTER_PROMPT},
                 {"role": "user", "content": f"Route this query: {user_query}"}
             ],
             temperature=0.0,
-            response_format={"type": "json_object"}
+            response_format={"type": "json_object"},
+            timeout=settings.LLM_ROUTER_TIMEOUT
         )
         
         content = response.choices[0].message.content
@@ -209,7 +299,8 @@ async def route_query(user_query: str) -> Dict[str, Any]:
         return {
             "pipeline": "ADVANCED_PIPELINE",
             "reasoning": "Routing JSON parsing failed, using advanced pipeline as fallback",
-            "confidence": 0.5
+            "confidence": 0.5,
+            "fallback": True
         }
     except Exception as e:
         logger.error(f"Query routing failed: {e}", exc_info=True)
@@ -217,14 +308,15 @@ async def route_query(user_query: str) -> Dict[str, Any]:
         return {
             "pipeline": "ADVANCED_PIPELINE",
             "reasoning": "Routing failed, using advanced pipeline as fallback",
-            "confidence": 0.5
+            "confidence": 0.5,
+            "fallback": True
         }
 
 
-def ask_openai(prompt: str) -> str:
+async def ask_openai(prompt: str) -> str:
     """Send user prompt to OpenAI LLM."""
     try:
-        response = client.chat.completions.create(
+        response = await gateway.chat(
             model="gpt-3.5-turbo",
             messages=[
                 {
@@ -241,7 +333,7 @@ def ask_openai(prompt: str) -> str:
         return "LLM request failed."
 
 
-def parse_natural_language_query(user_query: str) -> Dict[str, Any]:
+async def parse_natural_language_query(user_query: str) -> Dict[str, Any]:
     """Convert natural language query to structured WazuhSearchPlan for DSL builder."""
     system_prompt = """You are a Wazuh SIEM query translator. Convert natural language security queries into structured JSON for OpenSearch/Elasticsearch queries.
 
@@ -295,13 +387,13 @@ For aggregations:
 """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
+        response = await gateway.chat(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_query},
             ],
             temperature=0.1,
+            timeout=settings.LLM_PLANNER_TIMEOUT,
         )
 
         content = response.choices[0].message.content
@@ -331,7 +423,49 @@ For aggregations:
         }
 
 
-def format_wazuh_response(raw_data: Dict[str, Any], original_query: str) -> str:
+def _hits_stats_table(results: Dict[str, Any], documents: List[Dict[str, Any]], total_count: Any) -> Optional[str]:
+    """
+    Statistics table for the summary prompt: from the indexer-side summary aggregations when
+    the query carried them (full match set), otherwise computed over the returned hits
+    (SUMMARY_MODE=stats only). `total_count` is the raw hits.total ({} when not tracked).
+    """
+    stats = stats_from_aggregations(results.get("aggregations"))
+    if stats is None and documents and settings.SUMMARY_MODE == "stats":
+        stats = compute_hit_stats(documents, total_count)
+    return format_stats_table(stats) if stats else None
+
+
+def _plan_aggregations(results: Dict[str, Any]) -> Dict[str, Any]:
+    """Aggregations the plan itself asked for - the summary bundle is already in the stats table."""
+    return {k: v for k, v in results.get("aggregations", {}).items() if not k.startswith(SUMMARY_AGG_PREFIX)}
+
+
+def _sample_raw_data(raw_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Token-budgeted copy of a Manager API / indexer response for format_wazuh_response."""
+    if "hits" in raw_data:
+        documents = raw_data.get("hits", {}).get("hits", [])
+        total = raw_data["hits"].get("total")
+        sampled = {"total_hits": total}
+        stats_table = _hits_stats_table(raw_data, documents, total if total is not None else {})
+        if stats_table:
+            sampled["statistics"] = stats_table
+            sample, report = sample_hits(documents, settings.SUMMARY_STATS_SAMPLE_TOKENS)
+        else:
+            sample, report = sample_hits(documents)
+        sampled["sample_documents"] = sample
+        if _plan_aggregations(raw_data):
+            sampled["aggregations"] = _plan_aggregations(raw_data)
+    else:
+        list_key = next((k for k in ("agents", "alerts") if isinstance(raw_data.get(k), list)), None)
+        if list_key is None:
+            return raw_data
+        sample, report = sample_items(raw_data[list_key])
+        sampled = {**raw_data, list_key: sample}
+    _record_sampling(report)
+    return sampled
+
+
+async def format_wazuh_response(raw_data: Dict[str, Any], original_query: str) -> str:
     """Convert cryptic Wazuh JSON response to natural language summary."""
     system_prompt = """You are a security analyst assistant. Convert technical Wazuh SIEM data into clear, actionable natural language summaries.
 
@@ -346,18 +480,18 @@ Be concise, specific, and security-focused."""
     user_prompt = f"""Original query: {original_query}
 
 Wazuh data:
-{json.dumps(raw_data, indent=2)}
+{prompt_json(_sample_raw_data(raw_data))}
 
 Provide a natural language summary of this security data."""
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
+        response = await gateway.chat(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
             temperature=0.3,
+            timeout=settings.LLM_SUMMARY_TIMEOUT,
         )
         content = response.choices[0].message.content
         return content if content is not None else "Unable to format response."
@@ -368,9 +502,7 @@ Provide a natural language summary of this security data."""
 
 # ==================== NEW UNIFIED PIPELINE FUNCTIONS ====================
 
-async def parse_simple_query(user_query: str) -> Dict[str, Any]:
-    """Parse natural language for SIMPLE_PIPELINE (Wazuh Manager API)."""
-    system_prompt = """You are a Wazuh API query parser. Convert natural language agent queries into structured JSON.
+SIMPLE_PARSER_PROMPT = """You are a Wazuh API query parser. Convert natural language agent queries into structured JSON.
 
 Output ONLY valid JSON matching this structure:
 {
@@ -386,16 +518,19 @@ Examples:
 - "List active agents" → {"operation": "list_agents", "filters": {"status": "active", "agent_id": null}}
 - "Get agent 001" → {"operation": "get_agent", "filters": {"status": null, "agent_id": "001"}}
 """
-    
+
+
+async def parse_simple_query(user_query: str) -> Dict[str, Any]:
+    """Parse natural language for SIMPLE_PIPELINE (Wazuh Manager API)."""
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
+        response = await gateway.chat(
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": SIMPLE_PARSER_PROMPT},
                 {"role": "user", "content": user_query}
             ],
             temperature=0.0,
-            response_format={"type": "json_object"}
+            response_format={"type": "json_object"},
+            timeout=settings.LLM_ROUTER_TIMEOUT
         )
         
         content = response.choices[0].message.content
@@ -419,6 +554,35 @@ Examples:
         }
 
 
+AGENT_FIELDS = {"agent.name": "name", "agent.id": "id", "agent.ip": "ip"}
+
+
+def _resolve_agent_filter(field: str, value: Any):
+    """
+    Map an agent filter value onto the registry's canonical form, switching field when the
+    value clearly identifies the agent another way (e.g. agent.name="192.168.1.5" -> agent.ip).
+    Names differing from a real agent only in case/separators are snapped to it (closest()
+    with AGENT_SNAP_THRESHOLD); anything else, e.g. a host not yet registered, is left untouched.
+    """
+    if isinstance(value, list):
+        resolved = [_resolve_agent_filter(field, v)[1] for v in value]
+        return field, resolved
+
+    agent = agent_registry.closest(value)   # exact ID/name/IP, else the same name up to case/separators
+    if agent is None:
+        return field, value
+    if str(value).strip() == agent["ip"]:
+        canonical_field = "agent.ip"
+    elif agent_registry.get(value) is agent:
+        canonical_field = "agent.id"
+    else:
+        canonical_field = "agent.name"
+    canonical_value = agent[AGENT_FIELDS[canonical_field]]
+    if (canonical_field, canonical_value) != (field, value):
+        logger.info(f"Resolved agent filter {field}={value!r} → {canonical_field}={canonical_value!r}")
+    return canonical_field, canonical_value
+
+
 def validate_and_correct_plan(plan: Dict[str, Any], original_query: str, wazuh_client=None) -> Dict[str, Any]:
     """
     Validate and correct the GPT-generated query plan to ensure it works with DSL builder.
@@ -427,39 +591,12 @@ def validate_and_correct_plan(plan: Dict[str, Any], original_query: str, wazuh_c
     Args:
         plan: Query plan dict from GPT
         original_query: Original user query string
-        wazuh_client: Optional WazuhClient for agent validation
+        wazuh_client: Unused; agent references are resolved against the shared agent registry
         
     Returns:
         Corrected and validated plan dict
     """
-    # Valid field names in Wazuh
-    VALID_FIELDS = {
-        "rule.level", "rule.description", "rule.id", "rule.mitre.technique",
-        "agent.name", "agent.id", "agent.ip",
-        "data.srcip", "data.dstip", "data.srcuser", "data.dstuser",
-        "data.win.eventdata.targetUserName", "data.win.system.eventID",
-        "decoder.name", "decoder.parent",
-        "location", "full_log",
-        "timestamp", "@timestamp"
-    }
-    
-    # Common field name corrections
-    FIELD_CORRECTIONS = {
-        "severity": "rule.level",
-        "level": "rule.level",
-        "agent": "agent.name",
-        "host": "agent.name",
-        "hostname": "agent.name",
-        "source_ip": "data.srcip",
-        "src_ip": "data.srcip",
-        "destination_ip": "data.dstip",
-        "dst_ip": "data.dstip",
-        "user": "data.srcuser",
-        "username": "data.srcuser",
-        "event_id": "data.win.system.eventID",
-        "eventid": "data.win.system.eventID",
-    }
-    
+    # Known fields come from the index mapping (field_registry)
     VALID_OPERATORS = {"eq", "neq", "gt", "gte", "lt", "lte", "contains", "in"}
     
     # Ensure required fields exist
@@ -484,13 +621,13 @@ def validate_and_correct_plan(plan: Dict[str, Any], original_query: str, wazuh_c
         value = filter_item.get("value")
         
         # Correct field name if needed
-        if field not in VALID_FIELDS:
+        if not field_registry.is_known(field):
             corrected_field = FIELD_CORRECTIONS.get(field.lower(), field)
             if corrected_field != field:
                 logger.info(f"Corrected field '{field}' → '{corrected_field}'")
                 field = corrected_field
-            elif field not in VALID_FIELDS:
-                logger.warning(f"Unknown field '{field}', keeping as-is")
+            else:
+                logger.warning(f"Unknown field '{field}' (not in the index mapping), keeping as-is")
         
         # Validate operator
         if op not in VALID_OPERATORS:
@@ -502,6 +639,10 @@ def validate_and_correct_plan(plan: Dict[str, Any], original_query: str, wazuh_c
             logger.warning(f"Filter has empty value, skipping: {filter_item}")
             continue
         
+        # Resolve agent references against the registry (name given as ID/IP, wrong case, "1" vs "001")
+        if field in AGENT_FIELDS and op in ("eq", "neq", "in"):
+            field, value = _resolve_agent_filter(field, value)
+        
         corrected_filters.append({
             "field": field,
             "op": op,
@@ -543,94 +684,134 @@ def validate_and_correct_plan(plan: Dict[str, Any], original_query: str, wazuh_c
     return plan
 
 
-async def parse_query_to_plan(user_query: str, wazuh_client=None) -> Dict[str, Any]:
+# Validated plans keyed by (normalized query, agent-context version)
+plan_cache = TTLCache(
+    max_entries=settings.PLAN_CACHE_SIZE,
+    ttl=settings.PLAN_CACHE_TTL,
+    max_bytes=settings.PLAN_CACHE_MAX_BYTES,
+)
+
+
+def _plan_is_relative(plan: Dict[str, Any]) -> bool:
+    """True if the plan's time range is expressed with date math relative to 'now'."""
+    time_range = plan.get("time") or {}
+    return all(str(time_range.get(k, "now")).startswith("now") for k in ("from", "to"))
+
+
+def _plan_cache_ttl(plan: Dict[str, Any]) -> float:
+    """
+    Relative plans ("now-24h") stay correct indefinitely, so they get the full TTL.
+    Plans with absolute timestamps are only reused until the end of the current time bucket.
+    """
+    if _plan_is_relative(plan):
+        return settings.PLAN_CACHE_TTL
+    bucket = settings.PLAN_CACHE_TIME_BUCKET
+    return bucket - (time.time() % bucket)
+
+
+def _plan_is_valid(plan: Dict[str, Any]) -> bool:
+    """The checks /query/nl runs before executing a plan (schema, index, time window, filters)."""
+    try:
+        search_plan = WazuhSearchPlan(**plan)
+        validate_filters(search_plan.filters or [])
+        validate_filters(search_plan.must_not or [])
+    except (TypeError, ValueError):   # pydantic's ValidationError is a ValueError
+        return False
+    return (is_index_allowed(search_plan.indices)
+            and enforce_time_window(search_plan.time.from_, search_plan.time.to))
+
+
+def _store_plan(cache_key: tuple, plan: Dict[str, Any]):
+    # Only cache plans that will execute - a rejected plan must not be replayed until the TTL expires
+    if settings.PLAN_CACHE_ENABLED and _plan_is_valid(plan):
+        plan_cache.set(cache_key, copy.deepcopy(plan), ttl=_plan_cache_ttl(plan),
+                       size=len(dumps(plan)))
+
+
+def plan_cache_stats() -> Dict[str, Any]:
+    return {**plan_cache.stats(), "plans": plan_cache.entries()}
+
+
+async def parse_query_to_plan(user_query: str, wazuh_client=None,
+                              agent_ctx: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Parse natural language for ADVANCED_PIPELINE (Indexer) - returns WazuhSearchPlan dict.
     
     Args:
         user_query: Natural language query from user
         wazuh_client: Optional WazuhClient instance for fetching agent context
+        agent_ctx: Agent context already fetched by the caller (skips the fetch)
         
     Returns:
         Dict containing WazuhSearchPlan structure with validated fields
     """
-    from datetime import datetime, timezone
-    
-    # Fetch agent context to prevent hallucination
-    agent_context_str = ""
-    if wazuh_client:
-        try:
-            agent_ctx = await get_agent_context(wazuh_client)
-            if agent_ctx.get("agents"):
-                agent_context_str = f"\n\n**AVAILABLE AGENTS (use ONLY these agent names/IDs):**\n{format_agent_context(agent_ctx['agents'])}\n"
-        except Exception as e:
-            logger.warning(f"Could not fetch agent context: {e}")
-    
-    # Add time context for relative queries
-    now = datetime.now(timezone.utc)
-    time_context = f"""
-**CURRENT TIME CONTEXT:**
-- UTC Now: {now.strftime('%Y-%m-%d %H:%M:%S UTC')}
-- Use this for calculating "today", "yesterday", "this week", "recent"
-"""
-    
-    # Add common rules context
-    rules_context = """
-**COMMON WAZUH RULES (reference these when user mentions security events):**
-- Rule 5710: SSH - Attempt to login using non-existent user
-- Rule 5551: SSH - Multiple authentication failures
-- Rule 5503: PAM - User login failed
-- Rule 60204: Windows - User Logon Failure (EventID 4625)
-- Rule 87801: Windows - Possible Brute Force Attack
-- Rule 5502: User missed password multiple times
-- Rule 5720: SSH - Brute force attack attempt
-- Rule 31101: FIM - File added to system
-- Rule 31103: FIM - File modified
-- Rule 80790: Vulnerability detected in system
-"""
-    
-    # Add decoder context
-    decoder_context = """
-**LOG SOURCES (decoder.name field - use for filtering by log type):**
-- sshd: SSH authentication/connection logs
-- pam: Linux PAM authentication
-- windows: Windows event logs
-- json: JSON-formatted application logs
-- web-accesslog: Apache/Nginx web access
-- firewall: Firewall logs
-- aws-cloudtrail: AWS CloudTrail
-- docker: Docker container logs
-"""
-    
-    # Add field examples
-    field_examples = """
-**FIELD VALUE EXAMPLES:**
-- rule.level: 0-15 (0=info, 3=low, 5+=notable, 7+=important, 10+=critical, 12+=attack, 15=severe)
-- agent.os.platform: linux, windows, darwin
-- data.win.system.eventID: 4624 (success), 4625 (failed), 4672 (admin), 4720 (user created)
-- rule.mitre.technique: T1110 (Brute Force), T1078 (Valid Accounts), T1059 (Command Execution)
-"""
-    
-    system_prompt = f"""You are a Wazuh SIEM query translator. Convert natural language security queries into structured JSON for OpenSearch/Elasticsearch queries.
+    # Templated queries ("critical alerts last 6 hours") are planned locally without GPT
+    if settings.LOCAL_PLANNER_ENABLED:
+        local_plan = plan_query_locally(user_query)
+        if local_plan is not None:
+            return validate_and_correct_plan(local_plan, user_query, wazuh_client)
+
+    # Fetch agent context to prevent hallucination (unless the caller prefetched it)
+    if agent_ctx is None:
+        agent_ctx = {"agents": [], "version": ""}
+        if wazuh_client:
+            try:
+                agent_ctx = await get_agent_context(wazuh_client)
+            except Exception as e:
+                logger.warning(f"Could not fetch agent context: {e}")
+
+    cache_key = (normalize_query(user_query), agent_ctx.get("version", ""))
+    if settings.PLAN_CACHE_ENABLED:
+        cached = plan_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Plan cache hit for '{cache_key[0]}'")
+            return copy.deepcopy(cached)
+
+    parsed = await _parse_query_to_plan_llm(user_query, agent_ctx, wazuh_client)
+    if parsed is not None:
+        _store_plan(cache_key, parsed)
+        return parsed
+
+    # Default fallback (not cached so the next request retries GPT)
+    return {
+        "indices": "wazuh-alerts-*",
+        "time": {"from": "now-24h", "to": "now", "timezone": "UTC"},
+        "filters": [],
+        "must_not": [],
+        "query_string": None,
+        "aggregation": None,
+        "limit": 50,
+        "dry_run": False
+    }
+
 
-**IMPORTANT: Use ONLY the exact field names listed below. DO NOT invent field names.**{agent_context_str}{time_context}{rules_context}{decoder_context}{field_examples}
+# Planner prompt sections. The core (schema, fields, severity/time rules) is always sent;
+# the reference sections and examples are either all sent (PLANNER_PROMPT_STATIC) or picked
+# per query by the example index (PLANNER_RETRIEVAL). Static parts are rendered once at import
+# and sent first, in a fixed order, so the provider's prompt cache can reuse the prefix; the
+# per-call context (agents, current time) goes last - see planner_context().
+_PLANNER_HEADER = """You are a Wazuh SIEM query translator. Convert natural language security queries into structured JSON for OpenSearch/Elasticsearch queries.
 
+**IMPORTANT: Use ONLY the exact field names listed below. DO NOT invent field names.**
+"""
+
+_PLANNER_SCHEMA = """
 Output ONLY valid JSON matching this WazuhSearchPlan schema:
-{{
+{
   "indices": "wazuh-alerts-*",
-  "time": {{
+  "time": {
     "from": "now-24h",
     "to": "now",
     "timezone": "UTC"
-  }},
+  },
   "filters": [
-    {{"field": "rule.level", "op": "gte", "value": 12}}
+    {"field": "rule.level", "op": "gte", "value": 12}
   ],
   "must_not": [],
   "query_string": null,
   "aggregation": null,
   "limit": 50,
   "dry_run": false
-}}
+}
 
 **VALID OPERATORS:** "eq", "neq", "gt", "gte", "lt", "lte", "contains", "in"
 
@@ -660,95 +841,190 @@ Output ONLY valid JSON matching this WazuhSearchPlan schema:
 - full_log (full log message - use "contains" operator)
 - timestamp (ISO timestamp)
 - @timestamp (ISO timestamp)
+"""
 
-**CRITICAL SECURITY EVENT MAPPINGS:**
-
-1. **Failed Login Attempts:**
-   - SSH Failed: {{"field": "decoder.name", "op": "eq", "value": "sshd"}} AND {{"field": "rule.id", "op": "in", "value": ["5710", "5551", "5503"]}}
-   - Windows Failed: {{"field": "data.win.system.eventID", "op": "eq", "value": "4625"}}
-   - Linux PAM: {{"field": "decoder.name", "op": "eq", "value": "pam"}} AND {{"field": "rule.level", "op": "gte", "value": 5}}
-   
-2. **Successful Logins:**
-   - Windows Success: {{"field": "data.win.system.eventID", "op": "eq", "value": "4624"}}
-   - SSH Success: {{"field": "rule.id", "op": "eq", "value": "5715"}}
-
-3. **Brute Force Detection:**
-   - Use failed login filters (above)
-   - Set limit to 100-200 to capture patterns
-   - Add rule.level >= 7 for confirmed attacks
-   - Consider aggregation by data.srcip
-
-4. **File Integrity Monitoring:**
-   - File Added: {{"field": "rule.id", "op": "eq", "value": "31101"}}
-   - File Modified: {{"field": "rule.id", "op": "eq", "value": "31103"}}
-   - File Deleted: {{"field": "rule.id", "op": "eq", "value": "31102"}}
-
-5. **Privilege Escalation:**
-   - MITRE T1548: {{"field": "rule.mitre.technique", "op": "contains", "value": "T1548"}}
-   - Windows Admin Logon: {{"field": "data.win.system.eventID", "op": "eq", "value": "4672"}}
-
-6. **Severity Levels:**
+_PLANNER_SEVERITY_TIME = """
+**Severity Levels:**
    - ONLY add severity filter if explicitly mentioned in query
    - critical/severe → rule.level >= 12
    - high → rule.level >= 8
    - medium → rule.level >= 5
    - low → rule.level >= 3
 
-4. **Time Formats:**
-   - "last 24 hours" → {{"from": "now-24h", "to": "now"}}
-   - "last hour" → {{"from": "now-1h", "to": "now"}}
-   - "last 15 minutes" → {{"from": "now-15m", "to": "now"}}
-   - "past week" → {{"from": "now-7d", "to": "now"}}
-   - "yesterday" → {{"from": "now-1d/d", "to": "now/d"}}
+**Time Formats:**
+   - "last 24 hours" → {"from": "now-24h", "to": "now"}
+   - "last hour" → {"from": "now-1h", "to": "now"}
+   - "last 15 minutes" → {"from": "now-15m", "to": "now"}
+   - "past week" → {"from": "now-7d", "to": "now"}
+   - "yesterday" → {"from": "now-1d/d", "to": "now/d"}
 
 **AGENT NAMES:**
-- If query mentions agent but doesn't specify name → use {{"field": "agent.name", "op": "contains", "value": "*"}}
+- If query mentions agent but doesn't specify name → use {"field": "agent.name", "op": "contains", "value": "*"}
 - If uncertain about exact agent name → use wildcard or omit the filter
 - Common agents: "Ubuntu", "Windows", "CentOS", etc.
+"""
 
-**QUERY EXAMPLES:**
+_PLANNER_FOOTER = """
+**RESPOND WITH JSON ONLY. NO EXPLANATIONS.**
+"""
 
-Input: "Show me high-severity failed login attempts from the last 24 hours"
-Output:
-{{
-  "indices": "wazuh-alerts-*",
-  "time": {{"from": "now-24h", "to": "now", "timezone": "UTC"}},
-  "filters": [
-    {{"field": "rule.level", "op": "gte", "value": 8}},
-    {{"field": "decoder.name", "op": "in", "value": ["sshd", "pam", "windows"]}}
-  ],
-  "must_not": [],
-  "query_string": null,
-  "aggregation": null,
-  "limit": 100,
-  "dry_run": false
-}}
+# Reference sections, in prompt order. Keys are what the example index retrieves.
+PLANNER_REFERENCE_SECTIONS = {
+    "rules": """
+**COMMON WAZUH RULES (reference these when user mentions security events):**
+- Rule 5710: SSH - Attempt to login using non-existent user
+- Rule 5551: SSH - Multiple authentication failures
+- Rule 5503: PAM - User login failed
+- Rule 60204: Windows - User Logon Failure (EventID 4625)
+- Rule 87801: Windows - Possible Brute Force Attack
+- Rule 5502: User missed password multiple times
+- Rule 5720: SSH - Brute force attack attempt
+- Rule 31101: FIM - File added to system
+- Rule 31103: FIM - File modified
+- Rule 80790: Vulnerability detected in system
+""",
+    "decoders": """
+**LOG SOURCES (decoder.name field - use for filtering by log type):**
+- sshd: SSH authentication/connection logs
+- pam: Linux PAM authentication
+- windows: Windows event logs
+- json: JSON-formatted application logs
+- web-accesslog: Apache/Nginx web access
+- firewall: Firewall logs
+- aws-cloudtrail: AWS CloudTrail
+- docker: Docker container logs
+""",
+    "field_values": """
+**FIELD VALUE EXAMPLES:**
+- rule.level: 0-15 (0=info, 3=low, 5+=notable, 7+=important, 10+=critical, 12+=attack, 15=severe)
+- agent.os.platform: linux, windows, darwin
+- data.win.system.eventID: 4624 (success), 4625 (failed), 4672 (admin), 4720 (user created)
+- rule.mitre.technique: T1110 (Brute Force), T1078 (Valid Accounts), T1059 (Command Execution)
+""",
+    "failed_logins": """
+**Failed Login Attempts:**
+   - SSH Failed: {"field": "decoder.name", "op": "eq", "value": "sshd"} AND {"field": "rule.id", "op": "in", "value": ["5710", "5551", "5503"]}
+   - Windows Failed: {"field": "data.win.system.eventID", "op": "eq", "value": "4625"}
+   - Linux PAM: {"field": "decoder.name", "op": "eq", "value": "pam"} AND {"field": "rule.level", "op": "gte", "value": 5}
+""",
+    "successful_logins": """
+**Successful Logins:**
+   - Windows Success: {"field": "data.win.system.eventID", "op": "eq", "value": "4624"}
+   - SSH Success: {"field": "rule.id", "op": "eq", "value": "5715"}
+""",
+    "brute_force": """
+**Brute Force Detection:**
+   - Use failed login filters (SSH rule.id 5710/5551/5503, Windows eventID 4625)
+   - Set limit to 100-200 to capture patterns
+   - Add rule.level >= 7 for confirmed attacks
+   - Consider aggregation by data.srcip
+""",
+    "fim": """
+**File Integrity Monitoring:**
+   - File Added: {"field": "rule.id", "op": "eq", "value": "31101"}
+   - File Modified: {"field": "rule.id", "op": "eq", "value": "31103"}
+   - File Deleted: {"field": "rule.id", "op": "eq", "value": "31102"}
+""",
+    "privilege_escalation": """
+**Privilege Escalation:**
+   - MITRE T1548: {"field": "rule.mitre.technique", "op": "contains", "value": "T1548"}
+   - Windows Admin Logon: {"field": "data.win.system.eventID", "op": "eq", "value": "4672"}
+""",
+}
 
-Input: "Get logs from last 15 minutes"
-Output:
-{{
-  "indices": "wazuh-alerts-*",
-  "time": {{"from": "now-15m", "to": "now", "timezone": "UTC"}},
-  "filters": [],
-  "must_not": [],
-  "query_string": null,
-  "aggregation": null,
-  "limit": 50,
-  "dry_run": false
-}}
+planner_examples = ExampleIndex(settings.PLANNER_EXAMPLES_PATH, PLANNER_REFERENCE_SECTIONS)
 
-**RESPOND WITH JSON ONLY. NO EXPLANATIONS.**
+
+def _render_examples(examples: List[Dict[str, Any]]) -> str:
+    if not examples:
+        return ""
+    rendered = "\n".join(f'Input: "{example["query"]}"\nOutput:\n{prompt_json(example["plan"])}\n'
+                         for example in examples)
+    return f"\n**QUERY EXAMPLES:**\n\n{rendered}"
+
+
+# Core plus every reference section: ~1.2k tokens, above the 1024-token minimum prefix that
+# OpenAI's prompt cache reuses (the core alone, ~630 tokens, is never cached)
+PLANNER_CACHED_PREFIX = (_PLANNER_HEADER + _PLANNER_SCHEMA + "\n**CRITICAL SECURITY EVENT MAPPINGS:**\n"
+                         + "".join(PLANNER_REFERENCE_SECTIONS.values()) + _PLANNER_SEVERITY_TIME)
+
+# Pre-retrieval planner prompt: every reference section and the default examples
+PLANNER_PROMPT_STATIC = (PLANNER_CACHED_PREFIX + _render_examples(planner_examples.default_examples())
+                         + _PLANNER_FOOTER)
+
+
+def planner_reference(user_query: str) -> str:
+    """
+    Query-specific part of the planner prompt (PLANNER_RETRIEVAL): the top-k most similar
+    curated examples and, if PLANNER_SECTIONS_K > 0, only the reference sections the query touches.
+    """
+    examples, section_names = planner_examples.select(
+        user_query, settings.PLANNER_EXAMPLES_K, settings.PLANNER_SECTIONS_K)
+    sections = "".join(PLANNER_REFERENCE_SECTIONS[name] for name in PLANNER_REFERENCE_SECTIONS
+                       if name in section_names)
+    return sections + _render_examples(examples)
+
+
+def planner_context(agent_ctx: Dict[str, Any], user_query: Optional[str] = None) -> str:
+    """
+    Volatile tail of the planner prompt: agents and the current time, rounded to the minute so
+    calls within the same minute share the whole prompt. With the user query, only the agents
+    it mentions (fuzzy agent index) are listed instead of the first 20 of the inventory;
+    fuzzy matches are offered as candidates only.
+    """
+    from datetime import datetime, timezone
+
+    context = ""
+    if agent_ctx.get("agents") and user_query is not None:
+        mentioned = agent_registry.mentioned_in(user_query)
+        if mentioned["exact"]:
+            context += (f"\n**AGENTS MENTIONED IN THE QUERY (use these exact agent names/IDs):**\n"
+                        f"{format_agent_context(mentioned['exact'])}\n")
+        if mentioned["candidates"]:
+            context += (f"\n**POSSIBLE AGENT MATCHES (similar names, NOT confirmed - only filter on one if the "
+                        f"query clearly refers to that agent):**\n{format_agent_context(mentioned['candidates'])}\n")
+        if not mentioned["exact"] and not mentioned["candidates"]:
+            context += (f"\n**AGENTS:** {len(agent_ctx['agents'])} agents registered, none of them named in the "
+                        f"query. Only add an agent filter if the query clearly asks for one.\n")
+    elif agent_ctx.get("agents"):
+        context += f"\n**AVAILABLE AGENTS (use ONLY these agent names/IDs):**\n{format_agent_context(agent_ctx['agents'])}\n"
+    now = datetime.now(timezone.utc)
+    context += f"""
+**CURRENT TIME CONTEXT:**
+- UTC Now: {now.strftime('%Y-%m-%d %H:%M UTC')}
+- Use this for calculating "today", "yesterday", "this week", "recent"
 """
-    
+    return context
+
+
+def build_planner_prompt(agent_ctx: Dict[str, Any], user_query: Optional[str] = None) -> str:
+    """
+    Build the ADVANCED_PIPELINE system prompt: static part first, then the query's retrieved
+    examples (PLANNER_RETRIEVAL) or the default ones, agent/time context last.
+
+    With PLANNER_SECTIONS_K = 0 (default) the static part is PLANNER_CACHED_PREFIX, long enough
+    for the provider's prompt cache; a positive PLANNER_SECTIONS_K also retrieves the reference
+    sections, which shortens the prompt but leaves a static part too short to be cached.
+    """
+    if settings.PLANNER_RETRIEVAL and user_query is not None:
+        static = (_PLANNER_HEADER + _PLANNER_SCHEMA + _PLANNER_SEVERITY_TIME
+                  if settings.PLANNER_SECTIONS_K else PLANNER_CACHED_PREFIX)
+        return static + planner_reference(user_query) + _PLANNER_FOOTER + planner_context(agent_ctx, user_query)
+    return PLANNER_PROMPT_STATIC + planner_context(agent_ctx, user_query)
+
+
+async def _parse_query_to_plan_llm(user_query: str, agent_ctx: Dict[str, Any],
+                                   wazuh_client=None) -> Optional[Dict[str, Any]]:
+    """Ask GPT-4o for a WazuhSearchPlan. Returns the validated plan dict, or None on failure."""
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
+        response = await gateway.chat(
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": build_planner_prompt(agent_ctx, user_query)},
                 {"role": "user", "content": user_query}
             ],
             response_format={"type": "json_object"},
-            temperature=0.0
+            temperature=0.0,
+            timeout=settings.LLM_PLANNER_TIMEOUT
         )
         
         content = response.choices[0].message.content
@@ -769,22 +1045,117 @@ Output:
         
     except Exception as e:
         logger.error(f"Advanced query parsing failed: {e}", exc_info=True)
-        # Default fallback
-        return {
-            "indices": "wazuh-alerts-*",
-            "time": {"from": "now-24h", "to": "now", "timezone": "UTC"},
-            "filters": [],
-            "must_not": [],
-            "query_string": None,
-            "aggregation": None,
-            "limit": 50,
-            "dry_run": False
-        }
+        return None
 
 
-async def format_results(query: str, results: Dict[str, Any]) -> str:
-    """Format results to natural language summary - sends only sample to GPT to avoid token limits."""
-    system_prompt = """You are a security analyst assistant. Convert technical Wazuh SIEM data into clear, actionable natural language summaries.
+COMBINED_PROMPT_HEADER = """You are a Wazuh SIEM query router AND query translator. In ONE response you must
+(1) decide which pipeline handles the user's query and (2) produce the query structure for that pipeline.
+
+Return JSON with EXACTLY this structure:
+{
+  "routing": {"pipeline": "SIMPLE_PIPELINE" or "ADVANCED_PIPELINE", "reasoning": "...", "confidence": "high" or "medium" or "low"},
+  "simple_query": <SIMPLE_PIPELINE structure, or null when pipeline is ADVANCED_PIPELINE>,
+  "plan": <WazuhSearchPlan, or null when pipeline is SIMPLE_PIPELINE>
+}
+
+The three sections below describe each part. Where a section says "Return JSON" / "Output ONLY valid JSON",
+that describes the value of the corresponding key above, not the whole response.
+"""
+
+
+_combined_prompt_static: Optional[str] = None
+
+
+def combined_prompt_static() -> str:
+    """Static part of the combined router/planner prompt, rendered once (prompt-cache friendly prefix)."""
+    global _combined_prompt_static
+    if _combined_prompt_static is None:
+        _combined_prompt_static = "\n\n".join([
+            COMBINED_PROMPT_HEADER,
+            "## ROUTING\n" + ROUTER_PROMPT,
+            "## SIMPLE_PIPELINE (\"simple_query\")\n" + SIMPLE_PARSER_PROMPT,
+            "## ADVANCED_PIPELINE (\"plan\")\n" + PLANNER_PROMPT_STATIC,
+        ])
+    return _combined_prompt_static
+
+
+async def route_and_plan(user_query: str, wazuh_client=None,
+                         agent_ctx: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Combined router + planner: one GPT call returns the pipeline choice together with the
+    simple-query operation or the WazuhSearchPlan (QUERY_PLANNING_MODE=combined).
+
+    Returns {"routing", "simple_query", "plan"}; simple_query/plan are None when the caller
+    should fall back to parse_simple_query / parse_query_to_plan. Cached or locally-classified
+    routes skip the combined call entirely (the follow-up planner call can hit the plan cache).
+    """
+    routing = lookup_cached_route(user_query)
+    if routing is not None:
+        return {"routing": routing, "simple_query": None, "plan": None}
+
+    if agent_ctx is None:
+        agent_ctx = await get_agent_context(wazuh_client) if wazuh_client else {"agents": [], "version": ""}
+
+    system_prompt = combined_prompt_static() + planner_context(agent_ctx, user_query)
+    try:
+        routing_stats["llm_calls"] += 1
+        response = await gateway.chat(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_query}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.0,
+            timeout=settings.LLM_PLANNER_TIMEOUT
+        )
+
+        content = response.choices[0].message.content
+        if not content:
+            raise ValueError("Combined router/planner returned empty response")
+
+        result = content.strip()
+        if result.startswith("```"):
+            result = result.split("\n", 1)[1].rsplit("```", 1)[0]
+        combined = json.loads(result)
+
+        routing = combined["routing"]
+        if routing.get("pipeline") not in ("SIMPLE_PIPELINE", "ADVANCED_PIPELINE"):
+            raise ValueError(f"Invalid pipeline in combined response: {routing.get('pipeline')}")
+        confidence_map = {"high": 0.95, "medium": 0.75, "low": 0.5}
+        confidence = routing.get("confidence", "medium")
+        if not isinstance(confidence, (int, float)):
+            confidence = confidence_map.get(confidence, 0.75)
+        routing["confidence"] = confidence
+        routing.setdefault("reasoning", "")
+        routing["source"] = "llm_combined"
+        _store_route(user_query, routing)
+
+        simple_query = None
+        plan = None
+        if routing["pipeline"] == "SIMPLE_PIPELINE":
+            simple_query = combined.get("simple_query")
+            if not isinstance(simple_query, dict) or "operation" not in simple_query:
+                simple_query = None
+            else:
+                simple_query.setdefault("filters", {"status": None, "agent_id": None})
+        elif isinstance(combined.get("plan"), dict):
+            plan = validate_and_correct_plan(combined["plan"], user_query, wazuh_client)
+            if _plan_is_valid(plan):
+                _store_plan((normalize_query(user_query), agent_ctx.get("version", "")), plan)
+            else:
+                # Let parse_query_to_plan ask again rather than fail (or cache) this plan
+                logger.warning(f"Combined reply plan failed validation, planning separately: {plan}")
+                plan = None
+
+        logger.info(f"Combined routing/planning: {routing['pipeline']} (plan={'yes' if plan else 'no'})")
+        return {"routing": dict(routing), "simple_query": simple_query, "plan": plan}
+
+    except Exception as e:
+        logger.error(f"Combined routing/planning failed, falling back to two-call flow: {e}", exc_info=True)
+        return {"routing": await route_query(user_query), "simple_query": None, "plan": None}
+
+
+SUMMARY_SYSTEM_PROMPT = """You are a security analyst assistant. Convert technical Wazuh SIEM data into clear, actionable natural language summaries.
 
 Provide:
 1. Brief summary (1-2 sentences)
@@ -793,8 +1164,25 @@ Provide:
 
 Be concise, specific, and security-focused."""
 
+
+# Totals for what the summary sampler sent to GPT (GET /admin/llm)
+sampling_stats = {"summaries": 0, "hits_seen": 0, "documents_sent": 0, "tokens_sent": 0}
+
+
+def _record_sampling(report: Dict[str, Any]):
+    sampling_stats["summaries"] += 1
+    sampling_stats["hits_seen"] += report["hits"]
+    sampling_stats["documents_sent"] += report["documents_sent"]
+    sampling_stats["tokens_sent"] += report["tokens"]
+    logger.info(f"Summary sample: {report['documents_sent']}/{report['hits']} documents "
+                f"({report['groups']} groups), ~{report['tokens']}/{report['budget']} tokens")
+
+
+def _build_summary_messages(query: str, results: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Build the format_results prompt - sends only a sample of the results to avoid token limits."""
     # Extract key metrics and sample data to avoid token limits
     summary_data = {}
+    stats_table = None
     
     if "hits" in results:
         # Indexer results
@@ -803,47 +1191,95 @@ Be concise, specific, and security-focused."""
         total_count = total.get("value", total) if isinstance(total, dict) else total
         
         documents = hits_data.get("hits", [])
+        stats_table = _hits_stats_table(results, documents, total)
+        if stats_table:
+            # Statistics cover the whole result set; a few examples add context
+            sample, report = sample_hits(documents, settings.SUMMARY_STATS_SAMPLE_TOKENS)
+        else:
+            sample, report = sample_hits(documents)
+        _record_sampling(report)
         
         summary_data = {
             "total_hits": total_count,
             "returned_count": len(documents),
-            "sample_documents": documents[:10]  # Only send first 10 docs
+            "distinct_groups": report["groups"],  # by rule.id / agent.name / data.srcip
+            "sample_documents": sample
         }
         
         # Extract aggregations if present
-        if "aggregations" in results:
-            summary_data["aggregations"] = results["aggregations"]
+        if _plan_aggregations(results):
+            summary_data["aggregations"] = _plan_aggregations(results)
+    
+    elif "responses" in results:
+        # Batched (_msearch) results - the token budget is split between the queries
+        summary_data = {"queries": []}
+        query_budget = settings.SUMMARY_TOKEN_BUDGET // max(len(results["responses"]), 1)
+        for response in results["responses"]:
+            entry = {"query": response.get("name")}
+            if "error" in response:
+                entry["error"] = str(response["error"])[:200]
+            else:
+                hits_data = response.get("hits", {})
+                total = hits_data.get("total", {})
+                entry["total_hits"] = total.get("value", total) if isinstance(total, dict) else total
+                entry["sample_documents"], report = sample_hits(hits_data.get("hits", []), query_budget)
+                _record_sampling(report)
+                if "aggregations" in response:
+                    entry["aggregations"] = response["aggregations"]
+            summary_data["queries"].append(entry)
     
     elif "data" in results and "affected_items" in results["data"]:
         # Wazuh Manager API results
         items = results["data"]["affected_items"]
+        sample, report = sample_items(items)
+        _record_sampling(report)
         summary_data = {
             "total_items": len(items),
-            "sample_items": items[:10]  # Only send first 10 items
+            "sample_items": sample
         }
     
     else:
         # Unknown format - send minimal data
         summary_data = {"raw": str(results)[:1000]}  # Truncate to 1000 chars
 
+    stats_section = f"Statistics over the results:\n{stats_table}\n\n" if stats_table else ""
     user_prompt = f"""Original query: {query}
 
-Wazuh data summary (showing sample of results):
-{json.dumps(summary_data, indent=2, default=str)}
+{stats_section}Wazuh data summary (showing sample of results):
+{prompt_json(summary_data)}
 
 Note: If total_hits/total_items > sample size, this is a representative sample.
 
 Provide a natural language summary of this security data."""
 
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def _fallback_summary(results: Dict[str, Any]) -> str:
+    """Plain count-based summary used when GPT is unavailable."""
+    if "data" in results and "affected_items" in results["data"]:
+        return f"Found {len(results['data']['affected_items'])} items from Wazuh Manager API."
+    elif "hits" in results:
+        total = results.get("hits", {}).get("total", {})
+        count = total.get("value", total) if isinstance(total, dict) else total
+        return f"Found {count} results from Wazuh Indexer."
+    elif "responses" in results:
+        return f"Ran {len(results['responses'])} queries against Wazuh Indexer."
+    else:
+        return "Retrieved results from Wazuh."
+
+
+async def format_results(query: str, results: Dict[str, Any]) -> str:
+    """Format results to natural language summary - sends only sample to GPT to avoid token limits."""
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+        response = await gateway.chat(
+            messages=_build_summary_messages(query, results),
             temperature=0.3,
-            max_tokens=500  # Limit output tokens
+            max_tokens=500,  # Limit output tokens
+            timeout=settings.LLM_SUMMARY_TIMEOUT
         )
         
         content = response.choices[0].message.content
@@ -851,12 +1287,22 @@ Provide a natural language summary of this security data."""
         
     except Exception as e:
         logger.error(f"Failed to format results: {e}", exc_info=True)
-        # Fallback summary
-        if "data" in results and "affected_items" in results["data"]:
-            return f"Found {len(results['data']['affected_items'])} items from Wazuh Manager API."
-        elif "hits" in results:
-            total = results.get("hits", {}).get("total", {})
-            count = total.get("value", total) if isinstance(total, dict) else total
-            return f"Found {count} results from Wazuh Indexer."
-        else:
-            return "Retrieved results from Wazuh."
+        return _fallback_summary(results)
+
+
+async def format_results_stream(query: str, results: Dict[str, Any]) -> AsyncIterator[str]:
+    """Streaming variant of format_results - yields summary text as GPT produces it."""
+    produced = False
+    try:
+        async for delta in gateway.stream_chat(
+            messages=_build_summary_messages(query, results),
+            temperature=0.3,
+            max_tokens=500,
+            timeout=settings.LLM_SUMMARY_TIMEOUT
+        ):
+            produced = True
+            yield delta
+    except Exception as e:
+        logger.error(f"Failed to stream results summary: {e}", exc_info=True)
+        if not produced:
+            yield _fallback_summary(results)
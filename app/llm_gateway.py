@@ -0,0 +1,196 @@
+from openai import AsyncOpenAI
+from app.config import settings
+from app.http_transport import create_async_client
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, List, Optional
+import asyncio
+import logging
+import time
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-4o-2024-11-20"
+
+
+def _usage_field(usage: Any, name: str) -> Any:
+    """Usage fields are attributes on typed responses but plain dicts on stream chunks."""
+    if usage is None:
+        return None
+    return usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+
+
+class LLMGateway:
+    """
+    Single entry point for every OpenAI chat completion made by the server.
+
+    - One shared, pooled HTTP client for all calls
+    - A semaphore caps concurrent requests to OpenAI; extra callers queue
+    - Each call gets a timeout budget that covers both queueing and the request itself
+    """
+    def __init__(self, max_concurrency: int, default_timeout: float):
+        self.default_timeout = default_timeout
+        self.http_client = create_async_client(
+            "openai",
+            timeout=httpx.Timeout(default_timeout, connect=10.0),
+            max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive=settings.LLM_POOL_MAX_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+            verify=True,
+        )
+        self.client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=self.http_client,
+            max_retries=settings.LLM_MAX_RETRIES,
+        )
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._metrics = {
+            "calls": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "in_flight": 0,
+            "queued": 0,
+            "max_queued": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "latency_total": 0.0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+        }
+
+    @asynccontextmanager
+    async def _slot(self, budget: float):
+        """
+        Wait for a concurrency slot within the timeout budget and hold it for the body.
+        Yields the absolute deadline (perf_counter) for the remaining work.
+        """
+        m = self._metrics
+        deadline = time.perf_counter() + budget
+
+        m["queued"] += 1
+        m["max_queued"] = max(m["max_queued"], m["queued"])
+        queued_at = time.perf_counter()
+        try:
+            # asyncio.timeout (not wait_for) so a permit acquired as the timeout fires is never leaked
+            async with asyncio.timeout(budget):
+                await self._semaphore.acquire()
+        except asyncio.TimeoutError:
+            m["timeouts"] += 1
+            logger.warning(f"LLM call timed out after {budget:.1f}s waiting for a slot ({m['queued']} queued)")
+            raise
+        finally:
+            m["queued"] -= 1
+
+        waited = time.perf_counter() - queued_at
+        m["queue_wait_total"] += waited
+        m["queue_wait_max"] = max(m["queue_wait_max"], waited)
+        m["in_flight"] += 1
+        m["calls"] += 1
+        started = time.perf_counter()
+        try:
+            yield deadline
+        except asyncio.TimeoutError:
+            m["timeouts"] += 1
+            raise
+        except Exception:
+            m["errors"] += 1
+            raise
+        finally:
+            m["latency_total"] += time.perf_counter() - started
+            m["in_flight"] -= 1
+            self._semaphore.release()
+
+    async def chat(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                   timeout: Optional[float] = None, **kwargs):
+        """
+        Run a chat completion through the concurrency limiter.
+
+        Raises asyncio.TimeoutError if the budget is spent waiting for a slot or on the request.
+        """
+        async with self._slot(timeout or self.default_timeout) as deadline:
+            remaining = max(deadline - time.perf_counter(), 0.1)
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(model=model, messages=messages, timeout=remaining, **kwargs),
+                timeout=remaining,
+            )
+        self._record_usage(getattr(response, "usage", None))
+        return response
+
+    def _record_usage(self, usage):
+        """
+        Count prompt tokens and the share served from the provider's prompt cache
+        (usage.prompt_tokens_details.cached_tokens; absent on older API responses).
+        """
+        if usage is None:
+            return
+        cached = _usage_field(_usage_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+        prompt_tokens = _usage_field(usage, "prompt_tokens") or 0
+        self._metrics["prompt_tokens"] += prompt_tokens
+        self._metrics["cached_tokens"] += cached
+        logger.info(f"LLM usage: {prompt_tokens} prompt tokens ({cached} cached), "
+                    f"{_usage_field(usage, 'completion_tokens') or 0} completion tokens")
+
+    async def stream_chat(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                          timeout: Optional[float] = None, **kwargs) -> AsyncIterator[str]:
+        """
+        Streaming variant of chat(): yields content deltas as OpenAI produces them.
+        The slot is held until the stream is exhausted; the budget covers the whole stream.
+        Usage arrives in a final chunk (stream_options.include_usage) and is recorded like chat().
+        """
+        # openai 1.3.7 has no stream_options argument; send it in the request body
+        extra_body = {**(kwargs.pop("extra_body", None) or {}), "stream_options": {"include_usage": True}}
+        async with self._slot(timeout or self.default_timeout) as deadline:
+            remaining = max(deadline - time.perf_counter(), 0.1)
+            stream = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=model, messages=messages, stream=True, timeout=remaining,
+                    extra_body=extra_body, **kwargs),
+                timeout=remaining,
+            )
+            try:
+                chunks = stream.__aiter__()
+                while True:
+                    remaining = max(deadline - time.perf_counter(), 0.1)
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+                    except StopAsyncIteration:
+                        break
+                    usage = getattr(chunk, "usage", None)
+                    if usage:
+                        self._record_usage(usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                # Timeout, cancellation or the consumer stopping early: give the connection back to the pool
+                await stream.response.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of gateway counters for the admin endpoint."""
+        m = self._metrics
+        calls = m["calls"] or 1
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": m["in_flight"],
+            "queued": m["queued"],
+            "max_queued": m["max_queued"],
+            "calls": m["calls"],
+            "errors": m["errors"],
+            "timeouts": m["timeouts"],
+            "avg_queue_wait_ms": round(m["queue_wait_total"] / calls * 1000, 2),
+            "max_queue_wait_ms": round(m["queue_wait_max"] * 1000, 2),
+            "avg_latency_ms": round(m["latency_total"] / calls * 1000, 2),
+            "prompt_tokens": m["prompt_tokens"],
+            "cached_tokens": m["cached_tokens"],
+            "prompt_cache_hit_ratio": (round(m["cached_tokens"] / m["prompt_tokens"], 4)
+                                       if m["prompt_tokens"] else None),
+        }
+
+    async def close(self):
+        await self.http_client.aclose()
+
+
+gateway = LLMGateway(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    default_timeout=settings.LLM_DEFAULT_TIMEOUT,
+)
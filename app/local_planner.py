@@ -0,0 +1,199 @@
+from app.agent_registry import agent_registry
+from app.config import settings
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Vocabulary shared with the GPT planner prompt (build_planner_prompt) and validate_and_correct_plan
+SEVERITY_LEVELS = {"critical": 12, "severe": 12, "high": 8, "medium": 5, "low": 3}
+
+# Failed-login rules from the planner's COMMON WAZUH RULES reference (SSH, PAM, Windows 4625)
+FAILED_LOGIN_RULES = ["5710", "5551", "5503", "5502", "5720", "60204"]
+# Qualified failed logins, as in the planner prompt's AUTHENTICATION QUERIES reference
+FAILED_LOGIN_FILTERS = {
+    "ssh": [{"field": "decoder.name", "op": "eq", "value": "sshd"},
+            {"field": "rule.id", "op": "in", "value": ["5710", "5551", "5503"]}],
+    "windows": [{"field": "data.win.system.eventID", "op": "eq", "value": "4625"}],
+}
+
+# Common field name corrections for GPT plans (validate_and_correct_plan)
+FIELD_CORRECTIONS = {
+    "severity": "rule.level",
+    "level": "rule.level",
+    "agent": "agent.name",
+    "host": "agent.name",
+    "hostname": "agent.name",
+    "source_ip": "data.srcip",
+    "src_ip": "data.srcip",
+    "destination_ip": "data.dstip",
+    "dst_ip": "data.dstip",
+    "user": "data.srcuser",
+    "username": "data.srcuser",
+    "event_id": "data.win.system.eventID",
+    "eventid": "data.win.system.eventID",
+}
+
+UNIT_DAYS = {"m": 1 / 1440, "h": 1 / 24, "d": 1, "w": 7}
+TIME_UNITS = {"m": "m", "min": "m", "mins": "m", "minute": "m", "minutes": "m",
+              "h": "h", "hr": "h", "hrs": "h", "hour": "h", "hours": "h",
+              "d": "d", "day": "d", "days": "d", "w": "w", "week": "w", "weeks": "w"}
+
+_IP = r"\d{1,3}(?:\.\d{1,3}){3}"
+_TIME_N = re.compile(r"\b(?:in |over |during )?(?:the )?(?:last|past|previous) (\d+) ?(" + "|".join(TIME_UNITS) + r")\b")
+_TIME_ONE = re.compile(r"\b(?:in |over |during )?(?:the )?(?:last|past|previous) (minute|hour|day|week)\b")
+_TIME_NAMED = re.compile(r"\b(today|yesterday|this week)\b")
+_SEVERITY = re.compile(r"\b(critical|severe|high|medium|low)(?:[ -](?:severity|level|priority))?\b")
+_LEVEL = re.compile(r"\b(?:rule )?level (?:>= ?|of )?(\d{1,2})(?: (?:and above|or higher|or above|\+)|\+)?")
+_FAILED_LOGIN = re.compile(r"\b(?:(ssh|windows) )?(?:failed|unsuccessful|failing) (?:(ssh|user|windows) )?"
+                           r"(?:log ?ins?|logons?|sign ?ins?|authentications?)(?: attempts?)?\b"
+                           r"|\b(?:(ssh|windows) )?(?:login|logon|authentication) failures?\b")
+_RULE_ID = re.compile(r"\brule (?:id )?(\d{3,6})\b")
+_SRC_IP = re.compile(rf"\b(?:from|by|source ip|source|src ip|srcip|ip) ({_IP})\b")
+# "<field word> <value>" pairs, field words taken from FIELD_CORRECTIONS (agent/level have their own rules)
+_FIELD_VALUE = re.compile(r"\b(user|username|event[ _]?id|source[ _]ip|src[ _]ip|destination[ _]ip|dst[ _]ip)"
+                          r"(?: is| =|:)? ([\w.@$-]+)")
+_AGENT = re.compile(r"\b(?:(?:on|for|from) )?(?:the )?(agent|host|server|machine|endpoint|on|for|from)[ :]([\w.-]+)")
+
+SUBJECT_WORDS = {"alert", "alerts", "log", "logs", "event", "events"}
+FILLER_WORDS = SUBJECT_WORDS | {
+    "show", "me", "list", "get", "find", "display", "give", "fetch", "all", "any", "the", "a", "an",
+    "of", "in", "on", "for", "from", "over", "during", "with", "and", "please", "what", "which",
+    "are", "were", "there", "recent", "recently", "latest", "security", "wazuh", "my", "i", "see",
+}
+
+local_planner_stats = {"attempts": 0, "hits": 0, "time_us_total": 0.0}
+
+
+def _take(pattern: re.Pattern, text: str) -> Tuple[Optional[re.Match], str]:
+    """First match of `pattern` and the text with the match blanked out."""
+    match = pattern.search(text)
+    if match is None:
+        return None, text
+    return match, text[:match.start()] + " " + text[match.end():]
+
+
+def _time_range(text: str) -> Tuple[Optional[Dict[str, str]], str]:
+    """Time range of the query (default last 24h); None if it exceeds TIME_MAX_DAYS."""
+    match, text = _take(_TIME_N, text)
+    if match:
+        unit = TIME_UNITS[match.group(2)]
+        if int(match.group(1)) * UNIT_DAYS[unit] > settings.TIME_MAX_DAYS:
+            return None, text
+        return {"from": f"now-{match.group(1)}{unit}", "to": "now"}, text
+    match, text = _take(_TIME_ONE, text)
+    if match:
+        return {"from": f"now-1{TIME_UNITS[match.group(1)]}", "to": "now"}, text
+    match, text = _take(_TIME_NAMED, text)
+    if match:
+        return {"today": {"from": "now/d", "to": "now"},
+                "yesterday": {"from": "now-1d/d", "to": "now/d"},
+                "this week": {"from": "now/w", "to": "now"}}[match.group(1)], text
+    return {"from": "now-24h", "to": "now"}, text
+
+
+def _parse(query: str) -> Optional[Dict[str, Any]]:
+    text = re.sub(r"\s+", " ", query.lower()).strip().rstrip("?!. ")
+    if not SUBJECT_WORDS.intersection(text.split()) and not _FAILED_LOGIN.search(text):
+        return None
+
+    filters: List[Dict[str, Any]] = []
+    limit = 50
+    time_range, text = _time_range(text)
+    if time_range is None:
+        return None   # longer than TIME_MAX_DAYS - let GPT decide how to handle it
+
+    match, text = _take(_FAILED_LOGIN, text)
+    if match:
+        qualifier = match.group(1) or match.group(2) or match.group(3)
+        if qualifier in FAILED_LOGIN_FILTERS:
+            filters.extend(dict(f) for f in FAILED_LOGIN_FILTERS[qualifier])
+        else:
+            filters.append({"field": "rule.id", "op": "in", "value": list(FAILED_LOGIN_RULES)})
+        limit = 100
+
+    match, text = _take(_LEVEL, text)
+    if match:
+        filters.append({"field": "rule.level", "op": "gte", "value": int(match.group(1))})
+    else:
+        match, text = _take(_SEVERITY, text)
+        if match:
+            filters.append({"field": "rule.level", "op": "gte", "value": SEVERITY_LEVELS[match.group(1)]})
+
+    match, text = _take(_RULE_ID, text)
+    if match:
+        filters.append({"field": "rule.id", "op": "eq", "value": match.group(1)})
+
+    match, text = _take(_SRC_IP, text)
+    if match and not agent_registry.by_ip(match.group(1)):
+        filters.append({"field": "data.srcip", "op": "eq", "value": match.group(1)})
+    elif match:
+        filters.append({"field": "agent.ip", "op": "eq", "value": match.group(1)})
+
+    # "user admin and user root" means either user: repeated fields become one "in" filter
+    field_values: Dict[str, List[str]] = {}
+    while True:
+        match, text = _take(_FIELD_VALUE, text)
+        if match is None:
+            break
+        field = FIELD_CORRECTIONS[re.sub(r"[ _]", "", match.group(1)).replace("ip", "_ip")]
+        field_values.setdefault(field, []).append(match.group(2))
+    for field, values in field_values.items():
+        if any(f["field"] == field for f in filters):
+            return None   # also set by another rule ("from 1.2.3.4 ... src ip 5.6.7.8") - let GPT decide
+        values = list(dict.fromkeys(values))
+        if len(values) == 1:
+            filters.append({"field": field, "op": "eq", "value": values[0]})
+        else:
+            filters.append({"field": field, "op": "in", "value": values})
+
+    match = _AGENT.search(text)
+    if match and match.group(2) not in FILLER_WORDS:
+        agent = agent_registry.closest(match.group(2))
+        if agent is None:
+            return None   # names an agent we don't know - let GPT (and the agent context) decide
+        filters.append({"field": "agent.name", "op": "eq", "value": agent["name"]})
+        text = text[:match.start()] + " " + text[match.end():]
+
+    leftovers = [word for word in re.findall(r"[\w.-]+", text) if word not in FILLER_WORDS]
+    if leftovers:
+        return None   # words the grammar doesn't understand - not confident enough
+
+    return {
+        "indices": "wazuh-alerts-*",
+        "time": {**time_range, "timezone": "UTC"},
+        "filters": filters,
+        "must_not": [],
+        "query_string": None,
+        "aggregation": None,
+        "limit": limit,
+        "dry_run": False,
+    }
+
+
+def plan_query_locally(user_query: str) -> Optional[Dict[str, Any]]:
+    """
+    Deterministic planner for common query shapes ("critical alerts last 6 hours",
+    "failed logins on web-01", "alerts from 203.0.113.7"). Returns a WazuhSearchPlan dict
+    when every word of the query is understood, None when GPT should plan it.
+    """
+    started = time.perf_counter()
+    plan = _parse(user_query)
+    local_planner_stats["attempts"] += 1
+    local_planner_stats["time_us_total"] += (time.perf_counter() - started) * 1e6
+    if plan is not None:
+        local_planner_stats["hits"] += 1
+        logger.info(f"Query planned locally: {plan['filters']} {plan['time']}")
+    return plan
+
+
+def local_planner_report() -> Dict[str, Any]:
+    attempts = local_planner_stats["attempts"]
+    return {
+        "attempts": attempts,
+        "hits": local_planner_stats["hits"],
+        "hit_rate": round(local_planner_stats["hits"] / attempts, 4) if attempts else None,
+        "avg_time_us": round(local_planner_stats["time_us_total"] / attempts, 1) if attempts else None,
+    }
@@ -1,20 +1,43 @@
 # FastAPI Server
 # Full endpoint for wazuh.search 
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError
+from typing import Optional, Tuple
 from .schemas import WazuhSearchPlan
 from .validators import is_index_allowed, validate_filters, enforce_time_window
 from .dsl_builder import build_dsl
-from .es_client import validate_query, execute_query
-from .llm_client import ask_openai
+from .es_client import (
+    validate_query, cached_search, cached_msearch, close_clients,
+    result_cache, result_cache_stats, cache_headers, split_batch_queries,
+    open_pit, is_export_pit, export_pages, encode_cursor, decode_cursor,
+)
+from .llm_client import (
+    ask_openai, normalize_query,
+    routing_cache, routing_cache_stats,
+    plan_cache, plan_cache_stats,
+    planner_examples,
+)
+from .llm_gateway import gateway as llm_gateway
+from .agent_registry import agent_registry
+from .field_registry import field_registry
+from .local_planner import local_planner_report
+from .http_transport import transport_stats
+from .serialization import DefaultResponse, dumps
 from .wazuh_client import WazuhClient
 from .config import settings
 from mcp import MCPHandlers
+import asyncio
+import csv
+import io
+import json
 import logging
+import re
+import time
 
-app = FastAPI(title = "MCP Server for Wazuh")
+app = FastAPI(title = "MCP Server for Wazuh", default_response_class=DefaultResponse)
 
 # CORS - allow all origins for development (restrict in production)
 app.add_middleware(
@@ -36,13 +59,22 @@ async def startup_event():
     wazuh_client = WazuhClient(wazuh_url, settings.WAZUH_API_USERNAME, settings.WAZUH_API_PASSWORD)
     await wazuh_client.authenticate()
     
-    # Initialize MCP handlers
+    # Keep the JWT fresh in the background
+    wazuh_client.tokens.start()
+    
+    # Initialize MCP handlers (shares wazuh_client's connection pool and token)
     mcp_handlers = MCPHandlers(
         wazuh_url=wazuh_url,
         username=settings.WAZUH_API_USERNAME,
-        password=settings.WAZUH_API_PASSWORD
+        password=settings.WAZUH_API_PASSWORD,
+        client=wazuh_client
     )
-    await mcp_handlers.client.authenticate()
+    
+    # Agent inventory is loaded and kept fresh in the background
+    agent_registry.start(wazuh_client)
+    
+    # Field types: disk cache now, index mappings in the background
+    field_registry.start()
     
     if wazuh_client.token:
         logging.info(f"✓ Wazuh authenticated successfully")
@@ -54,12 +86,18 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup resources on shutdown"""
     global wazuh_client, mcp_handlers
+    await agent_registry.stop()
+    await field_registry.stop()
     if wazuh_client:
         await wazuh_client.close()
         logging.info("✓ Wazuh client closed")
     if mcp_handlers:
         await mcp_handlers.close()
         logging.info("✓ MCP handlers closed")
+    await close_clients()
+    logging.info("✓ Indexer clients closed")
+    await llm_gateway.close()
+    logging.info("✓ LLM gateway closed")
 
 @app.get("/")
 def home():
@@ -103,9 +141,105 @@ async def test_wazuh_connection():
         "sample_agents": [{"id": a["id"], "name": a["name"], "status": a["status"]} for a in agents[:3]]
     }
 
+@app.get("/admin/llm")
+async def llm_gateway_stats():
+    """LLM gateway concurrency and queueing metrics, plus what the summary sampler sent"""
+    from .llm_client import sampling_stats
+    return {**llm_gateway.stats(), "summary_sampling": sampling_stats}
+
+@app.get("/admin/transport")
+async def get_transport_stats():
+    """Outbound connection pools: requests, new connections, TLS handshakes and reuse ratio per client"""
+    return transport_stats()
+
+@app.get("/admin/wazuh/token")
+async def wazuh_token_stats():
+    """Wazuh API token expiry and refresh counters"""
+    if not wazuh_client:
+        raise HTTPException(status_code=503, detail="Wazuh client not initialized")
+    return wazuh_client.tokens.stats()
+
+@app.get("/admin/cache/routing")
+async def get_routing_cache_stats():
+    """Routing cache hit/miss counters"""
+    return routing_cache_stats()
+
+@app.delete("/admin/cache/routing")
+async def invalidate_routing_cache(query: Optional[str] = None):
+    """Drop one cached routing decision (?query=...) or the whole routing cache"""
+    if query:
+        removed = 1 if routing_cache.invalidate(normalize_query(query)) else 0
+    else:
+        removed = routing_cache.clear()
+    return {"invalidated": removed}
+
+@app.get("/admin/cache/plans")
+async def get_plan_cache_stats():
+    """Plan cache counters plus per-plan hit counts"""
+    return plan_cache_stats()
+
+@app.delete("/admin/cache/plans")
+async def invalidate_plan_cache():
+    """Drop all cached search plans"""
+    return {"invalidated": plan_cache.clear()}
+
+@app.get("/admin/planning")
+async def get_planning_stats():
+    """Per planning-mode latency (routing + plan ready) and plan validity rate"""
+    report = {"default_mode": settings.QUERY_PLANNING_MODE, "modes": {}}
+    for mode, stats in planning_stats.items():
+        requests = stats["requests"]
+        checked = stats["valid_plans"] + stats["invalid_plans"]
+        report["modes"][mode] = {
+            "requests": requests,
+            "simple": stats["simple"],
+            "advanced": stats["advanced"],
+            "avg_plan_ready_ms": round(stats["plan_ready_ms_total"] / requests, 1) if requests else None,
+            "valid_plan_rate": round(stats["valid_plans"] / checked, 4) if checked else None,
+        }
+    report["local_planner"] = local_planner_report()
+    report["planner_examples"] = {"retrieval": settings.PLANNER_RETRIEVAL, **planner_examples.stats()}
+    return report
+
+@app.get("/admin/agents")
+async def get_agent_registry_stats():
+    """Agent registry size, freshness and refresh counters"""
+    return agent_registry.stats()
+
+@app.post("/admin/agents/refresh")
+async def refresh_agent_registry():
+    """Force an agent registry refresh"""
+    ok = await agent_registry.refresh()
+    if not ok:
+        raise HTTPException(status_code=502, detail="Agent registry refresh failed")
+    return agent_registry.stats()
+
+@app.get("/admin/fields")
+async def get_field_registry_stats():
+    """Field registry size, source (defaults / disk cache / indexer mapping) and refresh counters"""
+    return field_registry.stats()
+
+@app.post("/admin/fields/refresh")
+async def refresh_field_registry():
+    """Reload field types from the index mappings"""
+    ok = await field_registry.refresh()
+    if not ok:
+        raise HTTPException(status_code=502, detail="Field registry refresh failed")
+    return field_registry.stats()
+
+@app.get("/admin/cache/results")
+async def get_result_cache_stats():
+    """Indexer result cache counters and memory use"""
+    return result_cache_stats()
+
+@app.delete("/admin/cache/results")
+async def invalidate_result_cache():
+    """Drop all cached indexer results"""
+    return {"invalidated": result_cache.clear()}
+
 # ✅ Natural Language Query Endpoint (Complete Flow with DSL)
 @app.post("/query/")
-async def natural_language_query(data: dict):
+async def natural_language_query(data: dict, response: Response):
     """
     Natural language query endpoint with complete LLM + DSL flow:
     User Query → LLM Parse → WazuhSearchPlan → DSL Builder → Indexer → LLM Format → Natural Response
@@ -120,7 +254,7 @@ async def natural_language_query(data: dict):
     
     try:
         # Step 1: LLM parses natural language to WazuhSearchPlan structure
-        parsed = parse_natural_language_query(query)
+        parsed = await parse_natural_language_query(query)
         logging.info(f"Parsed query: {parsed}")
         
         # Step 2: Validate and create WazuhSearchPlan
@@ -143,15 +277,16 @@ async def natural_language_query(data: dict):
             raise HTTPException(400, f"Invalid filters: {str(e)}")
         
         # Step 4: Build DSL from plan
-        dsl = build_dsl(plan)
+        dsl = build_dsl(plan, summary_aggs=settings.SUMMARY_AGGREGATIONS)
         logging.info(f"Generated DSL: {dsl}")
         
         # Step 5: Execute query against Wazuh Indexer
-        raw_data = execute_query(plan.indices, dsl)
+        raw_data, cache_info = await cached_search(plan.indices, dsl)
+        response.headers.update(cache_headers(cache_info))
         logging.info(f"Query results: {raw_data.get('hits', {}).get('total', 0)} hits")
         
         # Step 6: LLM formats response to natural language
-        natural_response = format_wazuh_response(raw_data, query)
+        natural_response = await format_wazuh_response(raw_data, query)
         
         return {
             "query": query,
@@ -202,7 +337,7 @@ async def simple_natural_language_query(data: dict):
                 raw_data = await wazuh_client.get_alerts(limit=limit)
         
         # Format response
-        natural_response = format_wazuh_response(raw_data, query)
+        natural_response = await format_wazuh_response(raw_data, query)
         
         return {
             "query": query,
@@ -225,11 +360,11 @@ async def query_llm(data: dict):
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt is required")
     
-    response = ask_openai(prompt)
+    response = await ask_openai(prompt)
     return {"response": response}
 
 @app.post("/mcp/wazuh.search")
-async def wazuh_search(plan: WazuhSearchPlan):
+async def wazuh_search(plan: WazuhSearchPlan, response: Response):
     # Step 1: index allowlist
     if not is_index_allowed(plan.indices):
         raise HTTPException(400, "index not allowed")
@@ -247,14 +382,15 @@ async def wazuh_search(plan: WazuhSearchPlan):
     # Step 5: preflight validate
     if plan.dry_run:
         try:
-            v = validate_query(plan.indices, dsl)
+            v = await validate_query(plan.indices, dsl)
             return {"validation": v}
         except Exception as e:
             logging.exception("validate failed")
             raise HTTPException(500, f"validate failed: {e}")
     # Step 6: execute with safe defaults / try-catch
     try:
-        res = execute_query(plan.indices, dsl)
+        res, cache_info = await cached_search(plan.indices, dsl)
+        response.headers.update(cache_headers(cache_info))
         # optionally post-process mask fields etc.
         return {"result": res}
     except Exception as e:
@@ -263,235 +399,458 @@ async def wazuh_search(plan: WazuhSearchPlan):
 
 # ==================== NEW UNIFIED QUERY ENDPOINTS ====================
 
-@app.post("/query/nl")
-async def query_natural_language_unified(data: dict):
+def _count_hits(raw_results: dict) -> int:
+    """Total hit count from an indexer response (handles both int and {"value": n} forms)."""
+    total_hits = raw_results.get("hits", {}).get("total", {})
+    if isinstance(total_hits, dict):
+        return total_hits.get("value", 0)
+    return total_hits
+
+
+def _extract_embedded_dsl(query: str) -> Tuple[Optional[dict], str]:
     """
-    Unified Natural Language query endpoint with intelligent routing.
-    GPT-4o automatically decides between SIMPLE_PIPELINE and ADVANCED_PIPELINE.
-    
-    Supports:
-    1. Pure NL: "Show me failed logins" → GPT routes & executes
-    2. Hybrid NL+DSL: "Analyze this query: {DSL}" → GPT provides insights on DSL results
-    3. GPT automatically routes to appropriate pipeline
-    
-    Example: {"query": "Show me all agents"}
+    Find a DSL query embedded in an NL query ("Analyze this query: {...}").
+    Returns (embedded_dsl, nl_context); embedded_dsl is None for pure NL queries.
     """
-    from .llm_client import route_query, parse_simple_query, parse_query_to_plan, format_results
-    import re
-    import json
-    import time
-    
-    query = data.get("query", "").strip()
-    if not query:
-        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    json_match = re.search(r'\{[\s\S]*\}', query)
+    if json_match:
+        try:
+            potential_dsl = json.loads(json_match.group(0))
+        except json.JSONDecodeError:
+            # Not valid JSON, treat as pure NL
+            return None, query
+        # Validate it looks like a DSL query
+        if "query" in potential_dsl or "index" in potential_dsl or "indices" in potential_dsl:
+            # Extract the NL part (text before/after the JSON)
+            nl_context = query[:json_match.start()].strip() + " " + query[json_match.end():].strip()
+            return potential_dsl, nl_context.strip() or "Analyze these query results"
+    return None, query
+
+
+def _embedded_index(embedded_dsl: dict) -> str:
+    return embedded_dsl.get("index") or embedded_dsl.get("indices", "wazuh-alerts-*")
+
+
+async def _nl_query_stages(query: str, timings: Optional[dict] = None, mode: Optional[str] = None):
+    """
+    Run the /query/nl pipeline, yielding (stage, payload) pairs as each stage completes:
+
+    - "routing":   pipeline decision
+    - "plan":      parsed query / DSL
+    - "cache":     indexer result cache info (advanced and hybrid pipelines)
+    - "results":   raw results and hit counts
+    - "summarize": {"context", "results"} input for format_results (not part of the response)
+
+    Both the buffered and the streaming endpoint are built on this generator.
+    """
+    timings = timings if timings is not None else {}
+
+    # Check if query contains embedded DSL
+    embedded_dsl, nl_context = _extract_embedded_dsl(query)
+    if embedded_dsl:
+        logging.info("✓ Detected embedded DSL in NL query")
+        logging.info(f"NL Context: {nl_context}")
+        logging.info(f"Embedded DSL: {json.dumps(embedded_dsl, indent=2)}")
     
-    try:
-        # Check if query contains embedded DSL
-        embedded_dsl = None
-        nl_context = query
+    # If embedded DSL found, execute it directly with NL insights
+    if embedded_dsl:
+        logging.info("=== Executing Hybrid NL+DSL Query ===")
+        routing = {
+            "pipeline": "HYBRID_NL_DSL",
+            "confidence": 1.0,
+            "reasoning": "Embedded DSL query detected with natural language context for insights"
+        }
+        yield "routing", {"pipeline": "HYBRID_NL_DSL", "routing": routing}
         
-        # Try to extract JSON from the query
-        json_match = re.search(r'\{[\s\S]*\}', query)
-        if json_match:
-            try:
-                potential_dsl = json.loads(json_match.group(0))
-                # Validate it looks like a DSL query
-                if "query" in potential_dsl or "index" in potential_dsl or "indices" in potential_dsl:
-                    embedded_dsl = potential_dsl
-                    # Extract the NL part (text before/after the JSON)
-                    nl_context = query[:json_match.start()].strip() + " " + query[json_match.end():].strip()
-                    nl_context = nl_context.strip() or "Analyze these query results"
-                    logging.info("✓ Detected embedded DSL in NL query")
-                    logging.info(f"NL Context: {nl_context}")
-                    logging.info(f"Embedded DSL: {json.dumps(embedded_dsl, indent=2)}")
-            except json.JSONDecodeError:
-                # Not valid JSON, treat as pure NL
-                pass
+        start_time = time.time()
         
-        # If embedded DSL found, execute it directly with NL insights
-        if embedded_dsl:
-            logging.info("=== Executing Hybrid NL+DSL Query ===")
-            
-            start_time = time.time()
-            
-            # Extract index
-            index = embedded_dsl.get("index") or embedded_dsl.get("indices", "wazuh-alerts-*")
-            dsl_body = {k: v for k, v in embedded_dsl.items() if k not in ["index", "indices"]}
-            
-            # Validate index
-            if not is_index_allowed(index):
-                raise HTTPException(400, "Index not allowed")
-            
-            # Execute the DSL query
-            logging.info(f"Executing DSL on index: {index}")
-            raw_results = execute_query(index, dsl_body)
-            
-            execution_time = time.time() - start_time
-            
-            # Extract hit count
-            hits = raw_results.get("hits", {})
-            total_hits = hits.get("total", {})
-            if isinstance(total_hits, dict):
-                total_count = total_hits.get("value", 0)
-            else:
-                total_count = total_hits
-            
-            logging.info(f"✓ DSL executed in {execution_time:.2f}s, found {total_count} results")
-            
-            # Generate AI insights based on NL context
-            logging.info("=== Generating AI Insights ===")
-            start_format = time.time()
-            
-            # Use the NL context to guide the formatting
-            formatted_response = await format_results(nl_context, raw_results)
-            
-            format_time = time.time() - start_format
-            logging.info(f"✓ Insights generated in {format_time:.2f}s")
-            
-            return {
-                "pipeline": "HYBRID_NL_DSL",
-                "query": query,
-                "nl_context": nl_context,
-                "embedded_dsl": embedded_dsl,
-                "success": True,
-                "total_hits": total_count,
-                "query_time": f"{execution_time:.2f}s",
-                "format_time": f"{format_time:.2f}s",
-                "summary": formatted_response,
-                "formatted_response": formatted_response,
-                "raw_data": raw_results,
-                "raw_results": raw_results,
-                "dsl": dsl_body,
-                "routing": {
-                    "pipeline": "HYBRID_NL_DSL",
-                    "confidence": 1.0,
-                    "reasoning": "Embedded DSL query detected with natural language context for insights"
-                }
-            }
+        # Extract index
+        index = _embedded_index(embedded_dsl)
+        dsl_body = {k: v for k, v in embedded_dsl.items() if k not in ["index", "indices"]}
+        
+        # Validate index
+        if not is_index_allowed(index):
+            raise HTTPException(400, "Index not allowed")
+        yield "plan", {"query": query, "nl_context": nl_context, "embedded_dsl": embedded_dsl, "dsl": dsl_body}
+        
+        # Execute the DSL query
+        logging.info(f"Executing DSL on index: {index}")
+        raw_results, cache_info = await cached_search(index, dsl_body)
+        yield "cache", cache_info
+        
+        execution_time = time.time() - start_time
+        timings["indexer_ms"] = round(execution_time * 1000, 1)
+        total_count = _count_hits(raw_results)
+        logging.info(f"✓ DSL executed in {execution_time:.2f}s, found {total_count} results")
         
+        yield "results", {
+            "success": True,
+            "total_hits": total_count,
+            "query_time": f"{execution_time:.2f}s",
+            "raw_data": raw_results,
+            "raw_results": raw_results,
+        }
+        # Use the NL context to guide the formatting
+        yield "summarize", {"context": nl_context, "results": raw_results}
+        return
+    
+    async for stage in _routed_query_stages(query, timings, mode or settings.QUERY_PLANNING_MODE):
+        yield stage
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.time() - start) * 1000, 1)
+
+
+async def _timed(awaitable, timings: dict, key: str):
+    """Await something and record how long it took (ms) under timings[key]."""
+    start = time.time()
+    try:
+        return await awaitable
+    finally:
+        timings[key] = _elapsed_ms(start)
+
+
+async def _plan_with_prefetched_context(query: str, agent_task: Optional[asyncio.Task]):
+    from .llm_client import parse_query_to_plan
+    agent_ctx = await agent_task if agent_task is not None else None
+    return await parse_query_to_plan(query, wazuh_client, agent_ctx=agent_ctx)
+
+
+async def _route_and_plan_with_prefetched_context(query: str, agent_task: Optional[asyncio.Task]):
+    from .llm_client import route_and_plan
+    agent_ctx = await agent_task if agent_task is not None else None
+    return await route_and_plan(query, wazuh_client, agent_ctx=agent_ctx)
+
+
+# Per-mode planning latency and plan validity, for A/B comparison of QUERY_PLANNING_MODE
+PLANNING_MODES = ("sequential", "speculative", "combined")
+planning_stats = {
+    mode: {"requests": 0, "simple": 0, "advanced": 0, "plan_ready_ms_total": 0.0,
+           "valid_plans": 0, "invalid_plans": 0}
+    for mode in PLANNING_MODES
+}
+
+
+def _record_planning(mode: str, pipeline: str, plan_ready_ms: float, valid: Optional[bool] = None):
+    stats = planning_stats[mode]
+    stats["requests"] += 1
+    stats["simple" if pipeline == "SIMPLE_PIPELINE" else "advanced"] += 1
+    stats["plan_ready_ms_total"] += plan_ready_ms
+    if valid is not None:
+        stats["valid_plans" if valid else "invalid_plans"] += 1
+
+
+async def _routed_query_stages(query: str, timings: dict, mode: str):
+    """
+    Routing + SIMPLE/ADVANCED pipeline stages for pure NL queries.
+
+    Planning depends on `mode` (QUERY_PLANNING_MODE); speculative and combined prefetch the
+    agent context while routing runs:
+    - sequential:  route, then parse the plan
+    - speculative: parse the advanced plan concurrently with routing, cancel it if routing picks SIMPLE_PIPELINE
+    - combined:    one GPT call returns routing plus the simple operation or WazuhSearchPlan
+    Per-stage durations are recorded in `timings`.
+    """
+    from .llm_client import route_query, parse_simple_query, get_agent_context
+
+    stages_start = time.time()
+    agent_task = None
+    plan_task = None
+    combined = None
+    if wazuh_client and mode in ("speculative", "combined"):
+        agent_task = asyncio.create_task(_timed(get_agent_context(wazuh_client), timings, "agent_context_ms"))
+    if mode == "speculative":
+        plan_task = asyncio.create_task(
+            _timed(_plan_with_prefetched_context(query, agent_task), timings, "planning_ms"))
+    timings["planning_mode"] = mode
+
+    try:
         # Step 1: Route the query (pure NL)
-        routing = await route_query(query)
+        if mode == "combined":
+            combined = await _timed(_route_and_plan_with_prefetched_context(query, agent_task), timings, "routing_ms")
+            routing = combined["routing"]
+        else:
+            routing = await _timed(route_query(query), timings, "routing_ms")
         pipeline = routing["pipeline"]
         logging.info(f"Routing decision: {pipeline} (confidence: {routing['confidence']})")
-        
+        yield "routing", {"pipeline": pipeline, "routing": routing}
+        if pipeline != "ADVANCED_PIPELINE" and plan_task is not None:
+            plan_task.cancel()
+            timings["speculative_plan_cancelled"] = True
+    
         # Step 2: Execute the appropriate pipeline
         if pipeline == "SIMPLE_PIPELINE":
             # Use Wazuh Manager API for simple queries
-            parsed = await parse_simple_query(query)
+            parsed = (combined or {}).get("simple_query") or await parse_simple_query(query)
             logging.info(f"Simple query parsed: {parsed}")
-            
+            _record_planning(mode, pipeline, _elapsed_ms(stages_start))
+            yield "plan", {"parsed_query": parsed, "dsl": None}  # No DSL for simple queries
+        
             # Execute based on parsed intent
             if parsed["operation"] == "list_agents":
-                raw_results = await wazuh_client.get_agents()
-                
-                # Apply client-side filtering if status is specified
+                # Status is filtered by the Wazuh API, not client-side
                 status_filter = parsed["filters"].get("status")
-                if status_filter:
-                    agents = raw_results.get("agents", [])
-                    filtered_agents = [
-                        agent for agent in agents 
-                        if agent.get("status", "").lower() == status_filter.lower()
-                    ]
-                    raw_results = {
-                        "total": len(filtered_agents),
-                        "agents": filtered_agents,
-                        "data": {"affected_items": filtered_agents}
-                    }
-                else:
-                    # Add data wrapper for consistency with API format
-                    raw_results["data"] = {"affected_items": raw_results.get("agents", [])}
-                    
+                raw_results = await wazuh_client.get_agents(status=status_filter.lower() if status_filter else None)
+                # Add data wrapper for consistency with API format
+                raw_results["data"] = {"affected_items": raw_results.get("agents", [])}
+                
             elif parsed["operation"] == "get_agent":
                 agent_id = parsed["filters"].get("agent_id")
-                # Check if get_agent_by_id exists, otherwise filter from get_agents
-                if hasattr(wazuh_client, 'get_agent_by_id'):
-                    raw_results = await wazuh_client.get_agent_by_id(agent_id)
-                else:
-                    all_agents = await wazuh_client.get_agents()
-                    agents = all_agents.get("agents", [])
-                    agent = next((a for a in agents if a.get("id") == agent_id), None)
-                    if agent:
-                        raw_results = {"data": {"affected_items": [agent]}}
-                    else:
-                        raw_results = {"data": {"affected_items": []}}
+                # Registry lookup by ID, name or IP - no Wazuh API round trip
+                await agent_registry.snapshot(wazuh_client)
+                agent = agent_registry.resolve(agent_id)
+                record = agent_registry.record(agent["id"]) if agent else None
+                raw_results = {"data": {"affected_items": [record] if record else []}}
             else:
                 raise HTTPException(
                     status_code=400,
                     detail=f"Unsupported operation: {parsed['operation']}"
                 )
-            
-            # Format results
-            formatted_response = await format_results(query, raw_results)
-            
-            return {
-                "success": True,
-                "routing": routing,
-                "pipeline": pipeline,
-                "parsed_query": parsed,
-                "summary": formatted_response,
-                "raw_data": raw_results,
-                "dsl": None  # No DSL for simple queries
-            }
-            
+        
+            yield "results", {"success": True, "raw_data": raw_results}
+            yield "summarize", {"context": query, "results": raw_results}
+        
         elif pipeline == "ADVANCED_PIPELINE":
             # Use Elasticsearch/OpenSearch Indexer for advanced queries
-            import time
             parse_start = time.time()
-            parsed_plan = await parse_query_to_plan(query, wazuh_client)
+            if combined is not None and combined["plan"] is not None:
+                # Plan came back with the routing decision - no second GPT call
+                parsed_plan = combined["plan"]
+                timings["planning_ms"] = 0.0
+            elif plan_task is not None:
+                # Speculative plan was started alongside routing - only wait for what's left of it
+                try:
+                    parsed_plan = await plan_task
+                    timings["planning_wait_ms"] = _elapsed_ms(parse_start)
+                    timings["speculative_saved_ms"] = round(timings["planning_ms"] - timings["planning_wait_ms"], 1)
+                except Exception as e:
+                    # A speculative failure shouldn't fail the request - plan again, as sequential mode would
+                    logging.warning(f"Speculative plan failed, planning again: {e}")
+                    timings["speculative_plan_failed"] = True
+                    parsed_plan = await _timed(_plan_with_prefetched_context(query, agent_task), timings,
+                                               "planning_ms")
+            else:
+                parsed_plan = await _timed(_plan_with_prefetched_context(query, agent_task), timings, "planning_ms")
             parse_time = time.time() - parse_start
             logging.info(f"Advanced query plan (parse took {parse_time:.2f}s): {parsed_plan}")
-            
-            # Create WazuhSearchPlan from parsed data
+        
+            plan_ready_ms = _elapsed_ms(stages_start)
             try:
-                plan = WazuhSearchPlan(**parsed_plan)
-            except ValidationError as e:
-                logging.error(f"Invalid search plan: {e}")
-                raise HTTPException(status_code=400, detail=f"Invalid query structure: {str(e)}")
-            
-            # Validate plan
-            if not is_index_allowed(plan.indices):
-                raise HTTPException(400, "Index not allowed")
-            if not enforce_time_window(plan.time.from_, plan.time.to):
-                raise HTTPException(400, "Time window too large or invalid")
+                # Create WazuhSearchPlan from parsed data
+                try:
+                    plan = WazuhSearchPlan(**parsed_plan)
+                except ValidationError as e:
+                    logging.error(f"Invalid search plan: {e}")
+                    raise HTTPException(status_code=400, detail=f"Invalid query structure: {str(e)}")
             
-            try:
-                validate_filters(plan.filters or [])
-                validate_filters(plan.must_not or [])
-            except Exception as e:
-                raise HTTPException(400, f"Invalid filters: {str(e)}")
+                # Validate plan
+                if not is_index_allowed(plan.indices):
+                    raise HTTPException(400, "Index not allowed")
+                if not enforce_time_window(plan.time.from_, plan.time.to):
+                    raise HTTPException(400, "Time window too large or invalid")
             
+                try:
+                    validate_filters(plan.filters or [])
+                    validate_filters(plan.must_not or [])
+                except Exception as e:
+                    raise HTTPException(400, f"Invalid filters: {str(e)}")
+            except HTTPException:
+                _record_planning(mode, pipeline, plan_ready_ms, valid=False)
+                raise
+            _record_planning(mode, pipeline, plan_ready_ms, valid=True)
+        
             # Build DSL query
-            dsl_query = build_dsl(plan)
+            dsl_query = build_dsl(plan, summary_aggs=settings.SUMMARY_AGGREGATIONS)
             logging.info(f"Generated DSL: {dsl_query}")
-            
+            yield "plan", {"parsed_query": parsed_plan, "dsl": dsl_query}
+        
             # Execute query
             query_start = time.time()
-            raw_results = execute_query(plan.indices, dsl_query)
+            raw_results, cache_info = await cached_search(plan.indices, dsl_query)
+            yield "cache", cache_info
             query_time = time.time() - query_start
-            total_hits = raw_results.get('hits', {}).get('total', 0)
+            timings["indexer_ms"] = round(query_time * 1000, 1)
+            total_hits = _count_hits(raw_results)
             logging.info(f"Query results: {total_hits} hits (query took {query_time:.2f}s)")
-            
-            # Format results
-            format_start = time.time()
-            formatted_response = await format_results(query, raw_results)
-            format_time = time.time() - format_start
-            logging.info(f"Results formatted (took {format_time:.2f}s)")
-            
-            return {
+        
+            yield "results", {
                 "success": True,
-                "routing": routing,
-                "pipeline": pipeline,
-                "parsed_query": parsed_plan,
-                "summary": formatted_response,
+                "total_hits": total_hits,
+                "query_time": f"{query_time:.2f}s",
                 "raw_data": raw_results,
-                "dsl": dsl_query
             }
-        
+            yield "summarize", {"context": query, "results": raw_results}
+    
         else:
             raise HTTPException(
                 status_code=500,
                 detail=f"Unknown pipeline: {pipeline}"
             )
+    finally:
+        for task in (plan_task, agent_task):
+            if task is None:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # mark retrieved: a speculative plan may have failed unawaited
+
+
+def _response_profile(request: Request, data: dict) -> dict:
+    """
+    Response shape requested by the client:
+    - lean: each payload once (raw_data only, summary only) - `?profile=lean` or
+      `Accept: application/json; profile="lean"`
+    - hits_only: indexer results as a flat "hits" list of documents instead of the
+      OpenSearch envelope - `?hits_only=true` or "hits_only": true in the body
+    """
+    accept = request.headers.get("accept", "")
+    lean = request.query_params.get("profile") == "lean" or "profile=lean" in accept.replace('"', "")
+    hits_only = request.query_params.get("hits_only", "").lower() in ("1", "true") or bool(data.get("hits_only"))
+    return {"lean": lean, "hits_only": hits_only}
+
+
+def _shape_results(payload: dict, profile: Optional[dict]) -> dict:
+    """Apply the response profile to a "results" payload (never mutates cached results)."""
+    if not profile or not (profile["lean"] or profile["hits_only"]):
+        return payload
+    shaped = {k: v for k, v in payload.items() if k != "raw_results"} if profile["lean"] else dict(payload)
+    raw = shaped.get("raw_data")
+    if profile["lean"] and isinstance(raw, dict) and "agents" in raw and "data" in raw:
+        # list_agents carries the agent list twice; keep the API-style data.affected_items the UI renders
+        shaped["raw_data"] = raw = {k: v for k, v in raw.items() if k != "agents"}
+    if profile["hits_only"] and isinstance(raw, dict) and "hits" in raw:
+        shaped.pop("raw_data")
+        shaped.pop("raw_results", None)
+        shaped["hits"] = [
+            {"_id": hit.get("_id"), "_index": hit.get("_index"), **hit.get("_source", {}), **hit.get("fields", {})}
+            for hit in raw["hits"].get("hits", [])
+        ]
+        if "aggregations" in raw:
+            shaped["aggregations"] = raw["aggregations"]
+    return shaped
+
+
+def _ndjson(event: str, data: dict) -> bytes:
+    return dumps({"event": event, "data": data}) + b"\n"
+
+
+async def _stream_query_events(stages, summary_source: str, stage_timings: Optional[dict] = None,
+                                profile: Optional[dict] = None):
+    """
+    Turn a stage generator into an NDJSON event stream.
+
+    Stage payloads are emitted as soon as they are available, the summary is streamed
+    as "summary" deltas, and a final "done" event reports time-to-first-byte, time to
+    first summary token and total time (plus any per-stage timings the stages recorded).
+    Errors after headers are sent become "error" events.
+    """
+    from .llm_client import format_results_stream
+
+    start = time.perf_counter()
+    timings = {}
+    summary_input = None
+
+    def elapsed_ms() -> float:
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    try:
+        async for stage, payload in stages:
+            if stage == "summarize":
+                summary_input = payload
+                continue
+            if stage == "results":
+                payload = _shape_results(payload, profile)
+            yield _ndjson(stage, payload)
+            timings.setdefault("first_byte_ms", elapsed_ms())
+        timings["results_ms"] = elapsed_ms()
+
+        if summary_input is not None:
+            async for delta in format_results_stream(summary_input["context"], summary_input["results"]):
+                timings.setdefault("first_token_ms", elapsed_ms())
+                yield _ndjson("summary", {"delta": delta})
+    except HTTPException as e:
+        yield _ndjson("error", {"status": e.status_code, "detail": e.detail})
+    except Exception as e:
+        logging.exception(f"Streaming {summary_source} query failed")
+        yield _ndjson("error", {"status": 500, "detail": f"Query failed: {str(e)}"})
+
+    timings["total_ms"] = elapsed_ms()
+    yield _ndjson("done", {"timings": {**(stage_timings or {}), **timings}})
+
+
+@app.post("/query/nl")
+async def query_natural_language_unified(data: dict, request: Request):
+    """
+    Unified Natural Language query endpoint with intelligent routing.
+    GPT-4o automatically decides between SIMPLE_PIPELINE and ADVANCED_PIPELINE.
+    
+    Supports:
+    1. Pure NL: "Show me failed logins" → GPT routes & executes
+    2. Hybrid NL+DSL: "Analyze this query: {DSL}" → GPT provides insights on DSL results
+    3. GPT automatically routes to appropriate pipeline
+    
+    Set "stream": true to receive NDJSON events (routing, plan, results, summary deltas, done)
+    instead of one JSON body. "planning_mode" overrides QUERY_PLANNING_MODE for this request
+    (sequential / speculative / combined) for A/B comparisons.
+    
+    `?profile=lean` sends each payload once and `hits_only` flattens indexer hits
+    (see _response_profile).
+    
+    Example: {"query": "Show me all agents"}
+    """
+    from .llm_client import format_results
+    
+    query = data.get("query", "").strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    mode = data.get("planning_mode") or settings.QUERY_PLANNING_MODE
+    if mode not in PLANNING_MODES:
+        raise HTTPException(status_code=400, detail=f"planning_mode must be one of {', '.join(PLANNING_MODES)}")
+    
+    # Cheap checks run before a streamed response's headers go out, so they keep their status code
+    embedded_dsl, _ = _extract_embedded_dsl(query)
+    if embedded_dsl and not is_index_allowed(_embedded_index(embedded_dsl)):
+        raise HTTPException(400, "Index not allowed")
+    
+    timings = {}
+    profile = _response_profile(request, data)
+    if data.get("stream"):
+        return StreamingResponse(_stream_query_events(_nl_query_stages(query, timings, mode), "NL", timings, profile),
+                                 media_type="application/x-ndjson")
+    
+    try:
+        request_start = time.time()
+        result = {}
+        summary_input = None
+        headers = {}
+        async for stage, payload in _nl_query_stages(query, timings, mode):
+            if stage == "cache":
+                headers.update(cache_headers(payload))
+            elif stage == "summarize":
+                summary_input = payload
+            elif stage == "results":
+                result.update(_shape_results(payload, profile))
+            else:
+                result.update(payload)
+        
+        # Format results
+        logging.info("=== Generating AI Insights ===")
+        start_format = time.time()
+        formatted_response = await format_results(summary_input["context"], summary_input["results"])
+        format_time = time.time() - start_format
+        logging.info(f"✓ Results formatted in {format_time:.2f}s")
+        timings["summary_ms"] = round(format_time * 1000, 1)
+        timings["total_ms"] = _elapsed_ms(request_start)
+        
+        result["summary"] = formatted_response
+        result["format_time"] = f"{format_time:.2f}s"
+        result["timings"] = timings
+        if result["pipeline"] == "HYBRID_NL_DSL" and not profile["lean"]:
+            result["formatted_response"] = formatted_response
+        # Serialize directly (skips jsonable_encoder's walk over every hit)
+        return DefaultResponse(result, headers=headers)
             
     except HTTPException:
         raise
@@ -500,94 +859,116 @@ async def query_natural_language_unified(data: dict):
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
 
+def _describe_dsl(index: str, dsl_body: dict) -> str:
+    """Short natural-language description of a raw DSL query, used as summary context."""
+    query_context = f"User executed a direct DSL query on index '{index}'"
+    
+    # Add filter context
+    if "query" in dsl_body and "bool" in dsl_body["query"]:
+        must_filters = dsl_body["query"]["bool"].get("must", [])
+        if must_filters:
+            query_context += " with filters: "
+            filter_descriptions = []
+            for f in must_filters:
+                if "range" in f:
+                    field = list(f["range"].keys())[0]
+                    filter_descriptions.append(f"{field} time range")
+                elif "term" in f:
+                    field = list(f["term"].keys())[0]
+                    value = f["term"][field]
+                    filter_descriptions.append(f"{field}={value}")
+                elif "terms" in f:
+                    field = list(f["terms"].keys())[0]
+                    filter_descriptions.append(f"{field} in list")
+            query_context += ", ".join(filter_descriptions)
+    return query_context
+
+
+async def _dsl_query_stages(index: str, dsl_body: dict, include_summary: bool, use_cache: bool):
+    """Stage generator for /query/dsl (same protocol as _nl_query_stages). The index is checked by the endpoint."""
+    # Execute the DSL query directly
+    start_time = time.time()
+    raw_results, cache_info = await cached_search(index, dsl_body, use_cache=use_cache)
+    yield "cache", cache_info
+    execution_time = time.time() - start_time
+    
+    total_count = _count_hits(raw_results)
+    documents = raw_results.get("hits", {}).get("hits", [])
+    
+    logging.info(f"Direct DSL results: {total_count} hits (executed in {execution_time:.2f}s)")
+    
+    yield "results", {
+        "success": True,
+        "pipeline": "DIRECT_DSL",
+        "query_time": f"{execution_time:.2f}s",
+        "total_hits": total_count,
+        "returned_count": len(documents),
+        "raw_data": raw_results,
+        "raw_results": raw_results,
+        "dsl": dsl_body
+    }
+    
+    # Add GPT summarization if requested
+    if include_summary and documents:
+        yield "summarize", {"context": _describe_dsl(index, dsl_body), "results": raw_results}
+
+
 @app.post("/query/dsl")
-async def query_direct_dsl(data: dict):
+async def query_direct_dsl(data: dict, request: Request):
     """
     Direct DSL query endpoint for advanced users with optional LLM summarization.
-    Accepts raw OpenSearch DSL queries.
+    Accepts raw OpenSearch DSL queries. Set "stream": true for NDJSON events (see /query/nl).
+    Supports the same `profile=lean` / `hits_only` response shaping as /query/nl.
     
     Example: {"index": "wazuh-alerts-*", "query": {...}, "size": 50, "sort": [...], "include_summary": true}
     """
     from .llm_client import format_results
-    import time
-    import json
     
     index = data.get("index", "wazuh-alerts-*")
     include_summary = data.get("include_summary", True)  # Default to true
+    use_cache = data.get("use_cache", True)
     
-    # Extract the query body (everything except 'index' and 'include_summary')
-    dsl_body = {k: v for k, v in data.items() if k not in ["index", "include_summary"]}
+    # Extract the query body (everything except our own control keys)
+    dsl_body = {k: v for k, v in data.items() if k not in ["index", "include_summary", "use_cache", "stream", "hits_only"]}
     
     if not dsl_body or (len(dsl_body) == 1 and "query" not in dsl_body):
         raise HTTPException(status_code=400, detail="DSL query body cannot be empty")
     
+    # Validate index (before a streamed response's headers go out)
+    if not is_index_allowed(index):
+        raise HTTPException(400, "Index not allowed")
+    
+    stages = _dsl_query_stages(index, dsl_body, include_summary, use_cache)
+    profile = _response_profile(request, data)
+    if data.get("stream"):
+        return StreamingResponse(_stream_query_events(stages, "DSL", profile=profile), media_type="application/x-ndjson")
+    
     try:
-        # Validate index
-        if not is_index_allowed(index):
-            raise HTTPException(400, "Index not allowed")
-        
-        # Execute the DSL query directly
-        start_time = time.time()
-        raw_results = execute_query(index, dsl_body)
-        execution_time = time.time() - start_time
-        
-        # Extract hit count
-        hits = raw_results.get("hits", {})
-        total_hits = hits.get("total", {})
-        if isinstance(total_hits, dict):
-            total_count = total_hits.get("value", 0)
-        else:
-            total_count = total_hits
-        
-        documents = hits.get("hits", [])
-        
-        logging.info(f"Direct DSL results: {total_count} hits (executed in {execution_time:.2f}s)")
-        
-        response_data = {
-            "success": True,
-            "pipeline": "DIRECT_DSL",
-            "query_time": f"{execution_time:.2f}s",
-            "total_hits": total_count,
-            "returned_count": len(documents),
-            "raw_data": raw_results,
-            "raw_results": raw_results,
-            "dsl": dsl_body
-        }
+        response_data = {}
+        headers = {}
+        summary_input = None
+        async for stage, payload in stages:
+            if stage == "cache":
+                headers.update(cache_headers(payload))
+            elif stage == "summarize":
+                summary_input = payload
+            elif stage == "results":
+                response_data.update(_shape_results(payload, profile))
+            else:
+                response_data.update(payload)
         
-        # Add GPT summarization if requested
-        if include_summary and documents:
+        if summary_input is not None:
             try:
                 logging.info("Generating natural language summary for DSL query...")
                 
-                # Create a simple query context from the DSL
-                query_context = f"User executed a direct DSL query on index '{index}'"
-                
-                # Add filter context
-                if "query" in dsl_body and "bool" in dsl_body["query"]:
-                    must_filters = dsl_body["query"]["bool"].get("must", [])
-                    if must_filters:
-                        query_context += " with filters: "
-                        filter_descriptions = []
-                        for f in must_filters:
-                            if "range" in f:
-                                field = list(f["range"].keys())[0]
-                                filter_descriptions.append(f"{field} time range")
-                            elif "term" in f:
-                                field = list(f["term"].keys())[0]
-                                value = f["term"][field]
-                                filter_descriptions.append(f"{field}={value}")
-                            elif "terms" in f:
-                                field = list(f["terms"].keys())[0]
-                                filter_descriptions.append(f"{field} in list")
-                        query_context += ", ".join(filter_descriptions)
-                
                 # Format results with GPT
                 start_format = time.time()
-                summary = await format_results(query_context, raw_results)
+                summary = await format_results(summary_input["context"], summary_input["results"])
                 format_time = time.time() - start_format
                 
                 response_data["summary"] = summary
-                response_data["formatted_response"] = summary
+                if not profile["lean"]:
+                    response_data["formatted_response"] = summary
                 response_data["format_time"] = f"{format_time:.2f}s"
                 logging.info(f"Summary generated successfully in {format_time:.2f}s")
                 
@@ -596,7 +977,7 @@ async def query_direct_dsl(data: dict):
                 response_data["summary"] = None
                 response_data["summary_error"] = str(summary_error)
         
-        return response_data
+        return DefaultResponse(response_data, headers=headers)
             
     except HTTPException:
         raise
@@ -634,6 +1015,188 @@ async def connect_to_wazuh():
         print(f"  Rule: {alert.get('rule', {}).get('description', 'N/A')}")
         print(f"  Level: {alert.get('rule', {}).get('level', 'N/A')}")
 
+def _flatten(doc: dict, prefix: str = "") -> dict:
+    """Nested _source -> dotted columns ({"rule": {"id": 1}} -> {"rule.id": 1}); lists stay JSON."""
+    flat = {}
+    for key, value in doc.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        else:
+            flat[name] = json.dumps(value, default=str) if isinstance(value, list) else value
+    return flat
+
+
+async def _export_rows(pages, export_format: str, includes: Optional[list]):
+    """
+    Encode export pages as NDJSON lines or CSV rows. Every document carries a "_cursor"
+    that resumes the export right after it. CSV columns are the requested fields, or the
+    fields present in the first page when none were requested.
+    If the indexer fails mid-stream the export ends with an error line (NDJSON) or a trailer
+    row (CSV: "_id" = "#error", the last "_cursor", then the error and the current PIT as two
+    extra cells) so a partial export is recognisable and can be resumed.
+    """
+    columns = None
+    cursor = None
+    try:
+        async for _, hits in pages:
+            chunk = io.StringIO()
+            if export_format == "csv":
+                writer = None
+                if columns is None:
+                    fields = includes or sorted({k for hit in hits for k in _flatten(hit.get("_source", {}))})
+                    columns = ["_id", *fields, "_cursor"]
+                    writer = csv.DictWriter(chunk, fieldnames=columns, extrasaction="ignore")
+                    writer.writeheader()
+                writer = writer or csv.DictWriter(chunk, fieldnames=columns, extrasaction="ignore")
+                for hit in hits:
+                    writer.writerow({"_id": hit["_id"], **_flatten(hit.get("_source", {})),
+                                     "_cursor": encode_cursor(hit["sort"])})
+            else:
+                for hit in hits:
+                    chunk.write(json.dumps({"_id": hit["_id"], "_index": hit["_index"], **hit.get("_source", {}),
+                                            "_cursor": encode_cursor(hit["sort"])}, default=str) + "\n")
+            cursor = encode_cursor(hits[-1]["sort"])
+            yield chunk.getvalue().encode()
+    except Exception as e:
+        logging.exception("Export interrupted")
+        pit_id = getattr(e, "pit_id", None)
+        chunk = io.StringIO()
+        if export_format == "csv":
+            if columns is None:
+                columns = ["_id", "_cursor"]
+                csv.writer(chunk).writerow(columns)
+            row = {column: "" for column in columns}
+            row.update({"_id": "#error", "_cursor": cursor or ""})
+            csv.writer(chunk).writerow([*row.values(), f"error: {e}", f"pit_id: {pit_id or ''}"])
+        else:
+            chunk.write(json.dumps({"_error": str(e), "_cursor": cursor, "_pit_id": pit_id}) + "\n")
+        yield chunk.getvalue().encode()
+
+
+def _positive_int(data: dict, key: str) -> Optional[int]:
+    """Optional positive integer from a request body; HTTP 400 on anything else."""
+    value = data.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise HTTPException(400, f"{key} must be a positive integer")
+    try:
+        value = int(value)
+    except ValueError:
+        raise HTTPException(400, f"{key} must be a positive integer")
+    if value <= 0:
+        raise HTTPException(400, f"{key} must be a positive integer")
+    return value
+
+
+@app.post("/query/dsl/export")
+async def export_dsl(data: dict):
+    """
+    Stream every document matching a DSL query as NDJSON or CSV (no MAX_LIMIT cap).
+    Pages through a point-in-time with search_after, so memory stays bounded.
+    
+    - "fields": _source includes (also the CSV columns), a list of field names
+    - "sort": OpenSearch sort; "_id" is appended as tiebreaker so resuming never skips or repeats documents
+    - "cursor": "_cursor" of the last document received, to resume an interrupted export
+    - "pit_id": X-Export-PIT header (or error line "_pit_id") of the interrupted export; only
+      reused if this server opened it for the same index, otherwise a new PIT is opened
+    - "page_size", "max_docs": positive integers, capped at EXPORT_MAX_PAGE_SIZE / EXPORT_MAX_DOCS
+    
+    Example: {"index": "wazuh-alerts-*", "query": {...}, "fields": ["agent.name", "rule.id"], "format": "csv"}
+    """
+    index = data.get("index", "wazuh-alerts-*")
+    export_format = data.get("format", "ndjson")
+    includes = data.get("fields")
+    if not is_index_allowed(index):
+        raise HTTPException(400, "Index not allowed")
+    if export_format not in ("ndjson", "csv"):
+        raise HTTPException(400, "format must be ndjson or csv")
+    if includes is not None and not (isinstance(includes, list) and all(isinstance(f, str) for f in includes)):
+        raise HTTPException(400, "fields must be a list of field names")
+    try:
+        search_after = decode_cursor(data["cursor"]) if data.get("cursor") else None
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    page_size = _positive_int(data, "page_size")
+    max_docs = min(_positive_int(data, "max_docs") or settings.EXPORT_MAX_DOCS, settings.EXPORT_MAX_DOCS)
+    
+    pit_id = data.get("pit_id")
+    if pit_id and not (isinstance(pit_id, str) and is_export_pit(pit_id, index)):
+        logging.warning("Ignoring export pit_id not opened by this server for this index")
+        pit_id = None
+    try:
+        pit_id = pit_id or await open_pit(index, settings.EXPORT_PIT_KEEP_ALIVE)
+    except Exception as e:
+        logging.exception("Export failed to open a point-in-time")
+        raise HTTPException(500, f"Export failed: {e}")
+    
+    pages = export_pages(index, data.get("query"), sort=data.get("sort"), includes=includes,
+                         page_size=page_size, search_after=search_after, pit_id=pit_id,
+                         max_docs=max_docs)
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(_export_rows(pages, export_format, includes), media_type=media_type,
+                             headers={"X-Export-PIT": pit_id})
+
+
+@app.post("/query/dsl/batch")
+async def query_dsl_batch(data: dict):
+    """
+    Run several DSL queries in one _msearch round trip, with one optional combined summary.
+    Each entry is a /query/dsl body ("index" defaults to wazuh-alerts-*) plus an optional "name".
+    
+    Example: {"queries": [{"name": "top source IPs", "size": 0, "aggs": {...}}, {...}], "include_summary": true}
+    """
+    from .llm_client import format_results
+    
+    try:
+        queries = split_batch_queries(data.get("queries") or [])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        start_time = time.time()
+        responses, cache_infos = await cached_msearch([(index, body) for _, index, body in queries],
+                                                      use_cache=data.get("use_cache", True))
+        execution_time = time.time() - start_time
+    except Exception as e:
+        logging.exception("Batch DSL query failed")
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+    
+    results = []
+    for (name, index, body), raw_results, cache_info in zip(queries, responses, cache_infos):
+        entry = {"name": name, "index": index, "dsl": body, "cache": cache_info["status"]}
+        if "error" in raw_results:
+            entry.update({"success": False, "error": raw_results["error"]})
+        else:
+            documents = raw_results.get("hits", {}).get("hits", [])
+            entry.update({"success": True, "total_hits": _count_hits(raw_results),
+                          "returned_count": len(documents), "raw_results": raw_results})
+        results.append(entry)
+    logging.info(f"Batch DSL: {len(results)} queries in one _msearch ({execution_time:.2f}s)")
+    
+    response_data = {
+        "success": all(r["success"] for r in results),
+        "pipeline": "DIRECT_DSL_BATCH",
+        "query_time": f"{execution_time:.2f}s",
+        "results": results,
+    }
+    
+    if data.get("include_summary", False):
+        try:
+            start_format = time.time()
+            context = "User executed a batch of DSL queries: " + ", ".join(name for name, _, _ in queries)
+            response_data["summary"] = await format_results(
+                context, {"responses": [{"name": name, **raw} for (name, _, _), raw in zip(queries, responses)]})
+            response_data["format_time"] = f"{time.time() - start_format:.2f}s"
+        except Exception as summary_error:
+            logging.warning(f"Failed to generate batch summary: {summary_error}")
+            response_data["summary"] = None
+            response_data["summary_error"] = str(summary_error)
+    
+    return DefaultResponse(response_data)
+
+
 if __name__ == "__main__":
     import asyncio
     asyncio.run(connect_to_wazuh())
@@ -0,0 +1,135 @@
+from app.config import settings
+from app.serialization import prompt_json
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_encoding: Any = _MISSING
+
+# Fields dedupe groups are keyed on: alerts for the same rule, agent and source IP
+# read the same to a summarizer
+DEDUPE_FIELDS = ("rule.id", "agent.name", "data.srcip")
+
+
+def _get_encoding():
+    """
+    The gpt-4o tokenizer, loaded on first use rather than at import: tiktoken downloads the
+    encoding file when it isn't cached, which must not block startup. None (for good) when
+    disabled (TIKTOKEN_ENABLED), not installed or not loadable.
+    """
+    global _encoding
+    if _encoding is _MISSING:
+        _encoding = None
+        if settings.TIKTOKEN_ENABLED:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:   # ImportError, or encoding file not cached and no network
+                logger.warning(f"tiktoken unavailable, estimating ~4 chars/token: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the gpt-4o tokenizer (tiktoken), or ~4 chars/token without it."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def _get_path(doc: Dict[str, Any], path: str) -> Any:
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _set_path(doc: Dict[str, Any], path: str, value: Any):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def project_document(source: Dict[str, Any], fields: List[str], max_chars: int) -> Dict[str, Any]:
+    """Keep only `fields` (dotted paths) and cut long strings such as full_log to `max_chars`."""
+    projected: Dict[str, Any] = {}
+    for field in fields:
+        value = _get_path(source, field)
+        if value is None or isinstance(value, dict):
+            continue
+        if isinstance(value, str) and len(value) > max_chars:
+            value = value[:max_chars] + "..."
+        _set_path(projected, field, value)
+    return projected
+
+
+def _diverse_order(groups: Dict[Tuple, List[Dict[str, Any]]]) -> List[Tuple]:
+    """
+    Order dedupe groups so the sample covers as many rules as possible: round-robin over
+    rule.id, biggest groups first within each rule.
+    """
+    by_rule: Dict[Any, List[Tuple]] = {}
+    for key in sorted(groups, key=lambda k: -len(groups[k])):
+        by_rule.setdefault(key[0], []).append(key)
+    rules = sorted(by_rule.values(), key=lambda keys: -sum(len(groups[k]) for k in keys))
+    ordered = []
+    while any(rules):
+        for keys in rules:
+            if keys:
+                ordered.append(keys.pop(0))
+    return ordered
+
+
+def sample_hits(hits: List[Dict[str, Any]], token_budget: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Pick a diverse, deduplicated, projected subset of indexer hits that fits `token_budget`.
+
+    Hits are grouped by DEDUPE_FIELDS; one representative per group is sent with a
+    "duplicates" count. Returns (sample, report) where report says how many documents
+    and tokens were sent out of how many hits.
+    """
+    token_budget = token_budget or settings.SUMMARY_TOKEN_BUDGET
+    fields = list(dict.fromkeys(settings.FIELD_ALLOWLIST + settings.SUMMARY_FIELDS))
+
+    groups: Dict[Tuple, List[Dict[str, Any]]] = {}
+    for hit in hits:
+        source = hit.get("_source", {})
+        key = tuple(str(_get_path(source, f)) for f in DEDUPE_FIELDS)
+        groups.setdefault(key, []).append(source)
+
+    sample, tokens = [], 2
+    for key in _diverse_order(groups):
+        doc = project_document(groups[key][0], fields, settings.SUMMARY_MAX_FIELD_CHARS)
+        if len(groups[key]) > 1:
+            doc["duplicates"] = len(groups[key]) - 1
+        doc_tokens = count_tokens(prompt_json(doc)) + 1
+        if tokens + doc_tokens > token_budget:
+            if sample:
+                break
+            continue   # a single oversized document - try the next group
+        sample.append(doc)
+        tokens += doc_tokens
+
+    report = {"hits": len(hits), "groups": len(groups), "documents_sent": len(sample),
+              "tokens": tokens, "budget": token_budget}
+    return sample, report
+
+
+def sample_items(items: List[Any], token_budget: Optional[int] = None) -> Tuple[List[Any], Dict[str, Any]]:
+    """Budget-fit a list of Wazuh Manager API items (agents, alerts) in order, without projection."""
+    token_budget = token_budget or settings.SUMMARY_TOKEN_BUDGET
+    sample, tokens = [], 2
+    for item in items:
+        item_tokens = count_tokens(prompt_json(item)) + 1
+        if tokens + item_tokens > token_budget:
+            break
+        sample.append(item)
+        tokens += item_tokens
+    report = {"hits": len(items), "groups": len(items), "documents_sent": len(sample),
+              "tokens": tokens, "budget": token_budget}
+    return sample, report
@@ -33,6 +33,10 @@ class WazuhSearchPlan(BaseModel):
     aggregation: Optional[dict] = None
     limit: Optional[int] = Field(50, le=200)
     dry_run: Optional[bool] = False
+    # _source fields to return (None = default projection, ["*"] = whole documents)
+    fields: Optional[List[str]] = None
+    # keyword/numeric/date fields read from doc values, returned under hit["fields"]
+    docvalue_fields: Optional[List[str]] = None
 
     model_config = {
         "populate_by_name": True
@@ -0,0 +1,32 @@
+from fastapi.responses import JSONResponse
+from typing import Any
+import json
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+    HAS_ORJSON = True
+except ImportError:
+    orjson = None
+    HAS_ORJSON = False
+
+# Default response class for the app: orjson when installed (several times faster on
+# large indexer responses), the stdlib encoder otherwise
+DefaultResponse = ORJSONResponse if HAS_ORJSON else JSONResponse
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON bytes (orjson when available). Non-JSON types fall back to str()."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+
+def prompt_json(obj: Any) -> str:
+    """
+    JSON for LLM prompts: no indentation or spaces after separators and unescaped unicode,
+    since every whitespace/escape character costs tokens and the model doesn't need them.
+    """
+    if HAS_ORJSON:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str)
@@ -0,0 +1,62 @@
+# app/tests/test_agent_registry.py
+
+from app.agent_registry import AgentRegistry, _normalize_agent
+
+AGENTS = [
+    {"id": "001", "name": "web-01", "ip": "10.0.0.5", "status": "active", "os": {"name": "Ubuntu"}},
+    {"id": "002", "name": "DC01", "ip": "10.0.0.6", "status": "disconnected", "os": {"name": "Ubuntu"}},
+]
+
+def _registry():
+    registry = AgentRegistry(refresh_interval=300, retry_interval=30)
+    registry._load([_normalize_agent(agent) for agent in AGENTS])
+    return registry
+
+def test_registry_lookups():
+    """✅ Agents are indexed by id (zero-padded), name (case-insensitive), IP and OS."""
+    registry = _registry()
+    assert registry.get("1")["name"] == "web-01"
+    assert registry.by_name("dc01")["id"] == "002"
+    assert registry.by_ip("10.0.0.6")["name"] == "DC01"
+    assert len(registry.by_os("ubuntu")) == 2
+    assert registry.resolve("10.0.0.5")["id"] == "001"
+    assert registry.resolve("unknown-host") is None
+
+def test_registry_version_tracks_agent_list():
+    """✅ Version only changes when the agent list does."""
+    registry = _registry()
+    version = registry.version
+    registry._load([_normalize_agent(agent) for agent in AGENTS])
+    assert registry.version == version
+    registry._load([_normalize_agent(AGENTS[0])])
+    assert registry.version != version
+
+def test_fuzzy_agent_matching():
+    """✅ Filters only snap across case/separators; queries pick only the agents they mention."""
+    registry = _registry()
+    registry._load([_normalize_agent(agent) for agent in AGENTS + [
+        {"id": "003", "name": "linux-db", "ip": "10.0.0.7", "status": "active", "os": {"name": "Ubuntu"}},
+        {"id": "004", "name": "web-server-01", "ip": "10.0.0.8", "status": "active", "os": {"name": "Ubuntu"}},
+    ]])
+    assert registry.closest("dc-01")["name"] == "DC01"
+    assert registry.closest("webserver01")["name"] == "web-server-01"
+    assert registry.closest("web-02") is None          # different machine, never snapped
+    assert registry.closest("web-O1") is None          # typo: not confident enough to rewrite a filter
+    assert registry.closest("mailserver") is None
+    mentioned = registry.mentioned_in("failed logins on web01 in the last 5 hours")
+    assert [a["name"] for a in mentioned["exact"]] == ["web-01"]
+    mentioned = registry.mentioned_in("alerts on web-srever-01")
+    assert mentioned["exact"] == [] and [a["name"] for a in mentioned["candidates"]] == ["web-server-01"]
+    assert registry.mentioned_in("brute force attacks on linux hosts") == {"exact": [], "candidates": []}
+    assert registry.mentioned_in("failed logins on web-02") == {"exact": [], "candidates": []}
+
+def test_record_keeps_the_fetched_agent_fields():
+    """✅ get_agent gets the fetched record (nested os, version, lastKeepAlive); lookups stay slim."""
+    record = {"id": "001", "name": "web-01", "ip": "10.0.0.5", "status": "active",
+              "os": {"name": "Ubuntu", "platform": "ubuntu"}, "version": "Wazuh v4.7.0",
+              "lastKeepAlive": "2026-10-16T12:00:00Z"}
+    registry = AgentRegistry(refresh_interval=300, retry_interval=30)
+    registry._load([_normalize_agent(record)], records=[record])
+    assert registry.record("1") == record
+    assert registry.resolve("web-01")["os"] == "Ubuntu"
+    assert registry.record("999") is None
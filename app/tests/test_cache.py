@@ -0,0 +1,56 @@
+# app/tests/test_cache.py
+
+import time
+from app.cache import TTLCache
+
+def test_cache_hit_and_miss_counters():
+    """✅ get() counts hits and misses."""
+    cache = TTLCache(max_entries=10, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+def test_cache_lru_eviction():
+    """✅ Least recently used entry is evicted first."""
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")          # "b" is now least recently used
+    cache.set("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.evictions == 1
+
+def test_cache_ttl_expiry():
+    """✅ Expired entries are treated as misses."""
+    cache = TTLCache(max_entries=10, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_cache_invalidate_and_clear():
+    """✅ Single-key invalidation and full clear."""
+    cache = TTLCache(max_entries=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.invalidate("a") is True
+    assert cache.invalidate("a") is False
+    assert cache.clear() == 1
+
+def test_cache_byte_bound_and_entry_hits():
+    """✅ max_bytes evicts oldest entries; per-entry hits are tracked."""
+    cache = TTLCache(max_entries=10, ttl=60, max_bytes=100)
+    cache.set("a", "x", size=60)
+    cache.get("a")
+    cache.get("a")
+    assert cache.entries()[0]["hits"] == 2
+    cache.set("b", "y", size=60)
+    assert "a" not in cache
+    assert cache.total_bytes == 60
+    cache.set("huge", "z", size=500)   # larger than the whole cache - not stored
+    assert "huge" not in cache
+    cache.set("b", "y2", size=500)     # oversize update drops the stale value
+    assert "b" not in cache and cache.total_bytes == 0
@@ -0,0 +1,33 @@
+# app/tests/test_dsl_projection.py
+
+from app.dsl_builder import build_dsl
+from app.schemas import WazuhSearchPlan
+
+def _plan(**kwargs):
+    return WazuhSearchPlan(indices="wazuh-alerts-*", time={"from": "now-24h", "to": "now"}, **kwargs)
+
+def test_default_projection_drops_bulky_fields():
+    """✅ Default _source projection keeps allowlisted fields and excludes full_log."""
+    source = build_dsl(_plan())["_source"]
+    assert "rule.level" in source["includes"]
+    assert "full_log" not in source["includes"]
+    assert "full_log" in source["excludes"]
+
+def test_explicit_fields_and_docvalue_fields():
+    """✅ Requested fields win over excludes; docvalue fields are not read from _source."""
+    dsl = build_dsl(_plan(fields=["agent.name", "full_log", "@timestamp"], docvalue_fields=["@timestamp"]))
+    assert dsl["_source"]["includes"] == ["agent.name", "full_log"]
+    assert "full_log" not in dsl["_source"]["excludes"]
+    assert dsl["docvalue_fields"] == [{"field": "@timestamp", "format": "strict_date_optional_time"}]
+
+def test_aggregation_only_query_skips_source():
+    """✅ size=0 queries don't fetch _source at all."""
+    assert build_dsl(_plan(aggregation={"type": "count"}))["_source"] is False
+
+def test_summary_aggregation_bundle():
+    """✅ summary_aggs attaches the bundle next to the plan's own aggregation."""
+    plan = _plan(aggregation={"type": "terms", "field": "rule.id", "size": 5})
+    body = build_dsl(plan, summary_aggs=True)
+    assert {"top_terms", "summary_rules", "summary_agents", "summary_srcips",
+            "summary_histogram", "summary_levels"} <= set(body["aggs"])
+    assert "aggs" not in build_dsl(_plan())
@@ -0,0 +1,91 @@
+# app/tests/test_es_client.py
+
+from app.es_client import round_relative_times, cache_key
+
+def test_round_relative_times():
+    """✅ Inclusive now-relative range bounds are rounded with date math, others untouched."""
+    body = {
+        "query": {"bool": {"filter": [
+            {"range": {"@timestamp": {"gte": "now-24h", "lte": "now"}}},
+            {"range": {"rule.level": {"gte": 12}}},
+            {"range": {"timestamp": {"gte": "now-1d/d", "lt": "2025-11-05T00:00:00"}}},
+            {"range": {"@timestamp": {"gt": "now-1h", "lt": "now"}}},
+        ]}},
+        "size": 50,
+    }
+    rounded = round_relative_times(body, "m")
+    ranges = rounded["query"]["bool"]["filter"]
+    assert ranges[0]["range"]["@timestamp"] == {"gte": "now-24h/m", "lte": "now/m"}
+    assert ranges[1]["range"]["rule.level"] == {"gte": 12}
+    assert ranges[2]["range"]["timestamp"] == {"gte": "now-1d/d", "lt": "2025-11-05T00:00:00"}
+    # exclusive bounds would be narrowed by rounding
+    assert ranges[3]["range"]["@timestamp"] == {"gt": "now-1h", "lt": "now"}
+    # original body is not modified
+    assert body["query"]["bool"]["filter"][0]["range"]["@timestamp"]["gte"] == "now-24h"
+
+def test_cache_key_is_canonical():
+    """✅ Key order does not change the cache key; index pattern does."""
+    a = {"size": 10, "query": {"match_all": {}}}
+    b = {"query": {"match_all": {}}, "size": 10}
+    assert cache_key("wazuh-alerts-*", a) == cache_key("wazuh-alerts-*", b)
+    assert cache_key("wazuh-alerts-*", a) != cache_key("wazuh-archives-*", a)
+
+def test_cached_msearch_fills_missing_responses(monkeypatch):
+    """✅ A truncated _msearch body yields an error entry per missing search, never None."""
+    import asyncio
+    from app import es_client
+
+    async def truncated_msearch(searches, timeout=None):
+        return {"responses": [{"hits": {"hits": []}}]}
+    monkeypatch.setattr(es_client, "_msearch", truncated_msearch)
+    responses, _ = asyncio.run(es_client.cached_msearch(
+        [("wazuh-alerts-*", {"size": 1}), ("wazuh-alerts-*", {"size": 2})], use_cache=False))
+    assert "hits" in responses[0]
+    assert "error" in responses[1]
+
+def test_cached_search_survives_cancelled_leader(monkeypatch):
+    """✅ Cancelling the request that started a search doesn't cancel identical requests that joined it."""
+    import asyncio
+    from app import es_client
+    from app.config import settings
+
+    calls = []
+    async def slow_search(indices, body, timeout=None):
+        calls.append(body)
+        await asyncio.sleep(0.05)
+        return {"hits": {"hits": [{"_id": "1"}]}}
+    monkeypatch.setattr(es_client, "_search", slow_search)
+    monkeypatch.setattr(settings, "RESULT_CACHE_ENABLED", True)
+    es_client.result_cache.clear()
+
+    async def run():
+        body = {"size": 1, "query": {"term": {"rule.id": "leader-cancel-test"}}}
+        leader = asyncio.create_task(es_client.cached_search("wazuh-alerts-*", body))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(es_client.cached_search("wazuh-alerts-*", body))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        result, info = await follower
+        assert leader.cancelled() and not follower.cancelled()
+        assert result["hits"]["hits"][0]["_id"] == "1" and info["status"] == "MISS"
+    asyncio.run(run())
+    assert len(calls) == 2   # the follower ran the search itself
+
+def test_indexer_errors_keep_the_opensearch_reason(monkeypatch):
+    """✅ A 4xx from the async backend raises opensearch-py's exception with the error type and reason."""
+    import asyncio
+    import httpx
+    import pytest
+    from opensearchpy.exceptions import RequestError
+    from app import es_client
+
+    def bad_dsl(request):
+        return httpx.Response(400, json={"status": 400, "error": {
+            "root_cause": [{"type": "parsing_exception", "reason": "unknown query [mtch]"}],
+            "type": "parsing_exception", "reason": "unknown query [mtch]"}})
+    indexer = es_client.AsyncIndexerClient("http://indexer:9200", None, None)
+    monkeypatch.setattr(indexer.client, "_transport", httpx.MockTransport(bad_dsl))
+    with pytest.raises(RequestError) as error:
+        asyncio.run(indexer.search("wazuh-alerts-*", {"query": {"mtch": {}}}))
+    assert error.value.status_code == 400 and error.value.error == "parsing_exception"
+    assert str(error.value) == "RequestError(400, 'parsing_exception', 'unknown query [mtch]')"
@@ -0,0 +1,29 @@
+# app/tests/test_example_index.py
+
+import os
+from app.example_index import BM25Index, ExampleIndex, tokenize
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "..", "planner_examples.json")
+
+def test_bm25_ranks_matching_documents_first():
+    """✅ BM25 prefers the document sharing the rarer query terms; plurals match singulars."""
+    index = BM25Index(["failed ssh login attempts", "windows logon failures", "file integrity changes"])
+    assert tokenize("Failed logins") == ["failed", "login"]
+    assert index.search("failed logins over ssh", k=2)[0][0] == 0
+    assert index.search("nothing relevant", k=2) == []
+
+def test_curated_examples_and_sections_are_selected():
+    """✅ The repo's curated examples load and FIM queries pull the FIM section and examples."""
+    index = ExampleIndex(EXAMPLES_PATH, {"fim": "File Integrity Monitoring", "failed_logins": "Failed Login Attempts"})
+    assert index.default_examples()
+    examples, sections = index.select("files modified on web servers this week", 2, 1)
+    assert sections == ["fim"]
+    assert "files" in examples[0]["query"].lower()
+
+def test_retrieval_prompts_keep_a_cacheable_prefix():
+    """✅ Retrieved planner prompts share a static prefix above the 1024-token prompt-cache minimum."""
+    from app.llm_client import PLANNER_CACHED_PREFIX, build_planner_prompt
+    first = build_planner_prompt({"agents": []}, "failed ssh logins last hour")
+    second = build_planner_prompt({"agents": []}, "files modified on web servers today")
+    assert first.startswith(PLANNER_CACHED_PREFIX) and second.startswith(PLANNER_CACHED_PREFIX)
+    assert len(PLANNER_CACHED_PREFIX) // 4 >= 1024   # ~4 chars per token
@@ -0,0 +1,87 @@
+# app/tests/test_export.py
+
+import asyncio
+import pytest
+from fastapi import HTTPException
+from opensearchpy.exceptions import NotFoundError
+from app import es_client, main
+
+class FakeIndexer:
+    """In-memory _search/point_in_time endpoints over `total` documents sorted by their number."""
+    def __init__(self, total, fail_after=None, expire_pit=False):
+        self.total = total
+        self.fail_after = fail_after
+        self.expire_pit = expire_pit
+        self.searches = []
+        self.opened = []
+        self.deleted = []
+
+    async def __call__(self, method, path, params=None, body=None):
+        if method == "POST" and path.endswith("/_search/point_in_time"):
+            self.opened.append(f"pit-{len(self.opened) + 1}")
+            return {"pit_id": self.opened[-1]}
+        if method == "DELETE":
+            self.deleted.extend(body["pit_id"])
+            return {}
+        self.searches.append(body)
+        if self.expire_pit and body["pit"]["id"] == "expired-pit":
+            raise NotFoundError(404, "search_context_missing_exception", {})
+        start = body["search_after"][0] + 1 if "search_after" in body else 0
+        if self.fail_after is not None and start >= self.fail_after:
+            raise RuntimeError("indexer down")
+        hits = [{"_id": str(n), "_index": "wazuh-alerts-1", "_source": {"n": n}, "sort": [n, str(n)]}
+                for n in range(start, min(start + body["size"], self.total))]
+        return {"pit_id": body["pit"]["id"], "hits": {"hits": hits}}
+
+def _export(indexer, monkeypatch, **kwargs):
+    monkeypatch.setattr(es_client, "_request", indexer)
+    async def collect():
+        return [hits async for _, hits in es_client.export_pages("wazuh-alerts-*", None, **kwargs)]
+    return asyncio.run(collect())
+
+def test_export_pages_through_pit_and_deletes_it(monkeypatch):
+    """✅ Every document is exported once, page by page, and the PIT is deleted at the end."""
+    indexer = FakeIndexer(total=25)
+    pages = _export(indexer, monkeypatch, page_size=10)
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [hit["_id"] for page in pages for hit in page] == [str(n) for n in range(25)]
+    assert indexer.deleted == ["pit-1"]
+    assert indexer.searches[0]["sort"][-1] == {"_id": {"order": "asc"}}
+
+def test_export_resumes_from_cursor_and_caps_max_docs(monkeypatch):
+    """✅ search_after resumes right after the cursor; max_docs stops the export early."""
+    indexer = FakeIndexer(total=100)
+    cursor = es_client.encode_cursor([41, "41"])
+    pages = _export(indexer, monkeypatch, page_size=10, max_docs=15,
+                    search_after=es_client.decode_cursor(cursor))
+    ids = [hit["_id"] for page in pages for hit in page]
+    assert ids[0] == "42" and len(ids) == 15
+    assert indexer.searches[0]["search_after"] == [41, "41"]
+
+def test_export_replaces_expired_pit(monkeypatch):
+    """✅ An expired PIT is replaced and the export continues from the same position."""
+    indexer = FakeIndexer(total=5, expire_pit=True)
+    pages = _export(indexer, monkeypatch, page_size=10, pit_id="expired-pit")
+    assert len(pages[0]) == 5
+    assert indexer.opened == ["pit-1"] and indexer.deleted == ["pit-1"]   # the replacement is cleaned up
+
+def test_interrupted_export_keeps_pit_for_resume(monkeypatch):
+    """✅ A mid-stream failure raises ExportInterrupted with the current PIT and leaves it alive."""
+    indexer = FakeIndexer(total=100, fail_after=20)
+    with pytest.raises(es_client.ExportInterrupted) as error:
+        _export(indexer, monkeypatch, page_size=10)
+    assert error.value.pit_id == "pit-1" and indexer.deleted == []
+
+def test_user_sort_gets_tiebreaker():
+    """✅ Caller sorts get "_id" appended once so search_after has a total order."""
+    assert es_client.with_tiebreaker([{"rule.level": "desc"}]) == [{"rule.level": "desc"}, {"_id": {"order": "asc"}}]
+    assert es_client.with_tiebreaker({"rule.level": "desc"})[-1] == {"_id": {"order": "asc"}}
+    assert es_client.with_tiebreaker(["_id"]) == ["_id"]
+    assert es_client.with_tiebreaker(None) == es_client.DEFAULT_EXPORT_SORT
+
+@pytest.mark.parametrize("body", [{"fields": "rule.id"}, {"fields": [1, 2]}, {"page_size": "x"}, {"max_docs": 0}])
+def test_export_endpoint_rejects_bad_parameters(body):
+    """✅ Malformed fields/page_size/max_docs are a 400 before anything is streamed."""
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.export_dsl(body))
+    assert error.value.status_code == 400
@@ -0,0 +1,34 @@
+# app/tests/test_field_registry.py
+
+from app.field_registry import FieldRegistry, flatten_mapping
+
+MAPPING = {
+    "rule": {"properties": {"level": {"type": "long"}, "description": {"type": "keyword"}}},
+    "full_log": {"type": "text"},
+    "data": {"properties": {"title": {"type": "text", "fields": {"raw": {"type": "keyword"}}},
+                            "srcip": {"type": "ip"}}},
+}
+
+def test_mapping_lookups():
+    """✅ Types and keyword sub-fields come from the mapping, not from guessed ".keyword" suffixes."""
+    registry = FieldRegistry(refresh_interval=3600, retry_interval=60, cache_path=None)
+    registry._load(flatten_mapping(MAPPING), "indexer")
+    assert registry.type_of("rule.level") == "long"
+    assert registry.supports_range("rule.level") and registry.supports_range("data.srcip")
+    assert registry.term_field("rule.description") == "rule.description"
+    assert registry.term_field("data.title") == "data.title.raw"
+    assert not registry.supports_exact("full_log")
+    assert not registry.is_known("agent.name")
+
+def test_disk_cache_round_trip(tmp_path):
+    """✅ A saved mapping is picked up by a new registry without contacting the indexer."""
+    path = str(tmp_path / "fields.json")
+    registry = FieldRegistry(refresh_interval=3600, retry_interval=60, cache_path=path)
+    registry._load(flatten_mapping(MAPPING), "indexer")
+    registry.save_cache()
+
+    restarted = FieldRegistry(refresh_interval=3600, retry_interval=60, cache_path=path)
+    assert restarted.type_of("data.title") is None   # template defaults until the cache is read
+    assert restarted.load_cache()
+    assert restarted.source == "cache"
+    assert restarted.term_field("data.title") == "data.title.raw"
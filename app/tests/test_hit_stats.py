@@ -0,0 +1,51 @@
+# app/tests/test_hit_stats.py
+
+from app.hit_stats import compute_hit_stats, format_stats_table, stats_from_aggregations
+
+def _hit(rule_id, level, agent, srcip, ts):
+    return {"_source": {"@timestamp": ts, "rule": {"id": rule_id, "level": level, "description": f"rule {rule_id}"},
+                        "agent": {"name": agent}, "data": {"srcip": srcip}}}
+
+def test_hit_stats_counts_every_hit():
+    """✅ Levels, top rules/agents/IPs and the histogram cover all hits, not a sample."""
+    hits = ([_hit("5710", 5, "web-01", "1.2.3.4", "2025-11-05T10:00:00Z") for _ in range(30)]
+            + [_hit("5503", 10, "db-01", "5.6.7.8", "2025-11-05T11:30:00Z") for _ in range(3)])
+    stats = compute_hit_stats(hits, total=500)
+    assert stats["total"] == 500 and stats["analysed"] == 33
+    assert stats["levels"] == [(10, 3), (5, 30)]
+    assert stats["rules"][0] == ("5710", "rule 5710", 30)
+    assert stats["agents"] == [("web-01", 30), ("db-01", 3)]
+    assert stats["histogram"]["interval"] == "5m"
+    assert sum(count for _, count in stats["histogram"]["buckets"]) == 33
+
+    table = format_stats_table(stats)
+    assert "Hits analysed: 33 of 500 matching" in table
+    assert "web-01: 30" in table
+
+def test_hit_stats_without_tracked_total():
+    """✅ A missing/uncounted hits.total (track_total_hits: false) never leaks into the table."""
+    hits = [_hit("5710", 5, "web-01", "1.2.3.4", "2025-11-05T10:00:00Z")]
+    assert compute_hit_stats(hits, total={"value": 40, "relation": "eq"})["total"] == 40
+    stats = compute_hit_stats(hits, total={})
+    assert stats["total"] is None
+    table = format_stats_table(stats)
+    assert "Hits analysed: 1 (total matches not counted)" in table and "{}" not in table
+
+def test_stats_from_summary_aggregations():
+    """✅ The indexer-side aggregation bundle renders through the same table."""
+    aggs = {
+        "summary_levels": {"count": 12000, "min": 3, "max": 12, "avg": 5.25},
+        "summary_rules": {"buckets": [{"key": "5710", "doc_count": 9000, "description": {"hits": {"hits": [
+            {"_source": {"rule": {"description": "sshd: non-existent user"}}}]}}}]},
+        "summary_agents": {"buckets": [{"key": "web-01", "doc_count": 8000}]},
+        "summary_srcips": {"buckets": []},
+        "summary_histogram": {"interval": "1h", "buckets": [
+            {"key_as_string": "2025-11-05T10:00:00.000Z", "key": 1762336800000, "doc_count": 12000}]},
+    }
+    stats = stats_from_aggregations(aggs)
+    assert stats["total"] == 12000
+    assert stats["rules"] == [("5710", "sshd: non-existent user", 9000)]
+    table = format_stats_table(stats)
+    assert "Alerts matching (aggregated by the indexer): 12000" in table
+    assert "Rule level: min 3, max 12, avg 5.2" in table
+    assert stats_from_aggregations({"top_terms": {"buckets": []}}) is None
@@ -0,0 +1,67 @@
+# app/tests/test_llm_gateway.py
+
+import asyncio
+import gc
+import json
+import httpx
+import pytest
+from app.llm_gateway import LLMGateway
+
+def _chunk(content):
+    return {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "m",
+            "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]}
+
+def _gateway(handler, max_concurrency=1):
+    gateway = LLMGateway(max_concurrency=max_concurrency, default_timeout=5.0)
+    gateway.http_client._transport = httpx.MockTransport(handler)
+    return gateway
+
+def _stream(request):
+    body = "".join(f"data: {json.dumps(_chunk(text))}\n\n" for text in ("a", "b", "c")) + "data: [DONE]\n\n"
+    return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+
+def _free_slots(gateway):
+    return gateway._semaphore._value
+
+def test_slot_released_after_queue_timeout():
+    """✅ A call that times out waiting for a slot doesn't take (or leak) one."""
+    async def run():
+        gateway = _gateway(_stream)
+        await gateway._semaphore.acquire()   # the only slot is busy
+        with pytest.raises(asyncio.TimeoutError):
+            await gateway.chat([{"role": "user", "content": "hi"}], timeout=0.05)
+        gateway._semaphore.release()
+        assert _free_slots(gateway) == 1
+        assert gateway.stats()["timeouts"] == 1 and gateway.stats()["queued"] == 0
+    asyncio.run(run())
+
+def test_slot_released_after_request_error():
+    """✅ An OpenAI error inside the slot releases it and is counted."""
+    def failing(request):
+        return httpx.Response(400, json={"error": {"message": "bad request", "type": "invalid_request_error"}})
+    async def run():
+        gateway = _gateway(failing)
+        with pytest.raises(Exception):
+            await gateway.chat([{"role": "user", "content": "hi"}])
+        assert _free_slots(gateway) == 1
+        assert gateway.stats()["errors"] == 1 and gateway.stats()["in_flight"] == 0
+    asyncio.run(run())
+
+def test_slot_released_when_stream_is_abandoned():
+    """✅ Closing or dropping a stream_chat generator mid-stream frees the slot."""
+    async def run():
+        gateway = _gateway(_stream)
+        stream = gateway.stream_chat([{"role": "user", "content": "hi"}])
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        assert _free_slots(gateway) == 1
+
+        stream = gateway.stream_chat([{"role": "user", "content": "hi"}])
+        assert await stream.__anext__() == "a"
+        del stream          # consumer went away without closing it
+        gc.collect()
+        for _ in range(5):  # the loop finalizes abandoned async generators in a task
+            await asyncio.sleep(0)
+        assert _free_slots(gateway) == 1
+        assert [text async for text in gateway.stream_chat([{"role": "user", "content": "hi"}])] == ["a", "b", "c"]
+    asyncio.run(run())
@@ -0,0 +1,45 @@
+# app/tests/test_local_planner.py
+
+from app import local_planner
+from app.agent_registry import AgentRegistry, _normalize_agent
+
+def _use_agents(monkeypatch):
+    registry = AgentRegistry(refresh_interval=300, retry_interval=30)
+    registry._load([_normalize_agent({"id": "001", "name": "web-01", "ip": "10.0.0.5", "status": "active"})])
+    monkeypatch.setattr(local_planner, "agent_registry", registry)
+
+def test_templated_queries_are_planned_locally(monkeypatch):
+    """✅ Severity, time, failed-login, agent and source-IP shapes produce a plan without GPT."""
+    _use_agents(monkeypatch)
+    plan = local_planner.plan_query_locally("Critical alerts last 6 hours")
+    assert plan["time"]["from"] == "now-6h"
+    assert plan["filters"] == [{"field": "rule.level", "op": "gte", "value": 12}]
+
+    plan = local_planner.plan_query_locally("failed logins on web-01")
+    assert plan["filters"][0]["value"] == local_planner.FAILED_LOGIN_RULES
+    assert plan["filters"][1] == {"field": "agent.name", "op": "eq", "value": "web-01"}
+
+    plan = local_planner.plan_query_locally("failed windows logins today")
+    assert plan["filters"] == [{"field": "data.win.system.eventID", "op": "eq", "value": "4625"}]
+    plan = local_planner.plan_query_locally("ssh login failures last 2 hours")
+    assert plan["filters"] == local_planner.FAILED_LOGIN_FILTERS["ssh"]
+
+    plan = local_planner.plan_query_locally("alerts from 203.0.113.7")
+    assert plan["filters"] == [{"field": "data.srcip", "op": "eq", "value": "203.0.113.7"}]
+
+def test_unrecognized_queries_fall_back(monkeypatch):
+    """✅ Unknown agents or words outside the grammar return None so GPT plans the query."""
+    _use_agents(monkeypatch)
+    assert local_planner.plan_query_locally("failed logins on unknown-box") is None
+    assert local_planner.plan_query_locally("brute force attacks from China") is None
+    assert local_planner.plan_query_locally("what is going on with the web server") is None
+    assert local_planner.plan_query_locally("alerts last 3 weeks") is None   # beyond TIME_MAX_DAYS
+
+def test_repeated_fields_are_merged(monkeypatch):
+    """✅ The same field named twice becomes one "in" filter, never two ANDed eq filters."""
+    _use_agents(monkeypatch)
+    plan = local_planner.plan_query_locally("alerts for user admin and user root")
+    assert plan["filters"] == [{"field": "data.srcuser", "op": "in", "value": ["admin", "root"]}]
+    plan = local_planner.plan_query_locally("alerts for user admin and user admin")
+    assert plan["filters"] == [{"field": "data.srcuser", "op": "eq", "value": "admin"}]
+    assert local_planner.plan_query_locally("alerts from 203.0.113.7 and src ip 198.51.100.2") is None
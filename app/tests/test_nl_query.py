@@ -0,0 +1,244 @@
+# app/tests/test_nl_query.py
+
+import asyncio
+import json
+import httpx
+import pytest
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from app import llm_client, main
+from app.config import settings
+from app.llm_gateway import gateway as llm_gateway
+
+LEAN = {"lean": True, "hits_only": False}
+
+def test_lean_profile_sends_agent_list_once():
+    """✅ profile=lean drops the duplicate "agents" copy of a list_agents result."""
+    agents = [{"id": "001", "name": "web-01"}]
+    payload = {"success": True, "raw_data": {"total": 1, "agents": agents, "data": {"affected_items": agents}}}
+    shaped = main._shape_results(payload, LEAN)
+    assert shaped["raw_data"] == {"total": 1, "data": {"affected_items": agents}}
+    assert "agents" in payload["raw_data"]   # the original payload is untouched
+    assert main._shape_results(payload, {"lean": False, "hits_only": False}) is payload
+
+def _stream_llm(request):
+    chunks = [{"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "m",
+               "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+              for text in ("Two ", "critical ", "alerts.")]
+    body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+    return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+
+def _use_fakes(monkeypatch):
+    async def fake_search(index, body, use_cache=True):
+        hits = [{"_id": str(n), "_index": "wazuh-alerts-1", "_source": {"rule": {"level": 12}}} for n in range(2)]
+        return {"hits": {"total": {"value": 2}, "hits": hits}}, {"status": "MISS", "age": 0}
+    monkeypatch.setattr(main, "cached_search", fake_search)
+    monkeypatch.setattr(llm_gateway.http_client, "_transport", httpx.MockTransport(_stream_llm))
+
+def test_stream_emits_cache_results_summary_done(monkeypatch):
+    """✅ stream=true sends cache, results, summary deltas and a final done event as NDJSON lines."""
+    _use_fakes(monkeypatch)
+    response = TestClient(main.app).post("/query/dsl", json={"query": {"match_all": {}}, "stream": True})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["event"] for e in events] == ["cache", "results", "summary", "summary", "summary", "done"]
+    assert events[1]["data"]["total_hits"] == 2
+    assert "".join(e["data"]["delta"] for e in events if e["event"] == "summary") == "Two critical alerts."
+    assert {"first_byte_ms", "first_token_ms", "total_ms"} <= set(events[-1]["data"]["timings"])
+
+def test_buffered_response_reports_cache_headers(monkeypatch):
+    """✅ Without stream, the cache info from cached_search becomes X-Cache / X-Cache-Age headers."""
+    _use_fakes(monkeypatch)
+    response = TestClient(main.app).post("/query/dsl", json={"query": {"match_all": {}}, "include_summary": False})
+    assert response.status_code == 200 and response.json()["total_hits"] == 2
+    assert response.headers["x-cache"] == "MISS" and response.headers["x-cache-age"] == "0"
+
+def test_stream_disconnect_releases_llm_slot(monkeypatch):
+    """✅ A client that disconnects mid-summary closes the stream and frees the gateway slot."""
+    _use_fakes(monkeypatch)
+    async def run():
+        stages = main._dsl_query_stages("wazuh-alerts-*", {"query": {"match_all": {}}}, True, True)
+        events = main._stream_query_events(stages, "DSL")
+        seen = []
+        async for line in events:
+            seen.append(json.loads(line)["event"])
+            if seen[-1] == "summary":
+                break
+        await events.aclose()   # what StreamingResponse does when the client goes away
+        return seen
+    assert asyncio.run(run()) == ["cache", "results", "summary"]
+    assert llm_gateway.stats()["in_flight"] == 0
+    assert llm_gateway._semaphore._value == settings.LLM_MAX_CONCURRENCY
+
+@pytest.mark.parametrize("path, body", [
+    ("/query/dsl", {"index": "secrets-*", "query": {"match_all": {}}, "stream": True}),
+    ("/query/nl", {"query": 'Analyze this: {"index": "secrets-*", "query": {"match_all": {}}}', "stream": True}),
+])
+def test_stream_rejects_disallowed_index_with_400(monkeypatch, path, body):
+    """✅ Validation that needs no indexer/LLM call fails with a 4xx status, not a 200 error event."""
+    _use_fakes(monkeypatch)
+    response = TestClient(main.app).post(path, json=body)
+    assert response.status_code == 400 and response.json()["detail"] == "Index not allowed"
+
+PLAN = {"indices": "wazuh-alerts-*", "time": {"from": "now-24h", "to": "now"},
+        "filters": [{"field": "rule.level", "op": "gte", "value": 12}], "limit": 10}
+
+def _use_planner(monkeypatch, pipeline, plans):
+    """Route to `pipeline`; each parse_query_to_plan call runs the next coroutine function in `plans`."""
+    async def route(query):
+        return {"pipeline": pipeline, "confidence": 0.9, "reasoning": ""}
+    async def parse_simple(query):
+        return {"operation": "list_agents", "filters": {"status": None}}
+    calls = iter(plans)
+    async def parse_plan(query, wazuh_client=None, agent_ctx=None):
+        return await next(calls)()
+    monkeypatch.setattr(llm_client, "route_query", route)
+    monkeypatch.setattr(llm_client, "parse_simple_query", parse_simple)
+    monkeypatch.setattr(llm_client, "parse_query_to_plan", parse_plan)
+    monkeypatch.setattr(main, "wazuh_client", None)
+
+def test_lean_list_agents_keeps_the_shape_the_ui_renders(monkeypatch):
+    """✅ A lean, streamed list_agents result still has raw_data.data.affected_items (displayFormattedData)."""
+    agents = [{"id": "001", "name": "web-01", "status": "active", "os": {"name": "Ubuntu"}}]
+    async def no_plan():
+        raise AssertionError("SIMPLE_PIPELINE must not plan")
+    _use_planner(monkeypatch, "SIMPLE_PIPELINE", [no_plan])
+    async def get_agents(status=None):
+        return {"total": len(agents), "agents": list(agents)}
+    monkeypatch.setattr(main, "wazuh_client", SimpleNamespace(get_agents=get_agents))
+    monkeypatch.setattr(llm_gateway.http_client, "_transport", httpx.MockTransport(_stream_llm))
+    response = TestClient(main.app).post(
+        "/query/nl?profile=lean&hits_only=true",   # frontend/app.js RESPONSE_PROFILE
+        json={"query": "show me all agents", "stream": True, "planning_mode": "sequential"})
+    results = [json.loads(line)["data"] for line in response.text.splitlines()
+               if json.loads(line)["event"] == "results"]
+    assert results[0]["raw_data"]["data"]["affected_items"] == agents
+    assert "agents" not in results[0]["raw_data"]
+
+async def _stages_until(stage_name, timings, mode="speculative"):
+    stages = main._routed_query_stages("critical alerts", timings, mode)
+    seen = []
+    async for stage, payload in stages:
+        seen.append((stage, payload))
+        if stage == stage_name:
+            break
+    await stages.aclose()
+    return seen
+
+def test_speculative_plan_is_cancelled_when_routing_picks_simple(monkeypatch):
+    """✅ The speculative advanced plan loses to SIMPLE_PIPELINE and is cancelled, not awaited."""
+    started, cancelled = asyncio.Event(), asyncio.Event()
+    async def slow_plan():
+        started.set()
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    _use_planner(monkeypatch, "SIMPLE_PIPELINE", [slow_plan])
+    async def route_after_planning_starts(query):
+        await started.wait()
+        return {"pipeline": "SIMPLE_PIPELINE", "confidence": 0.9, "reasoning": ""}
+    monkeypatch.setattr(llm_client, "route_query", route_after_planning_starts)
+    async def run():
+        timings = {}
+        seen = await _stages_until("plan", timings)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return seen, timings
+    seen, timings = asyncio.run(run())
+    assert [stage for stage, _ in seen] == ["routing", "plan"]
+    assert seen[1][1]["parsed_query"]["operation"] == "list_agents"
+    assert timings["speculative_plan_cancelled"] is True
+
+def test_failed_speculative_plan_is_replanned(monkeypatch):
+    """✅ If the speculative plan raised, the ADVANCED pipeline plans again instead of failing the query."""
+    async def failing_plan():
+        raise RuntimeError("planner timeout")
+    async def good_plan():
+        return dict(PLAN)
+    _use_planner(monkeypatch, "ADVANCED_PIPELINE", [failing_plan, good_plan])
+    timings = {}
+    seen = asyncio.run(_stages_until("plan", timings))
+    assert [stage for stage, _ in seen] == ["routing", "plan"]
+    assert seen[1][1]["parsed_query"] == PLAN
+    assert timings["speculative_plan_failed"] is True
+
+@pytest.mark.parametrize("content", [
+    "not json at all",
+    '{"routing": "ADVANCED_PIPELINE"}',
+    '{"routing": {"pipeline": "SOMETHING_ELSE"}}',
+    '{"plan": {}}',
+])
+def test_malformed_combined_response_falls_back_to_router(monkeypatch, content):
+    """✅ A combined router/planner reply that isn't the expected JSON falls back to the two-call flow."""
+    async def chat(**kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+    async def route(query):
+        return {"pipeline": "ADVANCED_PIPELINE", "confidence": 0.9, "reasoning": "fallback"}
+    monkeypatch.setattr(llm_client.gateway, "chat", chat)
+    monkeypatch.setattr(llm_client, "route_query", route)
+    monkeypatch.setattr(settings, "ROUTING_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "ROUTING_FAST_CLASSIFIER", False)
+    result = asyncio.run(llm_client.route_and_plan("zq handshake anomalies", agent_ctx={"agents": [], "version": ""}))
+    assert result == {"routing": {"pipeline": "ADVANCED_PIPELINE", "confidence": 0.9, "reasoning": "fallback"},
+                      "simple_query": None, "plan": None}
+
+def test_combined_response_with_unusable_plan_keeps_routing(monkeypatch):
+    """✅ A valid routing decision with a non-object plan returns plan=None so the planner runs separately."""
+    content = '{"routing": {"pipeline": "ADVANCED_PIPELINE", "confidence": "high"}, "plan": "critical alerts"}'
+    async def chat(**kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+    monkeypatch.setattr(llm_client.gateway, "chat", chat)
+    monkeypatch.setattr(settings, "ROUTING_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "ROUTING_FAST_CLASSIFIER", False)
+    result = asyncio.run(llm_client.route_and_plan("zq handshake anomalies", agent_ctx={"agents": [], "version": ""}))
+    assert result["routing"]["pipeline"] == "ADVANCED_PIPELINE" and result["routing"]["confidence"] == 0.95
+    assert result["plan"] is None and result["simple_query"] is None
+
+def _plan_reply(monkeypatch, plan):
+    """Every planner GPT call returns `plan`; returns the list of calls made."""
+    calls = []
+    async def chat(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(plan)))])
+    monkeypatch.setattr(llm_client.gateway, "chat", chat)
+    monkeypatch.setattr(settings, "PLAN_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "LOCAL_PLANNER_ENABLED", False)
+    llm_client.plan_cache.clear()
+    return calls
+
+@pytest.mark.parametrize("plan", [
+    {**PLAN, "time": {"from": "2026-01-01T00:00:00", "to": "2026-03-01T00:00:00"}},   # over TIME_MAX_DAYS
+    {**PLAN, "filters": [{"field": "rule.description", "op": "gte", "value": "ssh"}]},  # range on a text field
+    {**PLAN, "indices": "secrets-*"},
+])
+def test_rejected_plan_is_not_cached(monkeypatch, plan):
+    """✅ A GPT plan that /query/nl would reject is not cached - the next identical query asks GPT again."""
+    calls = _plan_reply(monkeypatch, plan)
+    ctx = {"agents": [], "version": ""}
+    asyncio.run(llm_client.parse_query_to_plan("zq handshake anomalies", agent_ctx=ctx))
+    asyncio.run(llm_client.parse_query_to_plan("zq handshake anomalies", agent_ctx=ctx))
+    assert len(calls) == 2 and len(llm_client.plan_cache) == 0
+
+def test_valid_plan_is_cached(monkeypatch):
+    """✅ A plan that passes validation is served from the plan cache on repeat."""
+    calls = _plan_reply(monkeypatch, PLAN)
+    ctx = {"agents": [], "version": ""}
+    first = asyncio.run(llm_client.parse_query_to_plan("zq handshake anomalies", agent_ctx=ctx))
+    second = asyncio.run(llm_client.parse_query_to_plan("zq handshake anomalies", agent_ctx=ctx))
+    assert len(calls) == 1 and first == second
+
+def test_combined_reply_with_rejected_plan_is_not_cached(monkeypatch):
+    """✅ A combined reply whose plan fails validation returns plan=None and leaves the plan cache empty."""
+    bad_plan = {**PLAN, "time": {"from": "2026-01-01T00:00:00", "to": "2026-03-01T00:00:00"}}
+    content = json.dumps({"routing": {"pipeline": "ADVANCED_PIPELINE", "confidence": "high"}, "plan": bad_plan})
+    async def chat(**kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+    monkeypatch.setattr(llm_client.gateway, "chat", chat)
+    monkeypatch.setattr(settings, "ROUTING_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "ROUTING_FAST_CLASSIFIER", False)
+    monkeypatch.setattr(settings, "PLAN_CACHE_ENABLED", True)
+    llm_client.plan_cache.clear()
+    result = asyncio.run(llm_client.route_and_plan("zq handshake anomalies", agent_ctx={"agents": [], "version": ""}))
+    assert result["routing"]["pipeline"] == "ADVANCED_PIPELINE" and result["plan"] is None
+    assert len(llm_client.plan_cache) == 0
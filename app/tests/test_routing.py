@@ -0,0 +1,18 @@
+# app/tests/test_routing.py
+
+from app.llm_client import classify_query_locally
+
+def _route(query):
+    routing = classify_query_locally(query)
+    return routing and routing["pipeline"]
+
+def test_local_classifier_defers_ambiguous_agent_queries():
+    """✅ Only bare agent listings route locally; agents + anything else is left to GPT."""
+    assert _route("show me all agents") == "SIMPLE_PIPELINE"
+    assert _route("list registered endpoints?") == "SIMPLE_PIPELINE"
+    assert _route("list agents with critical vulnerabilities") is None
+    assert _route("which agents have vulnerabilities") is None
+    assert _route("agents with open ports") is None
+    assert _route("agents active now") is None
+    assert _route("critical alerts last 6 hours") == "ADVANCED_PIPELINE"
+    assert _route("brute force attacks") == "ADVANCED_PIPELINE"
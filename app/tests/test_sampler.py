@@ -0,0 +1,41 @@
+# app/tests/test_sampler.py
+
+from app.sampler import sample_hits, sample_items
+
+def _hit(rule_id, agent, srcip, **extra):
+    return {"_source": {"rule": {"id": rule_id, "level": 5}, "agent": {"name": agent},
+                        "data": {"srcip": srcip}, **extra}}
+
+def test_sampler_dedupes_and_diversifies():
+    """✅ Near-duplicate hits collapse to one representative; every rule is represented."""
+    hits = [_hit("5710", "web-01", "1.2.3.4") for _ in range(50)] + [_hit("5503", "db-01", "5.6.7.8")]
+    sample, report = sample_hits(hits, token_budget=2000)
+    assert report["groups"] == 2
+    assert report["documents_sent"] == 2
+    assert {doc["rule"]["id"] for doc in sample} == {"5710", "5503"}
+    assert sample[0]["duplicates"] == 49
+
+def test_sampler_projects_fields_and_respects_budget():
+    """✅ Non-allowlisted fields are dropped, long strings cut, and the budget is honoured."""
+    hits = [_hit(str(i), f"agent-{i}", "1.1.1.1", secret="x", full_log="y" * 5000) for i in range(100)]
+    sample, report = sample_hits(hits, token_budget=500)
+    assert "secret" not in sample[0]
+    assert len(sample[0]["full_log"]) < 400
+    assert report["tokens"] <= 500
+    assert 0 < report["documents_sent"] < 100
+
+def test_sample_items_budget():
+    """✅ Manager API items are trimmed to the budget in order."""
+    items = [{"id": f"{i:03d}", "name": f"agent-{i}"} for i in range(1000)]
+    sample, report = sample_items(items, token_budget=200)
+    assert sample == items[:len(sample)]
+    assert report["tokens"] <= 200
+
+def test_tokenizer_loads_lazily_and_can_be_disabled(monkeypatch):
+    """✅ No tokenizer at import; TIKTOKEN_ENABLED=false falls back to the chars/4 estimate."""
+    from app import sampler
+    from app.config import settings
+    monkeypatch.setattr(sampler, "_encoding", sampler._MISSING)
+    monkeypatch.setattr(settings, "TIKTOKEN_ENABLED", False)
+    assert sampler.count_tokens("x" * 400) == 101
+    assert sampler._encoding is None
@@ -0,0 +1,74 @@
+# app/tests/test_wazuh_client.py
+
+import asyncio
+import httpx
+from app.wazuh_client import WazuhClient
+
+class FakeManager:
+    """Wazuh API stand-in: hands out tok-1, tok-2, ... and rejects tokens listed in `revoked`."""
+    def __init__(self, auth_body=None, auth_delay=0.0):
+        self.auth_body = auth_body
+        self.auth_delay = auth_delay
+        self.logins = 0
+        self.revoked = set()
+        self.requests = []
+
+    async def __call__(self, request):
+        if request.url.path == "/security/user/authenticate":
+            self.logins += 1
+            await asyncio.sleep(self.auth_delay)
+            if self.auth_body is not None:
+                return httpx.Response(200, content=self.auth_body)
+            return httpx.Response(200, json={"data": {"token": f"tok-{self.logins}"}})
+        token = request.headers["Authorization"].removeprefix("Bearer ")
+        self.requests.append(token)
+        if token in self.revoked:
+            return httpx.Response(401, json={"title": "Unauthorized"})
+        return httpx.Response(200, json={"data": {"affected_items": [], "total_affected_items": 0}})
+
+def _client(manager):
+    client = WazuhClient("https://wazuh.test:55000", "wazuh", "secret")
+    client.client._transport = httpx.MockTransport(manager)
+    return client
+
+def test_401_refreshes_token_and_retries_once():
+    """✅ A revoked token triggers one refresh and one retry with the new token."""
+    manager = FakeManager()
+    async def run():
+        client = _client(manager)
+        await client.authenticate()
+        manager.revoked.add("tok-1")
+        response = await client._request("GET", "/agents")
+        await client.client.aclose()
+        return response, client
+    response, client = asyncio.run(run())
+    assert response.status_code == 200
+    assert manager.requests == ["tok-1", "tok-2"]
+    assert manager.logins == 2 and client.token == "tok-2"
+
+def test_concurrent_refreshes_are_coalesced():
+    """✅ Refreshes requested while one is in flight share its login request."""
+    manager = FakeManager(auth_delay=0.05)
+    async def run():
+        client = _client(manager)
+        tokens = await asyncio.gather(*(client.tokens.refresh() for _ in range(5)))
+        await client.client.aclose()
+        return tokens, client.tokens.stats()
+    tokens, stats = asyncio.run(run())
+    assert tokens == ["tok-1"] * 5
+    assert manager.logins == 1
+    assert stats["refreshes"] == 1 and stats["coalesced"] == 4
+
+def test_bad_auth_response_counts_as_failed_login():
+    """✅ A 200 without a token (or not JSON at all) is a failed login, not a crash."""
+    for body in (b'{"data": {}}', b"<html>maintenance</html>"):
+        manager = FakeManager(auth_body=body)
+        async def run():
+            client = _client(manager)
+            token = await client.tokens.refresh()
+            await client.client.aclose()
+            return token, client.tokens.stats()
+        token, stats = asyncio.run(run())
+        assert token is None
+        assert stats["authenticated"] is False
+        assert stats["failures"] == 1 and stats["refreshes"] == 0
@@ -1,12 +1,5 @@
-# naive mapping: if field is in FIELD_TYPES and type is keyword/text decide .keyword
-from .validators import FIELD_TYPES
+from .field_registry import field_registry
 
 def field_to_term_field(field: str) -> str:
-    ftype = FIELD_TYPES.get(field)
-    if ftype == "keyword":
-        return field  # already keyword
-    if ftype == "text":
-        return f"{field}.keyword"
-    return field
-
-
+    """Term-level field for `field`: the mapped keyword sub-field of text fields, else the field itself."""
+    return field_registry.term_field(field)
@@ -2,42 +2,8 @@ from datetime import datetime, timedelta
 from typing import List
 from .config import settings
 from .schemas import FilterItem
+from .field_registry import field_registry
 
-# simple field->type mapping (in a real deploy populate using index mappings)
-FIELD_TYPES = {
-    # Rule fields
-    "rule.id": "keyword",
-    "rule.level": "integer",
-    "rule.description": "text",
-    "rule.mitre.technique": "keyword",
-    "rule.mitre.tactic": "keyword",
-    # Agent fields
-    "agent.name": "keyword",
-    "agent.id": "keyword",
-    "agent.ip": "ip",
-    "agent.os.platform": "keyword",
-    # Data fields
-    "data.srcip": "ip",
-    "data.dstip": "ip",
-    "data.srcuser": "keyword",
-    "data.dstuser": "keyword",
-    "data.srcport": "integer",
-    "data.dstport": "integer",
-    "data.protocol": "keyword",
-    "data.win.eventdata.targetUserName": "keyword",
-    "data.win.system.eventID": "keyword",
-    "data.win.system.channel": "keyword",
-    # Decoder fields
-    "decoder.name": "keyword",
-    "decoder.parent": "keyword",
-    # Other fields
-    "@timestamp": "date",
-    "timestamp": "date",
-    "location": "keyword",
-    "full_log": "text",
-    "manager.name": "keyword",
-    "vulnerability.severity": "keyword",
-}
 def is_index_allowed(indices: str) -> bool:
     # simple wildcard match
     return any(indices.startswith(allowed.rstrip("*")) for allowed in settings.INDEX_ALLOWLIST)
@@ -46,13 +12,12 @@ def field_allowed(field: str) -> bool:
     return field in settings.FIELD_ALLOWLIST
 
 def op_allowed_on_field(op: str, field: str) -> bool:
-    ftype = FIELD_TYPES.get(field)
-    if not ftype:
+    if not field_registry.is_known(field):
         return False
-    if op in ("gt","gte","lt","lte") and ftype not in ("integer","date","float"):
+    if op in ("gt","gte","lt","lte") and not field_registry.supports_range(field):
         return False
-    if op in ("eq","in") and ftype == "text":
-        # require .keyword in builder instead
+    if op in ("eq","in") and not field_registry.supports_exact(field):
+        # text field without a keyword sub-field - use "contains"
         return False
     return True
 
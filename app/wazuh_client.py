@@ -1,16 +1,67 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+import asyncio
+import base64
 import httpx
 import json
+import time
+from app.config import settings
+from app.http_transport import create_async_client
 
-class WazuhClient:
-    def __init__(self, wazuh_url, username, password, timeout=60):
-        self.wazuh_url = wazuh_url.rstrip('/')
+# Fields the agent registry uses from GET /agents (passed as `select` by the registry only;
+# the public agent endpoints return every field)
+AGENT_FIELDS = ("id", "name", "ip", "status", "os.name", "os.platform", "version", "lastKeepAlive")
+
+
+def decode_jwt_exp(token: str) -> Optional[float]:
+    """Read the `exp` claim (epoch seconds) from a JWT without verifying it."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """
+    Owns the Wazuh API JWT for every client that shares it.
+
+    - Expiry is read from the token's `exp` claim (WAZUH_TOKEN_DEFAULT_LIFETIME if absent)
+    - A background task refreshes WAZUH_TOKEN_REFRESH_MARGIN seconds before expiry
+    - Concurrent refreshes (startup, 401 retries, expiry) are coalesced into one request
+    """
+    def __init__(self, wazuh_url: str, username: str, password: str, client: httpx.AsyncClient):
+        self.wazuh_url = wazuh_url
         self.username = username
         self.password = password
-        self.token = None
-        self.timeout = timeout
-        self.client = httpx.AsyncClient(verify=False, timeout=timeout)
+        self.client = client
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._metrics = {"refreshes": 0, "failures": 0, "coalesced": 0}
 
-    async def authenticate(self):
+    def expires_in(self) -> float:
+        return self.expires_at - time.time()
+
+    def needs_refresh(self) -> bool:
+        return self.token is None or self.expires_in() <= settings.WAZUH_TOKEN_REFRESH_MARGIN
+
+    async def get_token(self) -> Optional[str]:
+        """Current token, refreshing first if it is missing or about to expire."""
+        if self.needs_refresh():
+            await self.refresh()
+        return self.token
+
+    async def refresh(self) -> Optional[str]:
+        """Request a new token, joining a refresh that is already in flight."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._authenticate())
+        else:
+            self._metrics["coalesced"] += 1
+        return await asyncio.shield(self._refresh_task)
+
+    async def _authenticate(self) -> Optional[str]:
         url = f"{self.wazuh_url}/security/user/authenticate"
         print(f"[*] Connecting to Wazuh API: {url}")
         try:
@@ -20,41 +71,164 @@ class WazuhClient:
             )
             response.raise_for_status()
             data = response.json()
-            self.token = data.get("data", {}).get("token")
-            print(f"[+] Authentication successful. Token: {self.token[:20]}...")
-        except httpx.HTTPError as e: 
+            token = (data.get("data") or {}).get("token") if isinstance(data, dict) else None
+            if not isinstance(token, str) or not token:
+                raise ValueError("no token in authentication response")
+            self.token = token
+            self.expires_at = decode_jwt_exp(self.token) or time.time() + settings.WAZUH_TOKEN_DEFAULT_LIFETIME
+            self._metrics["refreshes"] += 1
+            print(f"[+] Authentication successful. Token: {self.token[:20]}... (expires in {self.expires_in():.0f}s)")
+        except (httpx.HTTPError, ValueError, AttributeError) as e:
+            # ValueError: non-JSON body or missing token - a failed login, keep the previous token
+            self._metrics["failures"] += 1
             print(f"[!] Wazuh API connection failed: {e}")
-            return
+        return self.token
+
+    def start(self):
+        """Start proactive background refresh (called from startup_event)."""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                if self.needs_refresh():
+                    await self.refresh()
+            except Exception as e:
+                # never let one bad refresh end proactive renewal; retry on the short interval
+                self._metrics["failures"] += 1
+                print(f"[!] Wazuh token refresh failed: {e}")
+                await asyncio.sleep(settings.WAZUH_TOKEN_RETRY_INTERVAL)
+                continue
+            if self.token is None:
+                delay = settings.WAZUH_TOKEN_RETRY_INTERVAL
+            else:
+                delay = max(self.expires_in() - settings.WAZUH_TOKEN_REFRESH_MARGIN, 1.0)
+            await asyncio.sleep(delay)
+
+    async def stop(self):
+        for task in (self._loop_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._loop_task = None
+        self._refresh_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "authenticated": self.token is not None,
+            "expires_in": round(self.expires_in(), 1) if self.token else None,
+            **self._metrics,
+        }
+
+
+class WazuhClient:
+    """
+    Wazuh Manager API client. Instances created with `shared_with=` reuse the other
+    client's connection pool and TokenManager (one login, one pool for the whole server).
+    """
+    def __init__(self, wazuh_url, username, password, timeout=60, shared_with: Optional["WazuhClient"] = None):
+        self.wazuh_url = wazuh_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        if shared_with is not None:
+            self.client = shared_with.client
+            self.tokens = shared_with.tokens
+            self.owns_client = False
+        else:
+            self.client = create_async_client(
+                "wazuh_api",
+                max_connections=settings.WAZUH_API_POOL_MAX_CONNECTIONS,
+                max_keepalive=settings.WAZUH_API_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=settings.WAZUH_API_KEEPALIVE_EXPIRY,
+                timeout=httpx.Timeout(timeout),
+            )
+            self.tokens = TokenManager(self.wazuh_url, username, password, self.client)
+            self.owns_client = True
+
+    @property
+    def token(self) -> Optional[str]:
+        return self.tokens.token
+
+    async def authenticate(self):
+        await self.tokens.refresh()
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Authenticated request. A 401 means the token was revoked or expired early:
+        refresh once (coalesced with any other refresh) and retry.
+        """
+        url = f"{self.wazuh_url}{path}"
+        token = await self.tokens.get_token()
+        response = await self.client.request(method, url, headers={"Authorization": f"Bearer {token}"}, **kwargs)
+        if response.status_code == 401:
+            # Another request may already have replaced the rejected token
+            token = self.tokens.token if self.tokens.token != token else await self.tokens.refresh()
+            response = await self.client.request(method, url, headers={"Authorization": f"Bearer {token}"}, **kwargs)
+        response.raise_for_status()
+        return response
+
+    async def _get_agents_page(self, offset: int, limit: int, status: Optional[str] = None,
+                               select: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """Fetch one page of GET /agents; returns the API's data object (affected_items, total_affected_items)."""
+        params = {"offset": offset, "limit": limit, "sort": "+id"}
+        if status:
+            params["status"] = status
+        if select:
+            params["select"] = ",".join(select)
+        response = await self._request("GET", "/agents", params=params)
+        return response.json().get("data", {})
+
+    async def iter_agents(self, status: Optional[str] = None, select: Optional[Sequence[str]] = None,
+                          page_size: Optional[int] = None,
+                          max_concurrency: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield the agent inventory page by page, in ID order.
+
+        The first page tells us the total; the remaining pages are fetched up to
+        `max_concurrency` at a time, so only a window of pages is held in memory.
+        `status` is filtered server-side; `select` limits the returned fields (None = all).
+        """
+        page_size = page_size or settings.WAZUH_AGENTS_PAGE_SIZE
+        max_concurrency = max_concurrency or settings.WAZUH_AGENTS_PAGE_CONCURRENCY
 
-    async def get_agents(self):
-        if not self.token:
-            await self.authenticate()
-        url = f"{self.wazuh_url}/agents"
-        headers = {"Authorization": f"Bearer {self.token}"}
+        first = await self._get_agents_page(0, page_size, status, select)
+        yield first.get("affected_items", [])
+        total = first.get("total_affected_items", 0)
+
+        offsets = list(range(page_size, total, page_size))
+        for start in range(0, len(offsets), max_concurrency):
+            window = offsets[start:start + max_concurrency]
+            pages = await asyncio.gather(*(
+                self._get_agents_page(offset, page_size, status, select) for offset in window
+            ))
+            for page in pages:
+                yield page.get("affected_items", [])
+
+    async def get_agents(self, status: Optional[str] = None, select: Optional[Sequence[str]] = None):
+        """All agents (optionally filtered by status), collected from iter_agents. `select` = fields, None = all."""
+        agents = []
         try:
-            response = await self.client.get(url, headers=headers)
-            response.raise_for_status()
-            agents = response.json().get("data", {}).get("affected_items", [])
+            async for page in self.iter_agents(status=status, select=select):
+                agents.extend(page)
             return {"total": len(agents), "agents": agents}
-        except httpx.HTTPError as e:
+        except (httpx.HTTPError, ValueError) as e:  # ValueError: response body is not JSON
             print(f"[!] Failed to get agents: {e}")
             return {"total": 0, "agents": []}
 
     async def get_alerts(self, agent_id=None, severity=None, limit=5):
-        if not self.token:
-            await self.authenticate()
-        
         params = {"limit": limit}
         if agent_id:
             params["agent_id"] = agent_id
         if severity:
             params["rule.level"] = severity
         
-        url = f"{self.wazuh_url}/alerts"
-        headers = {"Authorization": f"Bearer {self.token}"}
         try:
-            response = await self.client.get(url, headers=headers, params=params)
-            response.raise_for_status()
+            response = await self._request("GET", "/alerts", params=params)
             alerts = response.json().get("data", {}).get("affected_items", [])
             return {"total": len(alerts), "alerts": alerts}
         except httpx.HTTPError as e:
@@ -63,13 +237,8 @@ class WazuhClient:
 
     async def restart_manager(self):
         """Restart the Wazuh manager"""
-        if not self.token:
-            await self.authenticate()
-        url = f"{self.wazuh_url}/manager/restart"
-        headers = {"Authorization": f"Bearer {self.token}"}
         try:
-            response = await self.client.put(url, headers=headers)
-            response.raise_for_status()
+            await self._request("PUT", "/manager/restart")
             print("[+] Manager restart initiated successfully")
             return True
         except httpx.HTTPError as e:
@@ -78,13 +247,8 @@ class WazuhClient:
 
     async def check_api(self):
         """Check if Wazuh API is accessible"""
-        if not self.token:
-            await self.authenticate()
-        url = f"{self.wazuh_url}/?pretty=true"
-        headers = {"Authorization": f"Bearer {self.token}"}
         try:
-            response = await self.client.get(url, headers=headers)
-            response.raise_for_status()
+            await self._request("GET", "/", params={"pretty": "true"})
             return True
         except httpx.HTTPError as e:
             print(f"[!] API check failed: {e}")
@@ -95,19 +259,15 @@ class WazuhClient:
         # Note: This checks the indexer via the Wazuh API
         # The actual indexer health is checked through OpenSearch client in es_client.py
         try:
-            if not self.token:
-                await self.authenticate()
             # Check if we can reach any indexer-related endpoint
-            url = f"{self.wazuh_url}/manager/info"
-            headers = {"Authorization": f"Bearer {self.token}"}
-            response = await self.client.get(url, headers=headers)
-            response.raise_for_status()
+            await self._request("GET", "/manager/info")
             return True
         except Exception as e:
             print(f"[!] Indexer check failed: {e}")
             return False
     
     async def close(self):
-        """Close the httpx client"""
-        await self.client.aclose()
-
+        """Close the httpx client (shared clients leave the pool to their owner)"""
+        if self.owns_client:
+            await self.tokens.stop()
+            await self.client.aclose()
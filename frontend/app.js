@@ -3,6 +3,9 @@ const API_BASE_URL = window.location.hostname === 'localhost' && window.location
     ? 'http://localhost:8000'  // Local development
     : '/api';                   // Docker/Production (proxied by Nginx)
 
+// Ask for each payload once (no raw_results/formatted_response copies) and flat hit documents
+const RESPONSE_PROFILE = 'profile=lean&hits_only=true';
+
 // State
 let currentPipeline = 'nl';
 let lastQueryResult = null;
@@ -204,12 +207,12 @@ async function executeQuery() {
                 throw new Error('Please enter a query');
             }
 
-            response = await fetch(`${API_BASE_URL}/query/nl`, {
+            response = await fetch(`${API_BASE_URL}/query/nl?${RESPONSE_PROFILE}`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ query }),
+                body: JSON.stringify({ query, stream: true }),
             });
 
         } else if (currentPipeline === 'dsl') {
@@ -226,28 +229,49 @@ async function executeQuery() {
                 throw new Error('Invalid JSON in DSL query');
             }
 
-            response = await fetch(`${API_BASE_URL}/query/dsl`, {
+            response = await fetch(`${API_BASE_URL}/query/dsl?${RESPONSE_PROFILE}`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify(dslObj),
+                body: JSON.stringify({ ...dslObj, stream: true }),
             });
         }
 
-        const endTime = Date.now();
-        const executionTimeMs = endTime - startTime;
-
         if (!response.ok) {
             const errorData = await response.json();
-            throw new Error(errorData.error || `HTTP ${response.status}`);
+            throw new Error(errorData.detail || errorData.error || `HTTP ${response.status}`);
         }
 
-        const result = await response.json();
+        // Render incrementally: results as soon as they arrive, then summary tokens
+        const result = {};
+        let summaryText = '';
         lastQueryResult = result;
 
-        // Display results
-        displayResults(result, executionTimeMs);
+        await readEventStream(response, (event, data) => {
+            if (event === 'error') {
+                throw new Error(data.detail || `HTTP ${data.status}`);
+            } else if (event === 'results') {
+                Object.assign(result, data);
+                displayResults(result, Date.now() - startTime);
+                showSummaryPlaceholder();
+            } else if (event === 'summary') {
+                summaryText += data.delta;
+                result.summary = summaryText;
+                nlResponse.classList.remove('hidden');
+                nlResponse.style.display = 'block';
+                nlResponseText.innerHTML = markdownToHtml(summaryText);
+            } else if (event === 'done') {
+                result.timings = data.timings;
+                displayTimings(data.timings);
+                if (!summaryText) {
+                    nlResponse.style.display = 'none';
+                }
+            } else if (event !== 'cache') {
+                // routing / plan
+                Object.assign(result, data);
+            }
+        });
 
     } catch (error) {
         console.error('Query error:', error);
@@ -267,6 +291,50 @@ async function executeQuery() {
     }
 }
 
+// Read an NDJSON event stream ({"event": ..., "data": ...} per line)
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (line) {
+                const message = JSON.parse(line);
+                onEvent(message.event, message.data);
+            }
+        }
+    }
+    if (buffer.trim()) {
+        const message = JSON.parse(buffer);
+        onEvent(message.event, message.data);
+    }
+}
+
+// Show a placeholder while summary tokens are still streaming
+function showSummaryPlaceholder() {
+    nlResponse.classList.remove('hidden');
+    nlResponse.style.display = 'block';
+    nlResponseText.innerHTML = '<em>Generating summary…</em>';
+}
+
+// Show server-side time-to-first-byte / first summary token / total
+function displayTimings(timings) {
+    if (!timings) return;
+    const parts = [];
+    if (timings.first_byte_ms !== undefined) parts.push(`TTFB ${Math.round(timings.first_byte_ms)}ms`);
+    if (timings.first_token_ms !== undefined) parts.push(`first token ${Math.round(timings.first_token_ms)}ms`);
+    parts.push(`total ${Math.round(timings.total_ms)}ms`);
+    executionTime.textContent = parts.join(' · ');
+}
+
 // Display results
 function displayResults(result, executionTimeMs) {
     console.log('Displaying results:', result);
@@ -409,13 +477,16 @@ function displayResults(result, executionTimeMs) {
         nlResponse.style.display = 'none';
     }
 
-    // Formatted data
-    if (result.raw_data) {
+    // Formatted data (hits_only responses carry flat documents in result.hits)
+    if (result.hits) {
+        formattedData.innerHTML = displayFormattedData(result.hits);
+    } else if (result.raw_data) {
         formattedData.innerHTML = displayFormattedData(result.raw_data);
     }
 
     // Raw JSON
-    rawData.innerHTML = `<pre>${JSON.stringify(result.raw_data, null, 2)}</pre>`;
+    const rawPayload = result.raw_data ?? { hits: result.hits, aggregations: result.aggregations };
+    rawData.innerHTML = `<pre>${JSON.stringify(rawPayload, null, 2)}</pre>`;
 
     // DSL Query (if available)
     if (result.dsl) {
@@ -429,6 +500,27 @@ function displayResults(result, executionTimeMs) {
 }
 
 // Display formatted data
+function renderAlertCard(alert) {
+    return `
+        <div class="alert-card">
+            <div class="alert-header">
+                <span class="timestamp">${alert.timestamp || alert['@timestamp'] || 'N/A'}</span>
+                <span class="level-badge level-${alert.rule?.level >= 12 ? 'critical' : alert.rule?.level >= 8 ? 'high' : 'medium'}">
+                    Level ${alert.rule?.level || 'N/A'}
+                </span>
+            </div>
+            <div class="alert-rule">
+                <strong>${alert.rule?.description || 'Unknown rule'}</strong>
+            </div>
+            <div class="alert-details">
+                ${alert.agent?.name ? `<div><strong>Agent:</strong> ${alert.agent.name}</div>` : ''}
+                ${alert.data?.srcip ? `<div><strong>Source IP:</strong> ${alert.data.srcip}</div>` : ''}
+                ${alert.data?.dstip ? `<div><strong>Dest IP:</strong> ${alert.data.dstip}</div>` : ''}
+            </div>
+        </div>
+    `;
+}
+
 function displayFormattedData(rawData) {
     let html = '';
 
@@ -456,32 +548,11 @@ function displayFormattedData(rawData) {
     }
     // Handle Indexer response (alerts/logs)
     else if (rawData.hits?.hits) {
-        const hits = rawData.hits.hits;
-        html = `
-            <div class="alert-list">
-                ${hits.map(hit => {
-                    const alert = hit._source;
-                    return `
-                        <div class="alert-card">
-                            <div class="alert-header">
-                                <span class="timestamp">${alert.timestamp || alert['@timestamp'] || 'N/A'}</span>
-                                <span class="level-badge level-${alert.rule?.level >= 12 ? 'critical' : alert.rule?.level >= 8 ? 'high' : 'medium'}">
-                                    Level ${alert.rule?.level || 'N/A'}
-                                </span>
-                            </div>
-                            <div class="alert-rule">
-                                <strong>${alert.rule?.description || 'Unknown rule'}</strong>
-                            </div>
-                            <div class="alert-details">
-                                ${alert.agent?.name ? `<div><strong>Agent:</strong> ${alert.agent.name}</div>` : ''}
-                                ${alert.data?.srcip ? `<div><strong>Source IP:</strong> ${alert.data.srcip}</div>` : ''}
-                                ${alert.data?.dstip ? `<div><strong>Dest IP:</strong> ${alert.data.dstip}</div>` : ''}
-                            </div>
-                        </div>
-                    `;
-                }).join('')}
-            </div>
-        `;
+        html = `<div class="alert-list">${rawData.hits.hits.map(hit => renderAlertCard(hit._source)).join('')}</div>`;
+    }
+    // Handle hits_only response (flat documents)
+    else if (Array.isArray(rawData)) {
+        html = `<div class="alert-list">${rawData.map(renderAlertCard).join('')}</div>`;
     }
     else {
         html = '<div class="no-data">No formatted data available</div>';
@@ -6,10 +6,11 @@ from mcp.schemas import (
     HealthStatus,
 )
 from app.wazuh_client import WazuhClient
-from app.llm_client import parse_natural_language_query, format_wazuh_response
+from app.llm_client import parse_natural_language_query, format_wazuh_response, format_results
 from app.dsl_builder import build_dsl
 from app.schemas import WazuhSearchPlan
-from app.es_client import execute_query
+from app.config import settings
+from app.es_client import execute_query, cached_msearch, split_batch_queries
 from app.validators import is_index_allowed, validate_filters, enforce_time_window
 
 class MCPHandlers:
@@ -17,8 +18,10 @@ class MCPHandlers:
     Responsible for executing all MCP-visible tools.
     Clean separation between tools.json and implementation logic.
     """
-    def __init__(self, wazuh_url: str, username: str, password: str, timeout: int = 60):
-        self.client = WazuhClient(wazuh_url, username, password, timeout)
+    def __init__(self, wazuh_url: str, username: str, password: str, timeout: int = 60,
+                 client: Optional[WazuhClient] = None):
+        # Reuse the server's client (connection pool + token) when one is given
+        self.client = WazuhClient(wazuh_url, username, password, timeout, shared_with=client)
     # -------------------------------------------------------------
     # 🔥 FETCH ALERTS
     # -------------------------------------------------------------
@@ -70,7 +73,7 @@ class MCPHandlers:
         
         try:
             # Step 1: Parse natural language to WazuhSearchPlan structure
-            parsed = parse_natural_language_query(query)
+            parsed = await parse_natural_language_query(query)
             
             # Step 2: Create WazuhSearchPlan
             try:
@@ -91,13 +94,13 @@ class MCPHandlers:
                 return {"error": f"Invalid filters: {str(e)}"}
             
             # Step 4: Build DSL from plan
-            dsl = build_dsl(plan)
+            dsl = build_dsl(plan, summary_aggs=settings.SUMMARY_AGGREGATIONS)
             
             # Step 5: Execute query against Wazuh Indexer
-            raw_data = execute_query(plan.indices, dsl)
+            raw_data = await execute_query(plan.indices, dsl)
             
             # Step 6: Format response to natural language
-            natural_response = format_wazuh_response(raw_data, query)
+            natural_response = await format_wazuh_response(raw_data, query)
             
             return {
                 "query": query,
@@ -134,7 +137,7 @@ class MCPHandlers:
             
             raw_data = await self.client.get_alerts(severity=severity, limit=limit)
         
-        natural_response = format_wazuh_response(raw_data, query)
+        natural_response = await format_wazuh_response(raw_data, query)
         
         return {
             "query": query,
@@ -142,6 +145,32 @@ class MCPHandlers:
             "response": natural_response
         }
     
+    # -------------------------------------------------------------
+    # 🔥 BATCH DSL QUERY (one _msearch round trip)
+    # -------------------------------------------------------------
+    async def wazuh_dsl_batch(self, params: Dict[str, Any]):
+        """
+        Run several DSL queries in one _msearch request; optional single combined summary.
+        """
+        try:
+            queries = split_batch_queries(params.get("queries") or [])
+        except ValueError as e:
+            return {"error": str(e)}
+        
+        try:
+            responses, _ = await cached_msearch([(index, body) for _, index, body in queries])
+        except Exception as e:
+            return {"error": f"Query failed: {str(e)}"}
+        
+        results = [{"name": name, "index": index, "raw_data": raw}
+                   for (name, index, _), raw in zip(queries, responses)]
+        response = None
+        if params.get("include_summary"):
+            context = "Batch of DSL queries: " + ", ".join(name for name, _, _ in queries)
+            response = await format_results(context, {"responses": [{"name": r["name"], **r["raw_data"]} for r in results]})
+        
+        return {"results": results, "response": response}
+    
     async def close(self):
         """Cleanup resources"""
         await self.client.close()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Serialization benchmark: response encoding and LLM prompt building for 10/200/1000-hit
+indexer responses, before (FastAPI JSONResponse / json.dumps indent=2) and after
+(ORJSONResponse / compact prompt_json).
+
+Run from the repo root: python tests/benchmark_serialization.py
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder
+from app.serialization import HAS_ORJSON, dumps, prompt_json
+
+REPEAT = 20
+
+
+def make_response(hits: int) -> dict:
+    """Synthetic Wazuh alert search response (~2 KB per hit, like a typical sshd alert)."""
+    return {
+        "took": 12,
+        "timed_out": False,
+        "hits": {
+            "total": {"value": hits, "relation": "eq"},
+            "hits": [
+                {
+                    "_index": "wazuh-alerts-4.x-2025.11.05",
+                    "_id": f"alert-{i}",
+                    "_score": None,
+                    "_source": {
+                        "@timestamp": "2025-11-05T10:15:%02d.000Z" % (i % 60),
+                        "timestamp": "2025-11-05T10:15:%02d.000+0000" % (i % 60),
+                        "rule": {
+                            "id": str(5710 + i % 7),
+                            "level": 5 + i % 8,
+                            "description": "sshd: Attempt to login using a non-existent user",
+                            "groups": ["syslog", "sshd", "authentication_failed", "invalid_login"],
+                            "mitre": {"id": ["T1110.001"], "tactic": ["Credential Access"],
+                                      "technique": ["Password Guessing"]},
+                            "firedtimes": i,
+                        },
+                        "agent": {"id": "%03d" % (i % 40), "name": f"web-{i % 40:02d}", "ip": f"10.0.{i % 4}.{i % 250}"},
+                        "manager": {"name": "wazuh-manager"},
+                        "data": {"srcip": f"203.0.113.{i % 255}", "srcport": str(40000 + i), "srcuser": "admin"},
+                        "decoder": {"name": "sshd", "parent": "sshd"},
+                        "location": "/var/log/auth.log",
+                        "full_log": ("Nov  5 10:15:01 web-01 sshd[12345]: Invalid user admin from "
+                                     f"203.0.113.{i % 255} port {40000 + i} ") * 8,
+                    },
+                }
+                for i in range(hits)
+            ],
+        },
+    }
+
+
+def timed(func, payload):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        out = func(payload)
+    return (time.perf_counter() - start) / REPEAT * 1000, len(out)
+
+
+def stdlib_response(payload):
+    # What JSONResponse did: jsonable_encoder walk, then json.dumps
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode()
+
+
+def pretty_prompt(payload):
+    return json.dumps(payload, indent=2, default=str)
+
+
+def main():
+    print(f"orjson installed: {HAS_ORJSON} (without it the 'after' columns use the stdlib fallback)\n")
+    header = f"{'hits':>5} | {'response before':>18} | {'response after':>18} | {'prompt before':>20} | {'prompt after':>20}"
+    print(header)
+    print("-" * len(header))
+    for hits in (10, 200, 1000):
+        payload = make_response(hits)
+        rb_ms, rb_bytes = timed(stdlib_response, payload)
+        ra_ms, ra_bytes = timed(dumps, payload)
+        pb_ms, pb_bytes = timed(pretty_prompt, payload)
+        pa_ms, pa_bytes = timed(prompt_json, payload)
+        print(f"{hits:>5} | {rb_ms:7.2f} ms {rb_bytes / 1024:6.0f} KB | {ra_ms:7.2f} ms {ra_bytes / 1024:6.0f} KB | "
+              f"{pb_ms:7.2f} ms {pb_bytes / 1024:8.0f} KB | {pa_ms:7.2f} ms {pa_bytes / 1024:8.0f} KB")
+
+
+if __name__ == "__main__":
+    main()